@@ -1,9 +1,31 @@
 import streamlit as st
+from streamlit.runtime.scriptrunner import add_script_run_ctx, get_script_run_ctx
 import mysql.connector
-from mysql.connector import pooling
+from mysql.connector import FieldType, errorcode, pooling
 import pandas as pd
-from datetime import datetime
+import numpy as np
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+try:
+    import duckdb
+except ImportError:  # 分析镜像为可选功能
+    duckdb = None
+from datetime import date, datetime, timedelta
+import csv
+import json
 import os
+import re
+import sys
+import tempfile
+import threading
+import time
+from array import array
+from collections import Counter, OrderedDict, deque
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from contextlib import contextmanager
+from dataclasses import asdict, dataclass, field
+from functools import wraps
 from dotenv import load_dotenv
 
 # Load environment variables
@@ -17,45 +39,515 @@ st.set_page_config(
 )
 
 # 数据库连接池配置
+DB_POOL_MIN_SIZE = int(os.getenv("DB_POOL_MIN_SIZE", "2"))
+DB_POOL_MAX_SIZE = int(os.getenv("DB_POOL_MAX_SIZE", "10"))
+DB_POOL_TIMEOUT = float(os.getenv("DB_POOL_TIMEOUT", "10"))
+DB_POOL_MAX_WAITERS = int(os.getenv("DB_POOL_MAX_WAITERS", "20"))
+DB_POOL_SESSION_IDLE_SECONDS = int(os.getenv("DB_POOL_SESSION_IDLE_SECONDS", "300"))
+
+class PooledConnection:
+    """连接池借出的连接：close() 归还连接池而不是断开"""
+
+    def __init__(self, pool, connection, wait_seconds=0.0):
+        self._pool = pool
+        self._connection = connection
+        self._released = False
+        self.wait_seconds = wait_seconds
+
+    def __getattr__(self, name):
+        return getattr(self._connection, name)
+
+    def close(self):
+        if not self._released:
+            self._released = True
+            self._pool.release(self._connection)
+
+class RequestConnection:
+    """一次页面渲染内复用的连接：close() 不归还，渲染结束时统一归还"""
+
+    def __init__(self, connection):
+        self._connection = connection
+
+    def __getattr__(self, name):
+        return getattr(self._connection, name)
+
+    def close(self):
+        pass
+
+class AdminConnectionPool:
+    """带等待队列和指标的数据库连接池
+
+    - 借出时连接不足则在有界队列中等待，超时抛出 PoolError
+    - 归还时重置会话（等同 pool_reset_session=True）
+    - 连接数上限随活跃管理员会话数在 [min_size, max_size] 之间调整，连接按需创建
+    - 并发查询组可临时借用额外的连接数（burst），总数不超过 max_size
+    """
+
+    def __init__(self, dbconfig, min_size=DB_POOL_MIN_SIZE, max_size=DB_POOL_MAX_SIZE,
+                 timeout=DB_POOL_TIMEOUT, max_waiters=DB_POOL_MAX_WAITERS):
+        self.dbconfig = dbconfig
+        self.min_size = min_size
+        self.max_size = max_size
+        self.timeout = timeout
+        self.max_waiters = max_waiters
+        self.limit = min_size
+        self._base_limit = min_size
+        self._burst = 0
+        self._idle = []
+        self._size = 0
+        self._in_use = 0
+        self._waiters = 0
+        self._sessions = {}  # admin session id -> last seen
+        self._cond = threading.Condition()
+        self.metrics = Counter()
+        self.max_wait = 0.0
+
+    def touch_session(self, session_id):
+        """记录活跃的管理员会话，并据此调整连接数上限"""
+        now = time.monotonic()
+        with self._cond:
+            self._sessions[session_id] = now
+            cutoff = now - DB_POOL_SESSION_IDLE_SECONDS
+            for sid in [sid for sid, seen in self._sessions.items() if seen < cutoff]:
+                del self._sessions[sid]
+            self._base_limit = max(self.min_size, min(self.max_size, len(self._sessions) + 1))
+            self._update_limit()
+
+    def _update_limit(self):
+        """按会话数和临时借用重新计算上限（需持有锁）"""
+        self.limit = min(self.max_size, self._base_limit + self._burst)
+        self._trim_idle()
+        self._cond.notify_all()
+
+    @contextmanager
+    def burst(self, extra):
+        """临时把上限提高最多 extra 个连接，返回实际借到的数量；退出时归还"""
+        with self._cond:
+            granted = max(0, min(extra, self.max_size - self._base_limit - self._burst))
+            self._burst += granted
+            self._update_limit()
+        try:
+            yield granted
+        finally:
+            with self._cond:
+                self._burst -= granted
+                self._update_limit()
+
+    def _trim_idle(self):
+        """关闭超出上限的空闲连接（需持有锁）"""
+        while self._idle and self._size > self.limit:
+            self._close_quietly(self._idle.pop(0))
+            self._size -= 1
+
+    @staticmethod
+    def _close_quietly(connection):
+        try:
+            connection.close()
+        except mysql.connector.Error:
+            pass
+
+    def get_connection(self, timeout=None):
+        timeout = self.timeout if timeout is None else timeout
+        start = time.monotonic()
+        deadline = start + timeout
+        with self._cond:
+            if not self._idle and self._size >= self.limit and self._waiters >= self.max_waiters:
+                self.metrics["rejected"] += 1
+                raise pooling.PoolError("数据库连接池等待队列已满")
+            self._waiters += 1
+            try:
+                while not self._idle and self._size >= self.limit:
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        self.metrics["timeouts"] += 1
+                        raise pooling.PoolError(f"等待数据库连接超时（{timeout:.0f} 秒）")
+                    self._cond.wait(remaining)
+            finally:
+                self._waiters -= 1
+            connection = self._idle.pop() if self._idle else None
+            if connection is None:
+                self._size += 1
+            self._in_use += 1
+            wait = time.monotonic() - start
+            self.metrics["checkouts"] += 1
+            self.metrics["wait_seconds"] += wait
+            self.max_wait = max(self.max_wait, wait)
+        
+        try:
+            if connection is None:
+                connection = mysql.connector.connect(**self.dbconfig)
+                self.metrics["connects"] += 1
+            elif not connection.is_connected():
+                connection.reconnect(attempts=3, delay=1)
+                self.metrics["reconnects"] += 1
+        except mysql.connector.Error:
+            with self._cond:
+                self._size -= 1
+                self._in_use -= 1
+                self._cond.notify()
+            raise
+        return PooledConnection(self, connection, wait)
+
+    def release(self, connection):
+        healthy = True
+        try:
+            if connection.is_connected():
+                connection.reset_session()
+                self.metrics["resets"] += 1
+            else:
+                healthy = False
+        except mysql.connector.Error:
+            healthy = False
+        with self._cond:
+            self._in_use -= 1
+            if healthy and self._size <= self.limit:
+                self._idle.append(connection)
+            else:
+                self._close_quietly(connection)
+                self._size -= 1
+            self._cond.notify()
+
+    def stats(self):
+        with self._cond:
+            checkouts = self.metrics["checkouts"]
+            return {
+                "limit": self.limit,
+                "burst": self._burst,
+                "open": self._size,
+                "in_use": self._in_use,
+                "idle": len(self._idle),
+                "waiting": self._waiters,
+                "active_sessions": len(self._sessions),
+                "checkouts": checkouts,
+                "avg_wait_ms": self.metrics["wait_seconds"] / checkouts * 1000 if checkouts else 0.0,
+                "max_wait_ms": self.max_wait * 1000,
+                "connects": self.metrics["connects"],
+                "resets": self.metrics["resets"],
+                "reconnects": self.metrics["reconnects"],
+                "timeouts": self.metrics["timeouts"],
+                "rejected": self.metrics["rejected"],
+            }
+
 @st.cache_resource
 def init_connection_pool():
-    """初始化数据库连接池"""
+    """初始化数据库连接池（连接按需创建）"""
+    dbconfig = {
+        "host": os.getenv("DB_HOST", "tramway.proxy.rlwy.net"),
+        "port": int(os.getenv("DB_PORT", "53965")),
+        "user": os.getenv("DB_USER", "root"),
+        "password": os.getenv("DB_PASSWORD", "aesZPoeaQuNokWDVsNWPXrxtmnVuOLgF"),
+        "database": os.getenv("DB_NAME", "railway"),
+    }
+    return AdminConnectionPool(dbconfig)
+
+_request_state = threading.local()
+
+@contextmanager
+def request_connection_scope():
+    """在一次页面渲染内复用同一个数据库连接（首次查询时才借出）
+
+    可以嵌套：片段单独重跑时自己开启作用域，整页渲染时沿用外层的连接。
+    """
+    if getattr(_request_state, "active", False):
+        yield
+        return
+    _request_state.active = True
+    _request_state.connection = None
     try:
-        dbconfig = {
-            "host": os.getenv("DB_HOST", "tramway.proxy.rlwy.net"),
-            "port": int(os.getenv("DB_PORT", "53965")),
-            "user": os.getenv("DB_USER", "root"),
-            "password": os.getenv("DB_PASSWORD", "aesZPoeaQuNokWDVsNWPXrxtmnVuOLgF"),
-            "database": os.getenv("DB_NAME", "railway"),
-        }
-        
-        connection_pool = pooling.MySQLConnectionPool(
-            pool_name="admin_pool",
-            pool_size=5,
-            pool_reset_session=True,
-            **dbconfig
-        )
-        return connection_pool
-    except mysql.connector.Error as err:
-        st.error(f"数据库连接池初始化失败: {err}")
-        return None
+        yield
+    finally:
+        connection = _request_state.connection
+        _request_state.active = False
+        _request_state.connection = None
+        if connection is not None:
+            connection.close()
+
+def page_fragment(func=None, *, run_every=None):
+    """页面片段：片段内的控件交互只重跑该函数及其查询，不重跑整个页面
+
+    片段单独重跑时不经过 main()，这里为它开启自己的连接作用域。
+    """
+    if func is None:
+        return lambda f: page_fragment(f, run_every=run_every)
+
+    @wraps(func)
+    def scoped(*args, **kwargs):
+        try:
+            with request_connection_scope():
+                return func(*args, **kwargs)
+        finally:
+            record_session_state()
+    return st.fragment(scoped, run_every=run_every)
+
+def checkout_connection():
+    """从连接池获取数据库连接；页面渲染期间返回本次渲染共享的连接。失败时抛出异常"""
+    pool = init_connection_pool()
+    if getattr(_request_state, "active", False):
+        connection = _request_state.connection
+        if connection is None:
+            connection = _request_state.connection = pool.get_connection()
+            _request_state.pool_wait = connection.wait_seconds
+        else:
+            _request_state.pool_wait = 0.0
+            if not connection.is_connected():
+                connection.reconnect(attempts=3, delay=1)
+                pool.metrics["reconnects"] += 1
+        return RequestConnection(connection)
+    connection = pool.get_connection()
+    _request_state.pool_wait = connection.wait_seconds
+    return connection
 
 def get_db_connection():
     """从连接池获取数据库连接"""
     try:
-        pool = init_connection_pool()
-        if pool is None:
-            return None
-        connection = pool.get_connection()
-        if connection.is_connected():
-            return connection
-        else:
-            connection.reconnect(attempts=3, delay=1)
-            return connection
+        return checkout_connection()
     except mysql.connector.Error as err:
         st.error(f"获取数据库连接失败: {err}")
         return None
 
+# 查询结果缓存配置
+QUERY_CACHE_TTL = int(os.getenv("QUERY_CACHE_TTL", "60"))
+QUERY_CACHE_MAX_ENTRIES = int(os.getenv("QUERY_CACHE_MAX_ENTRIES", "256"))
+QUERY_CACHE_MAX_MB = float(os.getenv("QUERY_CACHE_MAX_MB", "128"))
+
+_TABLE_PATTERN = re.compile(
+    r"\b(?:FROM|JOIN|UPDATE|INTO|TABLE(?:\s+IF\s+NOT\s+EXISTS)?)\s+`?(\w+)`?",
+    re.IGNORECASE,
+)
+
+def normalize_sql(query):
+    """规范化 SQL（合并空白），用作缓存键和统计键"""
+    return " ".join(query.split())
+
+def extract_tables(query):
+    """提取 SQL 语句涉及的表名"""
+    return frozenset(_TABLE_PATTERN.findall(query))
+
+def frame_bytes(df):
+    """DataFrame 占用的内存（含字符串对象本身）；所有缓存和内存统计都用它计算"""
+    return int(df.memory_usage(index=True, deep=True).sum())
+
+class QueryCache:
+    """查询结果缓存：按 规范化 SQL + 参数 作为键，按表打标签
+
+    - TTL 过期 + LRU 容量上限（条目数和字节数），字节数在存入 / 移除时增量维护
+    - execute_update 成功后只清除涉及同一张表的条目
+    - 进程内共享，线程安全
+    """
+
+    def __init__(self, ttl=QUERY_CACHE_TTL, max_entries=QUERY_CACHE_MAX_ENTRIES,
+                 max_bytes=int(QUERY_CACHE_MAX_MB * 1024 * 1024)):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self._entries = OrderedDict()  # key -> (expires_at, tables, df, nbytes)
+        self._lock = threading.Lock()
+        self.bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidations = 0
+
+    @staticmethod
+    def make_key(query, params):
+        return (normalize_sql(query), tuple(params) if params else ())
+
+    def _drop(self, key):
+        """移除一个条目并扣减字节数（需持有锁）"""
+        self.bytes -= self._entries.pop(key)[3]
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            expires_at, _, df, _ = entry
+            if expires_at < time.monotonic():
+                self._drop(key)
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return df.copy()
+
+    def put(self, key, tables, df, nbytes=None):
+        nbytes = frame_bytes(df) if nbytes is None else nbytes
+        if nbytes > self.max_bytes:
+            return  # 单个结果超过整个缓存的上限，不缓存
+        with self._lock:
+            if key in self._entries:
+                self._drop(key)
+            self._entries[key] = (time.monotonic() + self.ttl, tables, df.copy(), nbytes)
+            self.bytes += nbytes
+            while len(self._entries) > self.max_entries or self.bytes > self.max_bytes:
+                self._drop(next(iter(self._entries)))
+                self.evictions += 1
+
+    def invalidate(self, tables):
+        """清除所有涉及指定表的缓存条目"""
+        tables = set(tables)
+        with self._lock:
+            stale = [k for k, (_, t, _, _) in self._entries.items() if t & tables]
+            for k in stale:
+                self._drop(k)
+            self.invalidations += len(stale)
+            return len(stale)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self.bytes = 0
+
+    def stats(self):
+        with self._lock:
+            total = self.hits + self.misses
+            return {
+                "entries": len(self._entries),
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / total if total else 0.0,
+                "evictions": self.evictions,
+                "invalidations": self.invalidations,
+                "bytes": self.bytes,
+                "max_bytes": self.max_bytes,
+            }
+
+@st.cache_resource
+def get_query_cache():
+    """获取进程内共享的查询缓存"""
+    return QueryCache()
+
+# 会话内存配置：每个管理员会话缓存的页面结果超出预算时按 LRU 淘汰
+SESSION_MEMORY_BUDGET_MB = float(os.getenv("SESSION_MEMORY_BUDGET_MB", "64"))
+COMPACT_MIN_ROWS = 100
+
+def compact_frame(df):
+    """压缩 DataFrame：整数列向下转型，重复值多的字符串列转为 category
+
+    浮点列保持原精度；行数较少时 category 反而更占内存，不转换。
+    """
+    columns = {}
+    for name, column in df.items():
+        kind = column.dtype.kind
+        if kind == "i":
+            column = pd.to_numeric(column, downcast="integer")
+        elif kind == "u":
+            column = pd.to_numeric(column, downcast="unsigned")
+        elif kind == "O" and len(column) >= COMPACT_MIN_ROWS:
+            try:
+                if column.nunique(dropna=True) <= len(column) // 2:
+                    column = column.astype("category")
+            except TypeError:
+                pass  # 列中有不可哈希的值
+        columns[name] = column
+    return pd.DataFrame(columns, index=df.index)
+
+def held_frame_bytes(value, depth=0):
+    """统计对象中直接持有的 DataFrame 内存（向下查找两层容器）"""
+    if isinstance(value, pd.DataFrame):
+        return frame_bytes(value)
+    if depth >= 2:
+        return 0
+    if isinstance(value, dict):
+        value = list(value.values())
+    if isinstance(value, (list, tuple)):
+        return sum(held_frame_bytes(item, depth + 1) for item in value)
+    return 0
+
+class SessionFrameCache:
+    """单个管理员会话缓存的页面结果
+
+    存入时压缩；总字节数超过预算时淘汰最久未访问的条目（被淘汰的结果下次使用时重新加载）。
+    """
+
+    def __init__(self, session_id, budget_bytes):
+        self.session_id = session_id
+        self.budget_bytes = budget_bytes
+        self._entries = OrderedDict()  # key -> (df, nbytes)
+        self._lock = threading.Lock()
+        self.bytes = 0
+        self.evictions = 0
+        self.state_bytes = 0  # session_state 中其他 DataFrame 的内存
+        self.last_seen = time.monotonic()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            self._entries.move_to_end(key)
+            return entry[0]
+
+    def put(self, key, df):
+        df = compact_frame(df)
+        nbytes = frame_bytes(df)
+        with self._lock:
+            self._pop(key)
+            self._entries[key] = (df, nbytes)
+            self.bytes += nbytes
+            while self.bytes > self.budget_bytes and len(self._entries) > 1:
+                self._pop(next(iter(self._entries)))
+                self.evictions += 1
+
+    def _pop(self, key):
+        entry = self._entries.pop(key, None)
+        if entry is not None:
+            self.bytes -= entry[1]
+
+    def pop(self, key):
+        with self._lock:
+            self._pop(key)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self.bytes = 0
+
+    def entries(self):
+        with self._lock:
+            return [(key, len(df), nbytes) for key, (df, nbytes) in self._entries.items()]
+
+    def cached_bytes(self):
+        return self.bytes
+
+class SessionMemoryRegistry:
+    """所有管理员会话的页面结果缓存，空闲超时的会话整体释放"""
+
+    def __init__(self, budget_mb=SESSION_MEMORY_BUDGET_MB):
+        self.budget_bytes = int(budget_mb * 1024 * 1024)
+        self._sessions = {}
+        self._lock = threading.Lock()
+
+    def get(self, session_id):
+        now = time.monotonic()
+        with self._lock:
+            cutoff = now - DB_POOL_SESSION_IDLE_SECONDS
+            for sid in [sid for sid, cache in self._sessions.items() if cache.last_seen < cutoff and sid != session_id]:
+                del self._sessions[sid]
+            cache = self._sessions.get(session_id)
+            if cache is None:
+                cache = self._sessions[session_id] = SessionFrameCache(session_id, self.budget_bytes)
+            cache.last_seen = now
+            return cache
+
+    def sessions(self):
+        with self._lock:
+            return list(self._sessions.values())
+
+@st.cache_resource
+def get_session_memory():
+    """获取进程内共享的会话内存登记表"""
+    return SessionMemoryRegistry()
+
+def get_session_frames():
+    """当前管理员会话的页面结果缓存"""
+    return get_session_memory().get(st.session_state.get("admin_session_id", "local"))
+
+def record_session_state():
+    """记录本会话 session_state 中其他 DataFrame 的内存（整页重跑和片段重跑后都调用）"""
+    get_session_frames().state_bytes = held_frame_bytes(list(st.session_state.values()))
+
 def check_password():
     """密码验证"""
     def password_entered():
@@ -86,35 +578,357 @@ def check_password():
     else:
         return True
 
-def execute_query(query, params=None):
-    """执行查询并返回结果"""
+# 结果集列类型映射
+INTEGER_TYPES = {FieldType.TINY, FieldType.SHORT, FieldType.INT24,
+                 FieldType.LONG, FieldType.LONGLONG, FieldType.YEAR}
+FLOAT_TYPES = {FieldType.DECIMAL, FieldType.NEWDECIMAL, FieldType.FLOAT, FieldType.DOUBLE}
+DATETIME_TYPES = {FieldType.DATETIME, FieldType.TIMESTAMP, FieldType.DATE}
+CATEGORICAL_COLUMNS = {"status", "category", "userRole", "preferredRoles", "visibility"}
+
+def _integer_column(values):
+    """整数列按取值范围压缩为最小的整数类型；含 NULL 时使用可空整数类型"""
+    has_null = any(v is None for v in values)
+    if has_null:
+        non_null = [v for v in values if v is not None]
+        low, high = (min(non_null), max(non_null)) if non_null else (0, 0)
+    else:
+        array_values = np.fromiter(values, dtype=np.int64, count=len(values))
+        low, high = (int(array_values.min()), int(array_values.max())) if len(values) else (0, 0)
+    for dtype in (np.int8, np.int16, np.int32):
+        info = np.iinfo(dtype)
+        if info.min <= low and high <= info.max:
+            break
+    else:
+        dtype = np.int64
+    if has_null:
+        return pd.array(values, dtype=dtype.__name__.capitalize())
+    return array_values.astype(dtype, copy=False)
+
+def _convert_column(name, values, type_code):
+    """把一列原始值转换为紧凑的 pandas/NumPy 数组"""
+    if type_code in INTEGER_TYPES:
+        return _integer_column(values)
+    if type_code in FLOAT_TYPES:
+        return np.fromiter((np.nan if v is None else float(v) for v in values),
+                           dtype=np.float64, count=len(values))
+    if type_code in DATETIME_TYPES:
+        return pd.to_datetime(list(values))
+    if name in CATEGORICAL_COLUMNS:
+        return pd.Categorical(values)
+    return list(values)
+
+def fetch_dataframe(cursor):
+    """从元组游标直接按列构建 DataFrame（不为每行创建 dict）"""
+    if cursor.description is None:
+        return pd.DataFrame()
+    columns = [column[0] for column in cursor.description]
+    rows = cursor.fetchall()
+    if not rows:
+        return pd.DataFrame(columns=columns)
+    data = {}
+    for (name, type_code, *_), values in zip(cursor.description, zip(*rows)):
+        data[name] = _convert_column(name, values, type_code)
+    return pd.DataFrame(data, copy=False)
+
+# 查询追踪配置
+QUERY_TRACE_BUFFER_SIZE = int(os.getenv("QUERY_TRACE_BUFFER_SIZE", "5000"))
+SLOW_QUERY_MS = int(os.getenv("SLOW_QUERY_MS", "500"))
+STATEMENT_CATALOG_SIZE = int(os.getenv("STATEMENT_CATALOG_SIZE", "500"))
+_DB_HELPERS = {"fetch_query", "execute_query", "execute_update", "execute_many", "record_query", "capture", "_call_site"}
+
+@dataclass
+class QuerySample:
+    """一次数据库调用的追踪记录"""
+    timestamp: float
+    page: str
+    call_site: str
+    statement: str
+    kind: str
+    wall_ms: float
+    rows: int
+    bytes: int
+    pool_wait_ms: float
+    cached: bool
+    error: str = None
+
+class QueryTracer:
+    """进程内共享的查询追踪环形缓冲区"""
+
+    def __init__(self, size=QUERY_TRACE_BUFFER_SIZE):
+        self._samples = deque(maxlen=size)
+        self._lock = threading.Lock()
+
+    def record(self, sample):
+        with self._lock:
+            self._samples.append(sample)
+
+    def samples(self):
+        with self._lock:
+            return list(self._samples)
+
+    def frame(self):
+        samples = self.samples()
+        if not samples:
+            return pd.DataFrame(columns=list(QuerySample.__dataclass_fields__))
+        return pd.DataFrame([asdict(sample) for sample in samples])
+
+    def clear(self):
+        with self._lock:
+            self._samples.clear()
+
+@st.cache_resource
+def get_query_tracer():
+    """获取进程内共享的查询追踪器"""
+    return QueryTracer()
+
+def _call_site():
+    """调用数据库函数的页面代码位置（函数名:行号）"""
+    override = getattr(_request_state, "call_site", None)
+    if override:
+        return override
+    frame = sys._getframe(1)
+    while frame is not None and frame.f_code.co_name in _DB_HELPERS:
+        frame = frame.f_back
+    return f"{frame.f_code.co_name}:{frame.f_lineno}" if frame is not None else "?"
+
+def record_query(query, started, kind="query", rows=0, nbytes=0, cached=False, error=None):
+    """记录一次数据库调用"""
+    get_query_tracer().record(QuerySample(
+        timestamp=time.time(),
+        page=getattr(_request_state, "page", None) or "-",
+        call_site=_call_site(),
+        statement=normalize_sql(query),
+        kind=kind,
+        wall_ms=(time.perf_counter() - started) * 1000,
+        rows=rows,
+        bytes=nbytes,
+        pool_wait_ms=0.0 if cached else getattr(_request_state, "pool_wait", 0.0) * 1000,
+        cached=cached,
+        error=error,
+    ))
+
+class StatementCatalog:
+    """记录应用执行过的每条不同的 SELECT 语句及一组样例参数，供 EXPLAIN 分析"""
+
+    def __init__(self, size=STATEMENT_CATALOG_SIZE):
+        self.size = size
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def capture(self, query, params):
+        key = normalize_sql(query)
+        if not re.match(r"(SELECT|WITH)\b", key, re.IGNORECASE):
+            return
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                entry = {"statement": key, "query": query, "params": tuple(params or ()),
+                         "call_site": _call_site(), "calls": 0}
+                self._entries[key] = entry
+                if len(self._entries) > self.size:
+                    self._entries.popitem(last=False)
+            entry["calls"] += 1
+
+    def entries(self):
+        with self._lock:
+            return [dict(entry) for entry in self._entries.values()]
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+@st.cache_resource
+def get_statement_catalog():
+    """获取进程内共享的语句目录"""
+    return StatementCatalog()
+
+def fetch_query(query, params=None, use_cache=True):
+    """执行查询并返回 DataFrame（优先读取查询缓存）；出错时抛出异常，不调用 Streamlit"""
+    started = time.perf_counter()
+    cache = get_query_cache() if use_cache else None
+    if cache is not None:
+        key = cache.make_key(query, params)
+        cached = cache.get(key)
+        if cached is not None:
+            record_query(query, started, rows=len(cached), cached=True)
+            return cached
+
     conn = None
     cursor = None
     try:
-        conn = get_db_connection()
-        if conn is None or not conn.is_connected():
-            st.error("❌ 无法连接到数据库")
-            return pd.DataFrame()
-        
-        cursor = conn.cursor(dictionary=True)
+        conn = checkout_connection()
+        cursor = conn.cursor()
         cursor.execute(query, params or ())
-        results = cursor.fetchall()
-        df = pd.DataFrame(results)
+        df = fetch_dataframe(cursor)
+        get_statement_catalog().capture(query, params)
+        nbytes = frame_bytes(df)
+        if cache is not None:
+            cache.put(key, extract_tables(query), df, nbytes)
+        record_query(query, started, rows=len(df), nbytes=nbytes)
         return df
+    except Exception as e:
+        record_query(query, started, error=str(e))
+        raise
+    finally:
+        if cursor:
+            cursor.close()
+        if conn:
+            conn.close()
+
+def execute_query(query, params=None, use_cache=True):
+    """执行查询并返回结果（优先读取查询缓存）"""
+    try:
+        return fetch_query(query, params, use_cache)
     except mysql.connector.Error as err:
         st.error(f"数据库查询错误: {err}")
         return pd.DataFrame()
     except Exception as e:
         st.error(f"执行查询时出错: {e}")
         return pd.DataFrame()
+
+def run_parallel(tasks):
+    """并发执行互不依赖的任务 {name: callable}，返回 (results, errors)
+
+    执行期间向连接池临时借用每个任务一个连接（不超过 max_size），单个管理员也能真正并发；
+    连接池已满时借不到则在当前线程串行执行，复用本次渲染的连接，不再额外占用连接。
+    某个任务失败只记录在 errors 中，不影响其他任务。
+    """
+    if not tasks:
+        return {}, {}
+    caller = sys._getframe(1).f_code.co_name
+    with init_connection_pool().burst(len(tasks)) as granted:
+        if granted == 0:
+            return _run_tasks_inline(tasks, caller)
+        return _run_tasks(tasks, granted, caller)
+
+def _run_tasks_inline(tasks, caller):
+    previous = getattr(_request_state, "call_site", None)
+    results, errors = {}, {}
+    try:
+        for name, task in tasks.items():
+            _request_state.call_site = f"{caller}[{name}]"
+            try:
+                results[name] = task()
+            except Exception as e:
+                errors[name] = str(e)
+    finally:
+        _request_state.call_site = previous
+    return results, errors
+
+def _run_tasks(tasks, workers, caller):
+    ctx = get_script_run_ctx()
+    page = getattr(_request_state, "page", None)
+    
+    def run(name, task):
+        if ctx is not None:
+            add_script_run_ctx(threading.current_thread(), ctx)
+        _request_state.page = page
+        _request_state.call_site = f"{caller}[{name}]"
+        try:
+            return task()
+        finally:
+            _request_state.call_site = None
+    
+    results, errors = {}, {}
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        futures = {executor.submit(run, name, task): name for name, task in tasks.items()}
+        for future in as_completed(futures):
+            name = futures[future]
+            try:
+                results[name] = future.result()
+            except Exception as e:
+                errors[name] = str(e)
+    return results, errors
+
+def execute_parallel(queries):
+    """并发执行多条互不依赖的查询 {name: (query, params)}
+
+    返回 (results, errors)：失败的查询在 results 中为空 DataFrame，错误信息在 errors 中。
+    页面延迟接近最慢的一条查询，而不是所有查询之和。
+    """
+    results, errors = run_parallel({
+        name: (lambda query=query, params=params: fetch_query(query, params))
+        for name, (query, params) in queries.items()
+    })
+    for name in queries:
+        results.setdefault(name, pd.DataFrame())
+    return results, errors
+
+def show_query_errors(errors):
+    """显示并发查询中失败的查询"""
+    for name, error in errors.items():
+        st.warning(f"⚠️ 查询 {name} 失败: {error}")
+
+@contextmanager
+def streaming_cursor(query, params=None):
+    """以非缓冲游标执行查询，供调用方用 fetchmany 分块读取
+
+    结果行不会一次性加载到内存；提前退出时丢弃剩余结果，再把连接归还连接池。
+    """
+    conn = get_db_connection()
+    if conn is None or not conn.is_connected():
+        raise mysql.connector.Error("无法连接到数据库")
+    cursor = None
+    try:
+        cursor = conn.cursor(buffered=False)
+        cursor.execute(query, params or ())
+        yield cursor
+    finally:
+        if cursor:
+            try:
+                while cursor.fetchmany(1000):
+                    pass
+            except mysql.connector.Error:
+                pass
+            cursor.close()
+        conn.close()
+
+# 批量操作配置
+BULK_CHUNK_SIZE = int(os.getenv("BULK_CHUNK_SIZE", "200"))
+
+def execute_many(query, rows, chunk_size=BULK_CHUNK_SIZE, progress=None):
+    """分块 executemany，每块一个事务
+
+    某一块失败只回滚该块，其余块照常提交。数据库错误和参数错误（TypeError / ValueError）
+    都按块记录，不会中断后续块。返回与 rows 一一对应的 (成功, 错误信息) 列表——结果的粒度是块：
+    同一块的所有行结果相同，失败时错误信息注明所在块的行范围。
+    progress(done, total) 在每块执行后调用。
+    """
+    started = time.perf_counter()
+    results = []
+    conn = None
+    cursor = None
+    try:
+        conn = checkout_connection()
+        cursor = conn.cursor()
+        for start in range(0, len(rows), chunk_size):
+            chunk = rows[start:start + chunk_size]
+            try:
+                cursor.executemany(query, chunk)
+                conn.commit()
+                results.extend([(True, None)] * len(chunk))
+            except (mysql.connector.Error, TypeError, ValueError) as err:
+                conn.rollback()
+                error = f"第 {start + 1}-{start + len(chunk)} 行所在的块已回滚: {err}"
+                results.extend([(False, error)] * len(chunk))
+            if progress:
+                progress(len(results), len(rows))
+        record_query(query, started, kind="bulk", rows=len(rows))
+    except mysql.connector.Error as err:
+        record_query(query, started, kind="bulk", error=str(err))
+        results.extend([(False, str(err))] * (len(rows) - len(results)))
     finally:
         if cursor:
             cursor.close()
-        if conn and conn.is_connected():
+        if conn:
             conn.close()
+        if any(ok for ok, _ in results):
+            get_query_cache().invalidate(extract_tables(query))
+    return results
 
 def execute_update(query, params=None):
     """执行更新操作（INSERT, UPDATE, DELETE）"""
+    started = time.perf_counter()
     conn = None
     cursor = None
     try:
@@ -126,13 +940,18 @@ def execute_update(query, params=None):
         cursor = conn.cursor()
         cursor.execute(query, params or ())
         conn.commit()
+        # 写入成功后清除涉及该表的缓存
+        get_query_cache().invalidate(extract_tables(query))
+        record_query(query, started, kind="update", rows=max(cursor.rowcount, 0))
         return True
     except mysql.connector.Error as err:
+        record_query(query, started, kind="update", error=str(err))
         st.error(f"数据库更新错误: {err}")
         if conn:
             conn.rollback()
         return False
     except Exception as e:
+        record_query(query, started, kind="update", error=str(e))
         st.error(f"执行更新时出错: {e}")
         if conn:
             conn.rollback()
@@ -140,9 +959,397 @@ def execute_update(query, params=None):
     finally:
         if cursor:
             cursor.close()
-        if conn and conn.is_connected():
+        if conn:
             conn.close()
 
+# 分页配置
+PAGE_SIZE_OPTIONS = [25, 50, 100, 200]
+DEFAULT_PAGE_SIZE = 100
+
+def to_db_value(value):
+    """将 pandas/numpy 标量转换为数据库驱动可接受的 Python 值"""
+    if value is None or pd.isna(value):
+        return None
+    if isinstance(value, pd.Timestamp):
+        return value.to_pydatetime()
+    if hasattr(value, "item"):
+        return value.item()
+    return value
+
+def keyset_condition(sort_col, id_col, cursor, descending=True):
+    """构建 (sort_col, id_col) 上的 keyset 分页条件
+
+    MySQL 中 NULL 在升序时排最前、降序时排最后，这里保持一致。
+    """
+    value, last_id = cursor
+    op = "<" if descending else ">"
+    if value is None:
+        if descending:
+            return f"({sort_col} IS NULL AND {id_col} < %s)", [last_id]
+        return f"(({sort_col} IS NULL AND {id_col} > %s) OR {sort_col} IS NOT NULL)", [last_id]
+    condition = f"({sort_col} {op} %s OR ({sort_col} = %s AND {id_col} {op} %s)"
+    if descending:
+        condition += f" OR {sort_col} IS NULL"
+    return condition + ")", [value, value, last_id]
+
+def _pager_next(pager_key, cursor):
+    state = st.session_state[pager_key]
+    state["history"].append(state["cursor"])
+    state["cursor"] = cursor
+
+def _pager_prev(pager_key):
+    state = st.session_state[pager_key]
+    if state["history"]:
+        state["cursor"] = state["history"].pop()
+
+def paginated_query(state_key, query, params, sort_col, id_col,
+                    descending=True, sort_field=None, id_field="id"):
+    """按 (sort_col, id_col) 进行 keyset 分页查询，并显示翻页控件
+
+    query 必须以 WHERE 子句结尾（不含 ORDER BY / LIMIT）。
+    每一页都是一次索引范围扫描，翻到第几页代价都一样。
+    """
+    sort_field = sort_field or sort_col.split(".")[-1]
+    page_size = st.session_state.get(f"{state_key}_page_size", DEFAULT_PAGE_SIZE)
+    pager_key = f"{state_key}_pager"
+    
+    # 筛选条件或排序变化时回到第一页
+    signature = (normalize_sql(query), tuple(params or ()), sort_col, descending, page_size)
+    state = st.session_state.get(pager_key)
+    if state is None or state["signature"] != signature:
+        state = {"signature": signature, "cursor": None, "history": []}
+        st.session_state[pager_key] = state
+    
+    page_query = query
+    page_params = list(params or [])
+    if state["cursor"] is not None:
+        condition, condition_params = keyset_condition(sort_col, id_col, state["cursor"], descending)
+        page_query += f" AND {condition}"
+        page_params.extend(condition_params)
+    
+    direction = "DESC" if descending else "ASC"
+    page_query += f" ORDER BY {sort_col} {direction}, {id_col} {direction} LIMIT %s"
+    page_params.append(page_size + 1)
+    
+    rows = execute_query(page_query, page_params)
+    has_next = len(rows) > page_size
+    rows = rows.head(page_size)
+    
+    next_cursor = None
+    if has_next:
+        last = rows.iloc[-1]
+        next_cursor = (to_db_value(last[sort_field]), to_db_value(last[id_field]))
+    
+    col1, col2, col3, col4 = st.columns([1, 1, 1, 3])
+    with col1:
+        st.button("◀ 上一页", key=f"{state_key}_prev", disabled=not state["history"],
+                  on_click=_pager_prev, args=(pager_key,))
+    with col2:
+        st.button("下一页 ▶", key=f"{state_key}_next", disabled=not has_next,
+                  on_click=_pager_next, args=(pager_key, next_cursor))
+    with col3:
+        st.caption(f"第 {len(state['history']) + 1} 页")
+    with col4:
+        st.selectbox("每页条数", PAGE_SIZE_OPTIONS,
+                     index=PAGE_SIZE_OPTIONS.index(DEFAULT_PAGE_SIZE),
+                     key=f"{state_key}_page_size", label_visibility="collapsed")
+    
+    return rows
+
+# 增量读取（高水位）每批行数
+WATERMARK_BATCH_SIZE = int(os.getenv("WATERMARK_BATCH_SIZE", "50000"))
+
+# 用户搜索索引配置
+USER_SEARCH_REFRESH_INTERVAL = int(os.getenv("USER_SEARCH_REFRESH_INTERVAL", "10"))
+USER_SEARCH_MAX_RESULTS = 1000
+
+def trigrams(text):
+    """返回字符串的三元组集合"""
+    return {text[i:i + 3] for i in range(len(text) - 2)}
+
+@dataclass
+class UserSearchResult:
+    """用户搜索结果：ids 为截断后的用户 ID，total 为截断前的匹配数"""
+    ids: list
+    total: int
+    fuzzy: bool = False  # 没有子串匹配，结果来自三元组相似度
+
+    @property
+    def truncated(self):
+        return self.total > len(self.ids)
+
+class UserSearchIndex:
+    """users.name / users.email 的进程内三元组倒排索引
+
+    - 倒排表使用 array('I') 存储用户 ID，内存紧凑
+    - 用户更新时只追加新增的三元组；旧三元组留在倒排表中，
+      查询时用当前文本做子串校验过滤掉
+    - 同时记录 preferredRoles，角色筛选在截断之前完成
+    - 通过 (updatedAt, id) 高水位增量刷新
+    """
+
+    def __init__(self):
+        self._postings = {}  # trigram -> array('I') of user ids
+        self._texts = {}  # user id -> 小写的 "name\nemail"
+        self._roles = {}  # user id -> preferredRoles
+        self._lock = threading.Lock()
+        self.watermark = None  # (updatedAt, id)
+        self.last_refresh = 0.0
+
+    def __len__(self):
+        return len(self._texts)
+
+    def add_rows(self, rows):
+        """添加或更新用户，rows 为按 (updatedAt, id) 排序的 (id, name, email, preferredRoles, updatedAt)"""
+        with self._lock:
+            for user_id, name, email, role, updated_at in rows:
+                user_id = int(user_id)
+                name = name if isinstance(name, str) else ""
+                email = email if isinstance(email, str) else ""
+                text = f"{name}\n{email}".lower()
+                old_text = self._texts.get(user_id)
+                new_grams = trigrams(text)
+                if old_text is not None:
+                    new_grams -= trigrams(old_text)
+                for gram in new_grams:
+                    posting = self._postings.get(gram)
+                    if posting is None:
+                        posting = self._postings[gram] = array("I")
+                    posting.append(user_id)
+                self._texts[user_id] = text
+                self._roles[user_id] = role if isinstance(role, str) else None
+                self.watermark = (updated_at, user_id)
+
+    def role_ids(self, role):
+        """preferredRoles 等于 role 的用户 ID 列表"""
+        with self._lock:
+            return [uid for uid, user_role in self._roles.items() if user_role == role]
+
+    def search(self, query, limit=USER_SEARCH_MAX_RESULTS, fuzzy=True, role=None):
+        """子串搜索，返回 UserSearchResult（新用户在前）；无子串匹配时退化为三元组相似度搜索
+
+        role 不为空时只返回 preferredRoles 等于 role 的用户；筛选在截断之前，total 为筛选后的匹配数。
+        """
+        q = query.strip().lower()
+        if not q:
+            return UserSearchResult([], 0)
+        with self._lock:
+            if len(q) < 3:
+                candidates = self._texts.keys()
+            else:
+                postings = [self._postings.get(gram) for gram in trigrams(q)]
+                if any(posting is None for posting in postings):
+                    candidates = ()
+                else:
+                    candidates = set(min(postings, key=len))
+            texts, roles = self._texts, self._roles
+            matches = sorted((uid for uid in candidates
+                              if q in texts[uid] and (role is None or roles.get(uid) == role)), reverse=True)
+            if matches or not fuzzy or len(q) < 3:
+                return UserSearchResult(matches[:limit], len(matches))
+            return self._fuzzy_search(q, limit, role)
+
+    def _fuzzy_search(self, q, limit, role=None, min_similarity=0.5):
+        """按共享三元组比例排序的模糊搜索（需持有锁）"""
+        grams = trigrams(q)
+        counts = Counter()
+        for gram in grams:
+            posting = self._postings.get(gram)
+            if posting is not None:
+                counts.update(set(posting))
+        threshold = max(1, int(len(grams) * min_similarity))
+        scored = []
+        for uid, count in counts.items():
+            if count < threshold or (role is not None and self._roles.get(uid) != role):
+                continue
+            # 倒排表中可能有过期三元组，按当前文本重新计分
+            score = len(grams & trigrams(self._texts[uid]))
+            if score >= threshold:
+                scored.append((score, uid))
+        scored.sort(reverse=True)
+        return UserSearchResult([uid for _, uid in scored[:limit]], len(scored), fuzzy=True)
+
+@st.cache_resource
+def get_user_search_index():
+    """获取进程内共享的用户搜索索引"""
+    return UserSearchIndex()
+
+def iter_changed_rows(table, columns, watermark=None, batch_size=WATERMARK_BATCH_SIZE):
+    """按 (updatedAt, id) 高水位分批读取新增或变更的行
+
+    columns 必须包含 id 和 updatedAt；watermark 为 None 时从头全量读取。
+    """
+    select = f"SELECT {columns} FROM {table}"
+    while True:
+        if watermark is None:
+            rows = execute_query(f"{select} ORDER BY updatedAt, id LIMIT %s",
+                                 (batch_size,), use_cache=False)
+        else:
+            updated_at, last_id = watermark
+            rows = execute_query(f"""
+                {select}
+                WHERE updatedAt > %s OR (updatedAt = %s AND id > %s)
+                ORDER BY updatedAt, id
+                LIMIT %s
+            """, (updated_at, updated_at, last_id, batch_size), use_cache=False)
+        if rows.empty:
+            return
+        yield rows
+        last = rows.iloc[-1]
+        watermark = (to_db_value(last['updatedAt']), to_db_value(last['id']))
+        if len(rows) < batch_size:
+            return
+
+def refresh_user_search_index(index, force=False):
+    """从 (updatedAt, id) 高水位开始增量加载用户"""
+    if not force and time.monotonic() - index.last_refresh < USER_SEARCH_REFRESH_INTERVAL:
+        return
+    for rows in iter_changed_rows("users", "id, name, email, preferredRoles, updatedAt", index.watermark):
+        index.add_rows(
+            (row.id, row.name, row.email, to_db_value(row.preferredRoles), to_db_value(row.updatedAt))
+            for row in rows.itertuples(index=False)
+        )
+    index.last_refresh = time.monotonic()
+
+# 会话日汇总配置
+SESSION_ROLLUP_REFRESH_INTERVAL = int(os.getenv("SESSION_ROLLUP_REFRESH_INTERVAL", "30"))
+SESSION_STATUSES = ["PENDING", "CONFIRMED", "PENDING_RATING", "DISPUTED", "CLOSED", "CANCELLED"]
+ACTIVITY_WINDOWS = {"最近 7 天": 7, "最近 30 天": 30, "最近 90 天": 90, "最近 365 天": 365}
+
+class SessionRollup:
+    """按 日期 × 状态 的会话计数汇总，按 (updatedAt, id) 高水位增量维护
+
+    为每个会话记录上次计入的 (日期, 状态)，会话状态变化时从旧桶移到新桶。
+    记录压缩为一个整数 date.toordinal() * 16 + 状态序号，存放在按会话 id 下标的 int32 数组中
+    （0 表示未计入，100 万个会话约 4 MB）；计数按同样的压缩值作为键。
+    日期按数据库会话时区计算：DATE(createdAt) 和 today 都来自数据库，不使用应用服务器的时区。
+    """
+
+    def __init__(self):
+        self._counts = Counter()  # packed (date, status) -> count
+        self._packed = np.zeros(0, dtype=np.int32)  # session id -> packed (date, status)
+        self._statuses = list(SESSION_STATUSES)
+        self._lock = threading.Lock()
+        self.watermark = None  # (updatedAt, id)
+        self.today = None  # 数据库的 CURDATE()
+        self.last_refresh = 0.0
+        self._refresh_lock = threading.Lock()  # 串行化增量刷新，保证高水位按顺序推进
+
+    def _status_code(self, status):
+        if status not in self._statuses:
+            self._statuses.append(status)
+        return self._statuses.index(status)
+
+    def _reserve(self, max_id):
+        if max_id >= len(self._packed):
+            packed = np.zeros(max(max_id + 1, len(self._packed) * 2), dtype=np.int32)
+            packed[:len(self._packed)] = self._packed
+            self._packed = packed
+
+    def apply_rows(self, rows):
+        """应用新增或变更的会话，rows 为按 (updatedAt, id) 排序的 (id, day, status, updatedAt)"""
+        ids, values = [], []
+        watermark = None
+        for session_id, day, status, updated_at in rows:
+            watermark = (updated_at, int(session_id))
+            if day is None or status is None:
+                continue
+            if isinstance(day, datetime):
+                day = day.date()
+            ids.append(int(session_id))
+            values.append(day.toordinal() * 16 + self._status_code(status))
+        with self._lock:
+            if watermark is not None:
+                self.watermark = watermark
+            if not ids:
+                return
+            ids = np.array(ids, dtype=np.int64)
+            values = np.array(values, dtype=np.int32)
+            self._reserve(int(ids.max()))
+            previous = self._packed[ids]
+            moved = previous != values
+            old = previous[moved & (previous > 0)]
+            for packed, count in zip(*np.unique(old, return_counts=True)):
+                self._counts[int(packed)] -= int(count)
+            for packed, count in zip(*np.unique(values[moved], return_counts=True)):
+                self._counts[int(packed)] += int(count)
+            self._packed[ids] = values
+
+    def status_counts(self):
+        """各状态会话总数"""
+        totals = Counter()
+        with self._lock:
+            for packed, count in self._counts.items():
+                totals[self._statuses[packed % 16]] += count
+        rows = [(status, count) for status, count in totals.items() if count > 0]
+        return pd.DataFrame(rows, columns=['status', 'count'])
+
+    def daily_counts(self, days, today=None):
+        """最近 days 天每天的会话数（按创建日期），缺失日期补 0；代价 O(days × 状态数)"""
+        today = today or self.today or date.today()
+        dates = [today - timedelta(days=offset) for offset in range(days - 1, -1, -1)]
+        with self._lock:
+            codes = range(len(self._statuses))
+            counts = [sum(self._counts.get(day.toordinal() * 16 + code, 0) for code in codes) for day in dates]
+        return pd.DataFrame({'date': dates, 'count': counts})
+
+@st.cache_resource
+def get_session_rollup():
+    """获取进程内共享的会话日汇总"""
+    return SessionRollup()
+
+def database_today():
+    """数据库会话时区的当前日期（与 DATE(createdAt) 一致，不使用应用服务器的时区）"""
+    today = fetch_query("SELECT CURDATE() as today", use_cache=False)
+    return pd.Timestamp(today.iloc[0]['today']).date() if not today.empty else date.today()
+
+def refresh_session_rollup(rollup, force=False):
+    """从高水位开始把新增或变更的会话计入汇总
+
+    与 refresh_rating_engine 相同：读高水位 → 拉取 → 应用 → 推进高水位在刷新锁内完成，
+    等锁期间其他会话已刷新过则直接返回。
+    """
+    if not force and time.monotonic() - rollup.last_refresh < SESSION_ROLLUP_REFRESH_INTERVAL:
+        return
+    requested = time.monotonic()
+    with rollup._refresh_lock:
+        if rollup.last_refresh >= requested or (
+            not force and time.monotonic() - rollup.last_refresh < SESSION_ROLLUP_REFRESH_INTERVAL
+        ):
+            return
+        rollup.today = database_today()
+        for rows in iter_changed_rows("sessions", "id, DATE(createdAt) as day, status, updatedAt",
+                                      rollup.watermark):
+            rollup.apply_rows(
+                (row.id, to_db_value(row.day), row.status, to_db_value(row.updatedAt))
+                for row in rows.itertuples(index=False)
+            )
+        rollup.last_refresh = time.monotonic()
+
+def search_users(search, limit=USER_SEARCH_MAX_RESULTS, role=None):
+    """通过本地索引把姓名/邮箱搜索解析为 UserSearchResult"""
+    index = get_user_search_index()
+    refresh_user_search_index(index)
+    return index.search(search, limit, role=role)
+
+def show_search_notes(result, limit_hint="请输入更具体的关键词"):
+    """提示模糊匹配和结果截断"""
+    if result.fuzzy and result.ids:
+        st.info("🔎 没有完全匹配的用户，以下是姓名或邮箱相似的结果")
+    if result.truncated:
+        st.warning(f"⚠️ 共匹配 {result.total} 个用户，只取最新的 {len(result.ids)} 个；{limit_hint}")
+
+def parse_ids(text):
+    """解析用逗号、空格或换行分隔的 ID 列表（去重，保持输入顺序）"""
+    ids = [int(x) for x in re.split(r"[,，\s]+", text or "") if x.isdigit()]
+    return list(dict.fromkeys(ids))
+
+def id_in_clause(column, ids):
+    """构建 column IN (...) 条件；ids 为空时返回恒假条件"""
+    if not ids:
+        return "1=0", []
+    return f"{column} IN ({', '.join(['%s'] * len(ids))})", list(ids)
+
 def main():
     """主应用"""
     
@@ -150,23 +1357,76 @@ def main():
     if not check_password():
         return
     
+    # 记录活跃会话，连接池上限据此调整
+    if "admin_session_id" not in st.session_state:
+        st.session_state["admin_session_id"] = os.urandom(8).hex()
+    init_connection_pool().touch_session(st.session_state["admin_session_id"])
+    
+    # 首次渲染时建表和补齐索引
+    try:
+        run_migrations()
+    except (mysql.connector.Error, TimeoutError) as e:
+        st.error(f"数据库迁移失败: {e}")
+    
+    # 本次渲染的所有查询复用同一个连接
+    with request_connection_scope():
+        render_app()
+    
+    # 记录本会话 session_state 中其他 DataFrame 的内存，供性能诊断页查看
+    record_session_state()
+
+def render_app():
+    """渲染侧边栏和当前页面"""
+    
     # 侧边栏导航
     st.sidebar.title("📚 UniTutor Admin")
     st.sidebar.markdown("---")
     
     page = st.sidebar.radio(
         "导航",
-        ["📊 平台统计", "👥 用户管理", "📅 会话管理", "⚠️ 争议处理", "💬 支持工单", "⭐ 评分管理", "🎯 管理员评分"]
+        ["📊 平台统计", "📈 留存分析", "📚 课程供需", "👥 用户管理", "📅 会话管理", "⚠️ 争议处理", "💬 支持工单", "⭐ 评分管理", "🎯 管理员评分", "🏆 评分排行", "🧰 批量操作", "📤 数据导出", "🔧 性能诊断"]
     )
     
     st.sidebar.markdown("---")
     st.sidebar.info("💡 提示：点击用户可查看详细信息")
     
+    # 查询缓存统计
+    cache_stats = get_query_cache().stats()
+    st.sidebar.caption(
+        f"🗄️ 查询缓存: {cache_stats['entries']} 条 / {cache_stats['bytes'] / 1024 / 1024:.1f} MB · "
+        f"命中 {cache_stats['hits']} / 未命中 {cache_stats['misses']} "
+        f"({cache_stats['hit_rate']:.0%})"
+    )
+    if st.sidebar.button("🔄 清空缓存"):
+        get_query_cache().clear()
+    
+    # 连接池指标
+    with st.sidebar.expander("🔌 连接池"):
+        pool_stats = init_connection_pool().stats()
+        st.caption(
+            f"上限 {pool_stats['limit']} · 已打开 {pool_stats['open']} · "
+            f"使用中 {pool_stats['in_use']} · 等待 {pool_stats['waiting']}"
+        )
+        st.caption(
+            f"借出 {pool_stats['checkouts']} 次 · 平均等待 {pool_stats['avg_wait_ms']:.1f} ms · "
+            f"最长等待 {pool_stats['max_wait_ms']:.1f} ms"
+        )
+        st.caption(
+            f"重置 {pool_stats['resets']} · 重连 {pool_stats['reconnects']} · "
+            f"超时 {pool_stats['timeouts']} · 拒绝 {pool_stats['rejected']} · "
+            f"活跃会话 {pool_stats['active_sessions']}"
+        )
+    
     # 根据选择显示不同页面
+    _request_state.page = page
     if page == "📊 平台统计":
         show_dashboard()
+    elif page == "📚 课程供需":
+        show_course_supply()
     elif page == "👥 用户管理":
         show_users()
+    elif page == "📈 留存分析":
+        show_cohorts()
     elif page == "📅 会话管理":
         show_sessions()
     elif page == "⚠️ 争议处理":
@@ -177,29 +1437,84 @@ def main():
         show_ratings()
     elif page == "🎯 管理员评分":
         show_admin_rating()
+    elif page == "🏆 评分排行":
+        show_rating_leaderboard()
+    elif page == "🧰 批量操作":
+        show_bulk_actions()
+    elif page == "📤 数据导出":
+        show_exports()
+    elif page == "🔧 性能诊断":
+        show_performance()
+
+@dataclass
+class DashboardSnapshot:
+    """平台统计快照（一次往返获取）"""
+    total_users: int = 0
+    students: int = 0
+    tutors: int = 0
+    total_sessions: int = 0
+    status_counts: pd.DataFrame = field(default_factory=pd.DataFrame)
+    daily_sessions: pd.DataFrame = field(default_factory=pd.DataFrame)
+
+DASHBOARD_SNAPSHOT_QUERY = """
+    (SELECT 'total_users' as label, COUNT(*) as count FROM users)
+    UNION ALL
+    (SELECT 'students', COUNT(DISTINCT userId) FROM profiles WHERE userRole = 'student')
+    UNION ALL
+    (SELECT 'tutors', COUNT(DISTINCT userId) FROM profiles WHERE userRole = 'tutor')
+    UNION ALL
+    (SELECT 'total_sessions', COUNT(*) FROM sessions)
+"""
+
+def get_dashboard_snapshot(days=30):
+    """获取平台统计快照
+
+    KPI 合并为一条语句（一次连接、一次往返）；状态分布和每日会话数
+    读取增量维护的会话日汇总，与会话总量无关。启用分析镜像时全部在本地镜像上计算。
+    """
+    mirror = get_analytics_mirror()
+    if mirror is not None:
+        ensure_mirror_fresh(mirror)
+        return mirror_dashboard_snapshot(mirror, days)
+    
+    # KPI 查询与会话汇总的增量刷新互不依赖，并发执行
+    rollup = get_session_rollup()
+    results, errors = run_parallel({
+        "kpis": lambda: fetch_query(DASHBOARD_SNAPSHOT_QUERY),
+        "rollup": lambda: refresh_session_rollup(rollup),
+    })
+    show_query_errors(errors)
+    
+    snapshot = DashboardSnapshot()
+    kpis = results.get("kpis", pd.DataFrame())
+    if not kpis.empty:
+        kpis = kpis.set_index('label')['count']
+        snapshot.total_users = int(kpis.get('total_users', 0))
+        snapshot.students = int(kpis.get('students', 0))
+        snapshot.tutors = int(kpis.get('tutors', 0))
+        snapshot.total_sessions = int(kpis.get('total_sessions', 0))
+    
+    snapshot.status_counts = rollup.status_counts()
+    snapshot.daily_sessions = rollup.daily_counts(days)
+    return snapshot
 
 def show_dashboard():
     """显示平台统计"""
     st.title("📊 平台统计")
     
-    # 统计卡片
-    col1, col2, col3, col4 = st.columns(4)
-    
-    # 总用户数
-    total_users = execute_query("SELECT COUNT(*) as count FROM users")
-    col1.metric("总用户数", total_users['count'].iloc[0] if not total_users.empty else 0)
-    
-    # 学生数
-    students = execute_query("SELECT COUNT(DISTINCT userId) as count FROM profiles WHERE userRole = 'student'")
-    col2.metric("学生数", students['count'].iloc[0] if not students.empty else 0)
+    window = st.selectbox("统计周期", list(ACTIVITY_WINDOWS), index=1, key="dashboard_window")
+    snapshot = get_dashboard_snapshot(ACTIVITY_WINDOWS[window])
     
-    # 教师数
-    tutors = execute_query("SELECT COUNT(DISTINCT userId) as count FROM profiles WHERE userRole = 'tutor'")
-    col3.metric("教师数", tutors['count'].iloc[0] if not tutors.empty else 0)
+    mirror = get_analytics_mirror()
+    if mirror is not None:
+        render_mirror_freshness(mirror)
     
-    # 总会话数
-    sessions_count = execute_query("SELECT COUNT(*) as count FROM sessions")
-    col4.metric("总会话数", sessions_count['count'].iloc[0] if not sessions_count.empty else 0)
+    # 统计卡片
+    col1, col2, col3, col4 = st.columns(4)
+    col1.metric("总用户数", snapshot.total_users)
+    col2.metric("学生数", snapshot.students)
+    col3.metric("教师数", snapshot.tutors)
+    col4.metric("总会话数", snapshot.total_sessions)
     
     st.markdown("---")
     
@@ -208,28 +1523,15 @@ def show_dashboard():
     
     with col1:
         st.subheader("📈 会话状态分布")
-        session_status = execute_query("""
-            SELECT status, COUNT(*) as count 
-            FROM sessions 
-            GROUP BY status
-        """)
-        if not session_status.empty:
-            st.bar_chart(session_status.set_index('status'))
+        if not snapshot.status_counts.empty:
+            st.bar_chart(snapshot.status_counts.set_index('status'))
         else:
             st.info("暂无会话数据")
     
     with col2:
         st.subheader("📅 最近会话统计")
-        recent_sessions = execute_query("""
-            SELECT DATE(createdAt) as date, COUNT(*) as count
-            FROM sessions
-            WHERE createdAt >= DATE_SUB(NOW(), INTERVAL 30 DAY)
-            GROUP BY DATE(createdAt)
-            ORDER BY date DESC
-            LIMIT 10
-        """)
-        if not recent_sessions.empty:
-            st.line_chart(recent_sessions.set_index('date'))
+        if snapshot.daily_sessions['count'].sum() > 0:
+            st.line_chart(snapshot.daily_sessions.set_index('date'))
         else:
             st.info("暂无会话数据")
 
@@ -251,27 +1553,37 @@ def show_users():
     query = "SELECT id, name, email, role, preferredRoles, createdAt, lastSignedIn FROM users WHERE 1=1"
     params = []
     
+    role_map = {"学生": "student", "教师": "tutor", "两者都是": "both"}
+    role = role_map.get(role_filter)
+    
+    search_result = None
     if search:
-        query += " AND (name LIKE %s OR email LIKE %s)"
-        params.extend([f"%{search}%", f"%{search}%"])
+        # 角色筛选在索引内、截断之前完成，避免截断后再筛选丢掉匹配
+        search_result = search_users(search, role=role)
+        condition, id_params = id_in_clause("id", search_result.ids)
+        query += f" AND {condition}"
+        params.extend(id_params)
     
-    if role_filter != "全部":
-        role_map = {"学生": "student", "教师": "tutor", "两者都是": "both"}
+    if role is not None:
         query += " AND preferredRoles = %s"
-        params.append(role_map[role_filter])
+        params.append(role)
     
-    # 排序
+    # 排序（keyset 分页键）
     if sort_by == "最新注册":
-        query += " ORDER BY createdAt DESC"
+        sort_col, descending = "createdAt", True
     elif sort_by == "最近登录":
-        query += " ORDER BY lastSignedIn DESC"
+        sort_col, descending = "lastSignedIn", True
     else:
-        query += " ORDER BY name"
-    
-    query += " LIMIT 100"
+        # 按 name 前 64 个字符的索引列排序（迁移 7），name 是 TEXT 无法直接走组合索引
+        sort_col, descending = "nameSort", False
+        query = query.replace(" FROM users", ", nameSort FROM users", 1)
     
     # 执行查询
-    users = execute_query(query, params if params else None)
+    users = paginated_query("users", query, params, sort_col, "id", descending=descending)
+    users = users.drop(columns="nameSort", errors="ignore")
+    if search_result is not None:
+        show_search_notes(search_result)
+        st.caption(f"搜索匹配 {search_result.total} 个用户")
     
     if not users.empty:
         st.dataframe(
@@ -294,21 +1606,162 @@ def show_users():
         with col2:
             if st.button("🗑️ 删除用户", type="secondary"):
                 delete_user(user_id)
+        
+        # 批量查看
+        bulk_ids = st.text_input("批量查看（多个用户 ID，用逗号分隔）", key="bulk_user_ids")
+        if st.button("批量查看详情") and bulk_ids:
+            ids = parse_ids(bulk_ids)
+            if ids:
+                show_bulk_user_detail(ids)
+            else:
+                st.warning("请输入有效的用户 ID")
     else:
         st.info("没有找到用户")
 
+SESSION_STAT_KEYS = ("total", "completed", "cancelled", "disputed")
+
+@dataclass
+class UserDetail:
+    """用户详情（user 360）"""
+    user: dict
+    profiles: pd.DataFrame = field(default_factory=pd.DataFrame)
+    student_stats: dict = field(default_factory=lambda: dict.fromkeys(SESSION_STAT_KEYS, 0))
+    tutor_stats: dict = field(default_factory=lambda: dict.fromkeys(SESSION_STAT_KEYS, 0))
+    avg_score: float = None
+    rating_count: int = 0
+    recent_sessions: pd.DataFrame = field(default_factory=pd.DataFrame)
+
+def load_user_details(user_ids, recent_limit=10):
+    """批量加载用户详情
+
+    无论加载多少个用户，都只执行固定 5 条语句（并发执行），且只选取页面展示的列。
+    返回 {user_id: UserDetail}，不存在的用户不在结果中。
+    """
+    user_ids = sorted({int(uid) for uid in user_ids})
+    if not user_ids:
+        return {}
+    placeholders = ", ".join(["%s"] * len(user_ids))
+    ids = tuple(user_ids)
+    
+    results, errors = execute_parallel({
+        "users": (f"""
+            SELECT id, name, email, preferredRoles, loginMethod, createdAt, lastSignedIn
+            FROM users WHERE id IN ({placeholders})
+        """, ids),
+        "profiles": (f"""
+            SELECT userId, userRole, major, year, priceMin, priceMax, creditPoints, bio
+            FROM profiles WHERE userId IN ({placeholders})
+        """, ids),
+        "session_stats": (f"""
+            SELECT 'student' as role, studentId as userId,
+                COUNT(*) as total,
+                COALESCE(SUM(CASE WHEN status = 'CLOSED' THEN 1 ELSE 0 END), 0) as completed,
+                COALESCE(SUM(CASE WHEN status = 'CANCELLED' THEN 1 ELSE 0 END), 0) as cancelled,
+                COALESCE(SUM(CASE WHEN status = 'DISPUTED' THEN 1 ELSE 0 END), 0) as disputed
+            FROM sessions WHERE studentId IN ({placeholders})
+            GROUP BY studentId
+            UNION ALL
+            SELECT 'tutor', tutorId,
+                COUNT(*),
+                COALESCE(SUM(CASE WHEN status = 'CLOSED' THEN 1 ELSE 0 END), 0),
+                COALESCE(SUM(CASE WHEN status = 'CANCELLED' THEN 1 ELSE 0 END), 0),
+                COALESCE(SUM(CASE WHEN status = 'DISPUTED' THEN 1 ELSE 0 END), 0)
+            FROM sessions WHERE tutorId IN ({placeholders})
+            GROUP BY tutorId
+        """, ids + ids),
+        "ratings": (f"""
+            SELECT targetId as userId, AVG(score) as avg_score, COUNT(*) as count
+            FROM ratings WHERE targetId IN ({placeholders})
+            GROUP BY targetId
+        """, ids),
+        "recent": (f"""
+            SELECT userId, id, course, status, startTime, partner
+            FROM (
+                SELECT x.*, ROW_NUMBER() OVER (PARTITION BY x.userId ORDER BY x.createdAt DESC, x.id DESC) as rn
+                FROM (
+                    SELECT s.studentId as userId, s.id, s.course, s.status, s.startTime, s.createdAt,
+                        CONCAT('教师: ', tutor.name) as partner
+                    FROM sessions s
+                    LEFT JOIN users tutor ON s.tutorId = tutor.id
+                    WHERE s.studentId IN ({placeholders})
+                    UNION ALL
+                    SELECT s.tutorId, s.id, s.course, s.status, s.startTime, s.createdAt,
+                        CONCAT('学生: ', student.name)
+                    FROM sessions s
+                    LEFT JOIN users student ON s.studentId = student.id
+                    WHERE s.tutorId IN ({placeholders})
+                ) x
+            ) ranked
+            WHERE rn <= %s
+            ORDER BY userId, rn
+        """, ids + ids + (recent_limit,)),
+    })
+    show_query_errors(errors)
+    users, profiles, session_stats, ratings, recent = (results[name] for name in (
+        "users", "profiles", "session_stats", "ratings", "recent"))
+    
+    details = {}
+    for user in users.to_dict("records"):
+        details[int(user["id"])] = UserDetail(user=user)
+    
+    if not profiles.empty:
+        for uid, group in profiles.groupby("userId"):
+            if int(uid) in details:
+                details[int(uid)].profiles = group.reset_index(drop=True)
+    
+    for stats in session_stats.to_dict("records"):
+        detail = details.get(int(stats["userId"]))
+        if detail is None:
+            continue
+        values = {key: int(stats[key] or 0) for key in SESSION_STAT_KEYS}
+        if stats["role"] == "student":
+            detail.student_stats = values
+        else:
+            detail.tutor_stats = values
+    
+    for rating in ratings.to_dict("records"):
+        detail = details.get(int(rating["userId"]))
+        if detail is not None and rating["count"]:
+            detail.avg_score = float(rating["avg_score"])
+            detail.rating_count = int(rating["count"])
+    
+    if not recent.empty:
+        for uid, group in recent.groupby("userId"):
+            if int(uid) in details:
+                details[int(uid)].recent_sessions = group.drop(columns=["userId"]).reset_index(drop=True)
+    
+    return details
+
 def show_user_detail(user_id):
     """显示用户详细信息"""
+    render_user_detail(user_id, load_user_details([user_id]).get(int(user_id)))
+
+def show_bulk_user_detail(user_ids):
+    """批量显示多个用户的详细信息（固定次数的数据库往返）"""
+    details = load_user_details(user_ids)
+    for user_id in user_ids:
+        render_user_detail(user_id, details.get(int(user_id)))
+
+def plain_record(record):
+    """把一行记录转换为 Python 值（NaN / <NA> / NaT 都变为 None），供页面格式化显示"""
+    return {key: to_db_value(value) for key, value in record.items()}
+
+def format_date(value, default="未知"):
+    """日期时间显示为 YYYY-MM-DD，缺失时显示 default"""
+    return str(value)[:10] if value is not None else default
+
+def render_user_detail(user_id, detail):
+    """渲染单个用户的详细信息"""
     st.markdown("---")
     st.subheader(f"👤 用户 #{user_id} 详细信息")
     
     # 基本信息
-    user_info = execute_query("SELECT * FROM users WHERE id = %s", (user_id,))
-    if user_info.empty:
+    if detail is None:
         st.error("用户不存在")
         return
     
-    user = user_info.iloc[0]
+    # 分类列和可空整数列中的缺失值是 NaN / <NA> / NaT，先统一为 None
+    user = plain_record(detail.user)
     
     col1, col2, col3 = st.columns(3)
     with col1:
@@ -318,99 +1771,61 @@ def show_user_detail(user_id):
         st.metric("角色", user['preferredRoles'] or "未设置")
         st.metric("登录方式", user['loginMethod'] or "未知")
     with col3:
-        st.metric("注册时间", str(user['createdAt'])[:10])
-        st.metric("最后登录", str(user['lastSignedIn'])[:10])
+        st.metric("注册时间", format_date(user['createdAt']))
+        st.metric("最后登录", format_date(user['lastSignedIn']))
     
     # 个人资料
-    profiles = execute_query("SELECT * FROM profiles WHERE userId = %s", (user_id,))
-    if not profiles.empty:
+    if not detail.profiles.empty:
         st.markdown("### 📝 个人资料")
-        for idx, profile in profiles.iterrows():
-            with st.expander(f"{profile['userRole'].upper()} 资料"):
+        for profile in detail.profiles.to_dict("records"):
+            profile = plain_record(profile)
+            with st.expander(f"{(profile['userRole'] or '未知').upper()} 资料"):
                 col1, col2 = st.columns(2)
                 with col1:
                     st.write(f"**专业**: {profile['major'] or '未设置'}")
                     st.write(f"**年级**: {profile['year'] or '未设置'}")
                     if profile['userRole'] == 'tutor':
-                        st.write(f"**价格范围**: ${profile['priceMin']} - ${profile['priceMax']}")
+                        if profile['priceMin'] is None and profile['priceMax'] is None:
+                            st.write("**价格范围**: 未设置")
+                        else:
+                            st.write(f"**价格范围**: ${profile['priceMin'] or 0} - ${profile['priceMax'] or '不限'}")
                 with col2:
-                    st.write(f"**积分**: {profile['creditPoints']}")
+                    st.write(f"**积分**: {profile['creditPoints'] if profile['creditPoints'] is not None else 0}")
                     st.write(f"**简介**: {profile['bio'] or '无'}")
     
     # 会话统计
     st.markdown("### 📊 会话统计")
-    col1, col2, col3, col4 = st.columns(4)
     
     # 作为学生的会话
-    student_sessions = execute_query("""
-        SELECT 
-            COUNT(*) as total,
-            COALESCE(SUM(CASE WHEN status = 'CLOSED' THEN 1 ELSE 0 END), 0) as completed,
-            COALESCE(SUM(CASE WHEN status = 'CANCELLED' THEN 1 ELSE 0 END), 0) as cancelled,
-            COALESCE(SUM(CASE WHEN status = 'DISPUTED' THEN 1 ELSE 0 END), 0) as disputed
-        FROM sessions WHERE studentId = %s
-    """, (user_id,))
-    
-    if not student_sessions.empty:
-        s = student_sessions.iloc[0]
-        col1.metric("学生会话总数", int(s['total']) if s['total'] is not None else 0)
-        col2.metric("已完成", int(s['completed']) if s['completed'] is not None else 0)
-        col3.metric("已取消", int(s['cancelled']) if s['cancelled'] is not None else 0)
-        col4.metric("有争议", int(s['disputed']) if s['disputed'] is not None else 0)
+    col1, col2, col3, col4 = st.columns(4)
+    s = detail.student_stats
+    col1.metric("学生会话总数", s['total'])
+    col2.metric("已完成", s['completed'])
+    col3.metric("已取消", s['cancelled'])
+    col4.metric("有争议", s['disputed'])
     
     # 作为教师的会话
-    tutor_sessions = execute_query("""
-        SELECT 
-            COUNT(*) as total,
-            COALESCE(SUM(CASE WHEN status = 'CLOSED' THEN 1 ELSE 0 END), 0) as completed,
-            COALESCE(SUM(CASE WHEN status = 'CANCELLED' THEN 1 ELSE 0 END), 0) as cancelled,
-            COALESCE(SUM(CASE WHEN status = 'DISPUTED' THEN 1 ELSE 0 END), 0) as disputed
-        FROM sessions WHERE tutorId = %s
-    """, (user_id,))
-    
-    if not tutor_sessions.empty:
-        st.markdown("#### 作为教师")
-        col1, col2, col3, col4 = st.columns(4)
-        t = tutor_sessions.iloc[0]
-        col1.metric("教师会话总数", int(t['total']) if t['total'] is not None else 0)
-        col2.metric("已完成", int(t['completed']) if t['completed'] is not None else 0)
-        col3.metric("已取消", int(t['cancelled']) if t['cancelled'] is not None else 0)
-        col4.metric("有争议", int(t['disputed']) if t['disputed'] is not None else 0)
+    st.markdown("#### 作为教师")
+    col1, col2, col3, col4 = st.columns(4)
+    t = detail.tutor_stats
+    col1.metric("教师会话总数", t['total'])
+    col2.metric("已完成", t['completed'])
+    col3.metric("已取消", t['cancelled'])
+    col4.metric("有争议", t['disputed'])
     
     # 评分统计
     st.markdown("### ⭐ 评分统计")
-    ratings_received = execute_query("""
-        SELECT AVG(score) as avg_score, COUNT(*) as count
-        FROM ratings WHERE targetId = %s
-    """, (user_id,))
-    
-    if not ratings_received.empty and ratings_received.iloc[0]['count'] > 0:
-        r = ratings_received.iloc[0]
+    if detail.rating_count > 0:
         col1, col2 = st.columns(2)
-        col1.metric("平均评分", f"{float(r['avg_score']):.2f} / 5.0")
-        col2.metric("评分数量", int(r['count']))
+        col1.metric("平均评分", f"{detail.avg_score:.2f} / 5.0")
+        col2.metric("评分数量", detail.rating_count)
     else:
         st.info("暂无评分")
     
     # 最近会话
     st.markdown("### 📅 最近会话")
-    recent_sessions = execute_query("""
-        SELECT 
-            s.id, s.course, s.status, s.startTime,
-            CASE 
-                WHEN s.studentId = %s THEN CONCAT('教师: ', tutor.name)
-                ELSE CONCAT('学生: ', student.name)
-            END as partner
-        FROM sessions s
-        LEFT JOIN users student ON s.studentId = student.id
-        LEFT JOIN users tutor ON s.tutorId = tutor.id
-        WHERE s.studentId = %s OR s.tutorId = %s
-        ORDER BY s.createdAt DESC
-        LIMIT 10
-    """, (user_id, user_id, user_id))
-    
-    if not recent_sessions.empty:
-        st.dataframe(recent_sessions, use_container_width=True, hide_index=True)
+    if not detail.recent_sessions.empty:
+        st.dataframe(detail.recent_sessions, use_container_width=True, hide_index=True)
     else:
         st.info("暂无会话记录")
 
@@ -427,15 +1842,11 @@ def delete_user(user_id):
     with col1:
         if st.button("✅ 确认删除", type="primary", key=f"confirm_delete_{user_id}"):
             # 软删除：更新用户名为 "已删除用户"
-            success = execute_update("""
-                UPDATE users 
-                SET name = CONCAT('已删除用户_', id),
-                    email = CONCAT('deleted_', id, '@deleted.com'),
-                    role = 'user'
-                WHERE id = %s
-            """, (user_id,))
+            success = execute_update(SOFT_DELETE_USER_QUERY, (user_id,))
             
             if success:
+                # 让搜索索引在下次搜索时立即拉取变更
+                get_user_search_index().last_refresh = 0.0
                 st.success(f"✅ 用户 #{user_id} 已删除")
                 st.rerun()
             else:
@@ -484,9 +1895,7 @@ def show_sessions():
         query += " AND s.status = %s"
         params.append(status_map[status_filter])
     
-    query += " ORDER BY s.createdAt DESC LIMIT 100"
-    
-    sessions = execute_query(query, params if params else None)
+    sessions = paginated_query("sessions", query, params, "s.createdAt", "s.id")
     
     if not sessions.empty:
         st.dataframe(sessions, use_container_width=True, hide_index=True)
@@ -494,39 +1903,638 @@ def show_sessions():
     else:
         st.info("没有找到会话")
 
-def show_disputes():
-    """显示争议处理"""
-    st.title("⚠️ 争议处理")
+    st.markdown("---")
+    session_chat_fragment()
     
-    query = """
-        SELECT 
-            s.id,
-            student.name as student_name,
-            tutor.name as tutor_name,
-            s.course,
-            s.startTime,
-            s.endTime,
-            s.cancelReason,
-            s.createdAt
+    st.markdown("---")
+    schedule_conflicts_fragment()
+
+@page_fragment
+def session_chat_fragment():
+    """按会话 ID 查看聊天记录"""
+    st.subheader("💬 聊天记录")
+    session_id = st.number_input("会话 ID", min_value=1, step=1, value=None, key="session_chat_id")
+    if session_id:
+        render_chat_transcript(session_id)
+
+# 重复预约检测配置
+SCHEDULE_CONFLICT_REFRESH_INTERVAL = int(os.getenv("SCHEDULE_CONFLICT_REFRESH_INTERVAL", "30"))
+CONFLICT_ROLES = {"tutor": "tutorId", "student": "studentId"}
+CONFLICT_DISPLAY_LIMIT = 200
+CONFLICT_CHUNK_SIZE = int(os.getenv("CONFLICT_CHUNK_SIZE", "100000"))
+
+def find_overlaps(ids, users, starts, ends):
+    """按 (用户, 开始时间) 排序后一次扫描，找出与同一用户更早开始的会话时间重叠的会话
+
+    对每个冲突会话给出之前结束最晚的那个会话作为冲突对象。O(n log n)，全部为 NumPy 向量运算。
+    返回 (session_ids, other_ids, user_ids)。
+    """
+    valid = (users > 0) & (ends > starts)
+    ids, users, starts, ends = ids[valid], users[valid], starts[valid], ends[valid]
+    if len(ids) < 2:
+        empty = np.empty(0, dtype=np.int64)
+        return empty, empty, empty
+    
+    order = np.lexsort((starts, users))
+    ids, users, starts, ends = ids[order], users[order], starts[order], ends[order]
+    group_start = np.r_[True, users[1:] != users[:-1]]
+    
+    # 每个用户的区间平移到互不重叠的区段，一次 maximum.accumulate 即得到组内“之前最晚的结束时间”
+    base = starts.min()
+    span = int(ends.max() - base) + 1
+    offset = (np.cumsum(group_start) - 1) * span
+    shifted_start = starts - base + offset
+    shifted_end = ends - base + offset
+    running_end = np.maximum.accumulate(shifted_end)
+    positions = np.arange(len(ids))
+    holder = np.maximum.accumulate(np.where(shifted_end == running_end, positions, 0))
+    
+    conflict = np.zeros(len(ids), dtype=bool)
+    conflict[1:] = ~group_start[1:] & (shifted_start[1:] < running_end[:-1])
+    current = positions[conflict]
+    previous = holder[current - 1]
+    return ids[current], ids[previous], users[current]
+
+class ScheduleConflicts:
+    """教师 / 学生重复预约（时间重叠的未取消会话）
+
+    首次全表扫描用 find_overlaps 计算；之后按 (updatedAt, id) 高水位找出变更的会话，
+    移除它们原有的冲突，再用 (tutorId / studentId, startTime) 索引探测变更会话及其原冲突对象的重叠。
+    全表扫描每个冲突会话只记一个冲突对象，所以原冲突对象也要重新探测，
+    否则 A–B、B–C 两条记录在 B 改期后会丢掉仍然存在的 A–C 冲突。
+    """
+
+    def __init__(self):
+        self.conflicts = {}  # (角色, 较小会话 id, 较大会话 id) -> 用户 id
+        self.watermark = None
+        self.built = False
+        self.last_refresh = 0.0
+        self._lock = threading.Lock()  # 串行化刷新
+        self._pairs_lock = threading.Lock()  # 保护 conflicts 的读写
+
+    @staticmethod
+    def _pairs(role, sessions, others, users):
+        for session_id, other_id, user_id in zip(sessions, others, users):
+            a, b = sorted((int(session_id), int(other_id)))
+            yield (role, a, b), int(user_id)
+
+    def add(self, role, sessions, others, users):
+        with self._pairs_lock:
+            self.conflicts.update(self._pairs(role, sessions, others, users))
+
+    def replace(self, groups):
+        """用全量计算结果 [(角色, sessions, others, users), ...] 整体替换"""
+        conflicts = {}
+        for group in groups:
+            conflicts.update(self._pairs(*group))
+        with self._pairs_lock:
+            self.conflicts = conflicts
+
+    def discard_sessions(self, session_ids):
+        """移除涉及这些会话的冲突，返回被移除冲突中的其他会话 id（需要重新探测）"""
+        session_ids = set(session_ids)
+        partners = set()
+        with self._pairs_lock:
+            kept = {}
+            for key, user in self.conflicts.items():
+                if key[1] in session_ids or key[2] in session_ids:
+                    partners.update(key[1:])
+                else:
+                    kept[key] = user
+            self.conflicts = kept
+        return partners - session_ids
+
+    def frame(self):
+        with self._pairs_lock:
+            items = list(self.conflicts.items())
+        return pd.DataFrame(
+            [(role, user, a, b) for (role, a, b), user in items],
+            columns=['role', 'user_id', 'session_a', 'session_b'],
+        )
+
+@st.cache_resource
+def get_schedule_conflicts():
+    """获取进程内共享的重复预约检测结果"""
+    return ScheduleConflicts()
+
+def build_schedule_conflicts(conflicts, chunk_size=CONFLICT_CHUNK_SIZE):
+    """流式读取全部未取消会话的时间区间，全量计算冲突"""
+    head = execute_query("SELECT updatedAt, id FROM sessions ORDER BY updatedAt DESC, id DESC LIMIT 1",
+                         use_cache=False)
+    watermark = (to_db_value(head.iloc[0]['updatedAt']), to_db_value(head.iloc[0]['id'])) if not head.empty else None
+    
+    chunks = []
+    with streaming_cursor("""
+        SELECT id, COALESCE(studentId, 0), COALESCE(tutorId, 0),
+               CAST(UNIX_TIMESTAMP(startTime) AS SIGNED), CAST(UNIX_TIMESTAMP(endTime) AS SIGNED)
+        FROM sessions
+        WHERE status <> 'CANCELLED' AND startTime IS NOT NULL AND endTime IS NOT NULL
+    """) as cursor:
+        while True:
+            rows = cursor.fetchmany(chunk_size)
+            if not rows:
+                break
+            chunks.append(np.array(rows, dtype=np.int64).reshape(-1, 5))
+    data = np.concatenate(chunks) if chunks else np.empty((0, 5), dtype=np.int64)
+    
+    conflicts.replace([
+        (role, *find_overlaps(data[:, 0], data[:, column], data[:, 3], data[:, 4]))
+        for role, column in (("student", 1), ("tutor", 2))
+    ])
+    conflicts.watermark = watermark
+    conflicts.built = True
+
+def probe_schedule_conflicts(conflicts, session_ids):
+    """用区间索引探测指定会话与同一用户其他会话的重叠"""
+    for start in range(0, len(session_ids), WATERMARK_BATCH_SIZE):
+        condition, params = id_in_clause("c.id", session_ids[start:start + WATERMARK_BATCH_SIZE])
+        for role, column in CONFLICT_ROLES.items():
+            rows = execute_query(f"""
+                SELECT c.id as session_id, o.id as other_id, c.{column} as user_id
+                FROM sessions c
+                JOIN sessions o ON o.{column} = c.{column}
+                    AND o.startTime < c.endTime AND o.endTime > c.startTime
+                    AND o.id <> c.id AND o.status <> 'CANCELLED'
+                WHERE {condition} AND c.status <> 'CANCELLED'
+            """, params, use_cache=False)
+            if not rows.empty:
+                conflicts.add(role, rows['session_id'], rows['other_id'], rows['user_id'])
+
+def refresh_schedule_conflicts(conflicts, force=False):
+    """首次全量计算，之后只重新检查新建或变更的会话"""
+    if not force and time.monotonic() - conflicts.last_refresh < SCHEDULE_CONFLICT_REFRESH_INTERVAL:
+        return
+    with conflicts._lock:
+        if force or not conflicts.built:
+            build_schedule_conflicts(conflicts)
+        else:
+            changed = []
+            for rows in iter_changed_rows("sessions", "id, updatedAt", conflicts.watermark):
+                changed.extend(int(i) for i in rows['id'])
+                last = rows.iloc[-1]
+                conflicts.watermark = (to_db_value(last['updatedAt']), to_db_value(last['id']))
+            if changed:
+                partners = conflicts.discard_sessions(changed)
+                probe_schedule_conflicts(conflicts, changed + sorted(partners))
+        conflicts.last_refresh = time.monotonic()
+
+@page_fragment
+def schedule_conflicts_fragment():
+    """重复预约检测：同一教师或学生时间重叠的未取消会话"""
+    st.subheader("⏰ 重复预约检测")
+    
+    conflicts = get_schedule_conflicts()
+    col1, col2 = st.columns([4, 1])
+    with col2:
+        force = st.button("🔄 全量重新扫描", key="conflicts_rescan")
+    try:
+        refresh_schedule_conflicts(conflicts, force=force)
+    except mysql.connector.Error as err:
+        st.error(f"数据库查询错误: {err}")
+        return
+    
+    frame = conflicts.frame()
+    with col1:
+        st.caption("每个冲突会话至少列出一个与它时间重叠的同一用户的会话；新建或改期的会话自动增量检查")
+    if frame.empty:
+        st.success("✅ 没有发现重复预约")
+        return
+    
+    col1, col2 = st.columns(2)
+    col1.metric("教师冲突", int((frame['role'] == "tutor").sum()))
+    col2.metric("学生冲突", int((frame['role'] == "student").sum()))
+    
+    frame = frame.sort_values('session_b', ascending=False).head(CONFLICT_DISPLAY_LIMIT)
+    session_ids = sorted(set(frame['session_a']) | set(frame['session_b']))
+    condition, params = id_in_clause("s.id", [int(i) for i in session_ids])
+    details = execute_query(f"""
+        SELECT s.id, s.status, s.course, s.startTime, s.endTime,
+               student.name as student_name, tutor.name as tutor_name
         FROM sessions s
         LEFT JOIN users student ON s.studentId = student.id
         LEFT JOIN users tutor ON s.tutorId = tutor.id
-        WHERE s.status = 'DISPUTED'
-        ORDER BY s.createdAt DESC
+        WHERE {condition}
+    """, params)
+    if details.empty:
+        return
+    details = details.set_index('id')
+    
+    def describe(session_id):
+        if session_id not in details.index:
+            return ""
+        row = details.loc[session_id]
+        return f"#{session_id} {row['course'] or ''} {row['startTime']:%m-%d %H:%M}~{row['endTime']:%H:%M}"
+    
+    frame['角色'] = frame['role'].map({"tutor": "教师", "student": "学生"})
+    frame['用户'] = [
+        details.loc[a, 'tutor_name' if role == "tutor" else 'student_name'] if a in details.index else user
+        for role, a, user in zip(frame['role'], frame['session_a'], frame['user_id'])
+    ]
+    frame['会话 A'] = frame['session_a'].map(describe)
+    frame['会话 B'] = frame['session_b'].map(describe)
+    st.dataframe(frame[['角色', '用户', 'user_id', '会话 A', '会话 B']], use_container_width=True, hide_index=True)
+    
+    # 选中一组冲突，展开两个会话的完整信息
+    choice = st.selectbox(
+        "查看冲突会话",
+        list(zip(frame['session_a'], frame['session_b'])),
+        format_func=lambda pair: f"#{pair[0]} ↔ #{pair[1]}",
+        key="conflict_choice",
+    )
+    if choice:
+        st.dataframe(details.loc[[i for i in choice if i in details.index]].reset_index(),
+                     use_container_width=True, hide_index=True)
+
+# 实时队列配置
+LIVE_QUEUE_POLL_SECONDS = int(os.getenv("LIVE_QUEUE_POLL_SECONDS", "10"))
+
+class LiveQueue:
+    """会话内的实时队列
+
+    首次全量加载处于 statuses 状态的行，之后按 (updatedAt, id) 高水位只拉取变更过的行，
+    合并进已有结果：状态离开队列的行移除，新进入队列的行标记为新项。
+    无变更时每次轮询只是一次命中 (updatedAt, id) 索引的空范围查询。
     """
+
+    def __init__(self, table, alias, statuses, detail_query, sort_field):
+        self.table = table
+        self.alias = alias
+        self.statuses = statuses
+        self.detail_query = detail_query
+        self.sort_field = sort_field
+        self.key = f"live_queue:{table}"
+        self.watermark = None
+        self.new_ids = set()
+        self.last_poll = None
+
+    @property
+    def rows(self):
+        """队列中的行，存放在会话结果缓存中；被内存预算淘汰后为 None，下次轮询时重新全量加载"""
+        return get_session_frames().get(self.key)
+
+    @rows.setter
+    def rows(self, value):
+        get_session_frames().put(self.key, value)
+
+    def _fetch(self, condition, params):
+        rows = execute_query(self.detail_query.format(condition=condition), params, use_cache=False)
+        return rows.set_index('id', drop=False) if not rows.empty else rows
+
+    def load(self):
+        """全量加载；先取高水位，加载期间发生的变更会在下次轮询中补上"""
+        head = execute_query(
+            f"SELECT updatedAt, id FROM {self.table} ORDER BY updatedAt DESC, id DESC LIMIT 1",
+            use_cache=False,
+        )
+        if not head.empty:
+            self.watermark = (to_db_value(head.iloc[0]['updatedAt']), to_db_value(head.iloc[0]['id']))
+        self.rows = self._fetch(*id_in_clause(f"{self.alias}.status", self.statuses))
+        self.new_ids.clear()
+        self.last_poll = datetime.now()
+
+    def poll(self):
+        """拉取高水位之后变更的行并合并，返回新进入队列的 id 列表"""
+        if self.rows is None:
+            self.load()
+            return []
+        changed = []
+        for rows in iter_changed_rows(self.table, "id, status, updatedAt", self.watermark):
+            changed.append(rows)
+            last = rows.iloc[-1]
+            self.watermark = (to_db_value(last['updatedAt']), to_db_value(last['id']))
+        self.last_poll = datetime.now()
+        if not changed:
+            return []
+        
+        changed = pd.concat(changed, ignore_index=True)
+        active = changed['status'].isin(self.statuses)
+        leaving = [int(i) for i in changed.loc[~active, 'id']]
+        entering = [int(i) for i in changed.loc[active, 'id']]
+        rows = self.rows
+        previous = set(rows.index) if not rows.empty else set()
+        if not rows.empty:
+            rows = rows.drop(index=leaving + entering, errors='ignore')
+        self.new_ids.difference_update(leaving)
+        
+        added = []
+        if entering:
+            fresh = self._fetch(*id_in_clause(f"{self.alias}.id", entering))
+            if not fresh.empty:
+                added = [i for i in fresh.index if i not in previous]
+                rows = pd.concat([rows, fresh]) if not rows.empty else fresh
+                rows = rows.sort_values(self.sort_field, ascending=False)
+        self.rows = rows
+        self.new_ids.update(added)
+        return added
+
+def get_live_queue(key, factory):
+    """获取当前管理员会话中的实时队列（不存在时创建）"""
+    if key not in st.session_state:
+        st.session_state[key] = factory()
+    return st.session_state[key]
+
+def render_live_queue(queue, label, live=False):
+    """轮询一次并显示队列，新项标记 🆕"""
+    added = queue.poll()
+    if added:
+        st.toast(f"🆕 {len(added)} 个新的{label}")
+    
+    rows = queue.rows
+    col1, col2, col3 = st.columns([2, 2, 1])
+    with col3:
+        if st.button("✔️ 标为已读", key=f"{queue.table}_queue_ack", disabled=not queue.new_ids):
+            queue.new_ids.clear()
+    col1.metric(f"当前{label}", 0 if rows is None else len(rows))
+    col2.metric("未读", len(queue.new_ids))
     
-    disputes = execute_query(query)
+    if rows is not None and not rows.empty:
+        display = rows.copy()
+        display.insert(0, "新", np.where(display['id'].isin(list(queue.new_ids)), "🆕", ""))
+        st.dataframe(display, use_container_width=True, hide_index=True)
+    else:
+        st.success(f"✅ 暂无{label}")
+    refresh = f"，每 {LIVE_QUEUE_POLL_SECONDS} 秒自动刷新" if live else ""
+    st.caption(f"上次轮询: {queue.last_poll:%H:%M:%S}{refresh}")
+
+@page_fragment(run_every=LIVE_QUEUE_POLL_SECONDS)
+def live_queue_fragment(key, factory, label):
+    """定时重跑的实时队列片段，只执行增量轮询，不重跑整个页面"""
+    render_live_queue(get_live_queue(key, factory), label, live=True)
+
+DISPUTE_QUEUE_QUERY = """
+    SELECT 
+        s.id,
+        student.name as student_name,
+        tutor.name as tutor_name,
+        s.course,
+        s.status,
+        s.startTime,
+        s.endTime,
+        s.cancelReason,
+        s.createdAt
+    FROM sessions s
+    LEFT JOIN users student ON s.studentId = student.id
+    LEFT JOIN users tutor ON s.tutorId = tutor.id
+    WHERE {condition}
+    ORDER BY s.createdAt DESC
+"""
+
+TICKET_QUEUE_QUERY = """
+    SELECT 
+        t.id,
+        t.status,
+        t.category,
+        u.name as user_name,
+        u.email,
+        u.id as user_id,
+        t.subject,
+        t.message,
+        t.createdAt,
+        t.updatedAt
+    FROM tickets t
+    LEFT JOIN users u ON t.userId = u.id
+    WHERE {condition}
+    ORDER BY t.createdAt DESC
+"""
+
+def dispute_queue():
+    return LiveQueue("sessions", "s", ["DISPUTED"], DISPUTE_QUEUE_QUERY, "createdAt")
+
+def ticket_queue():
+    return LiveQueue("tickets", "t", ["pending", "in_progress"], TICKET_QUEUE_QUERY, "createdAt")
+
+def show_disputes():
+    """显示争议处理"""
+    st.title("⚠️ 争议处理")
     
-    if not disputes.empty:
-        st.warning(f"⚠️ 当前有 {len(disputes)} 个争议需要处理")
-        st.dataframe(disputes, use_container_width=True, hide_index=True)
+    if st.toggle("🔴 实时队列（自动刷新）", key="disputes_live"):
+        live_queue_fragment("live_queue_disputes", dispute_queue, "争议")
     else:
-        st.success("✅ 暂无争议会话")
+        render_live_queue(get_live_queue("live_queue_disputes", dispute_queue), "争议")
+    
+    st.markdown("---")
+    dispute_chat_fragment()
+
+@page_fragment
+def dispute_chat_fragment():
+    """查看争议会话的聊天记录"""
+    st.subheader("💬 聊天记录")
+    
+    rows = get_live_queue("live_queue_disputes", dispute_queue).rows
+    if rows is None or rows.empty:
+        return
+    labels = {
+        int(row.id): f"#{row.id} {row.student_name or '?'} ↔ {row.tutor_name or '?'} {row.course or ''}"
+        for row in rows.itertuples(index=False)
+    }
+    session_id = st.selectbox("选择争议会话", list(labels), format_func=labels.get, key="dispute_chat_session")
+    if session_id:
+        render_chat_transcript(session_id)
+
+# 聊天记录配置
+TRANSCRIPT_PAGE_SIZE = int(os.getenv("TRANSCRIPT_PAGE_SIZE", "50"))
+TRANSCRIPT_CACHE_SIZE = int(os.getenv("TRANSCRIPT_CACHE_SIZE", "32"))
+TRANSCRIPT_CACHE_MAX_MB = float(os.getenv("TRANSCRIPT_CACHE_MAX_MB", "32"))
+TRANSCRIPT_SEARCH_LIMIT = 100
+
+CHAT_PAGE_QUERY = """
+    SELECT cm.id, cm.senderId, u.name as sender_name, cm.message, cm.createdAt
+    FROM chatMessages cm
+    LEFT JOIN users u ON cm.senderId = u.id
+    WHERE cm.sessionId = %s AND {condition}
+    ORDER BY cm.id {order}
+    LIMIT %s
+"""
+
+class ChatTranscript:
+    """一个会话的聊天记录，按 (sessionId, id) keyset 分页懒加载
+
+    打开时只加载最新一页，“加载更早的消息”时再向前翻一页；再次打开时只拉取之后的新消息。
+    """
+
+    def __init__(self, session_id):
+        self.session_id = session_id
+        self.student_id = None
+        self.tutor_id = None
+        self.pages = []  # 从新到旧，每页按 id 升序
+        self.oldest_id = None
+        self.newest_id = None
+        self.exhausted = False
+        self.opened = False
+        self.nbytes = 0  # 已加载页的内存
+        self._lock = threading.Lock()
+
+    def open(self, page_size=TRANSCRIPT_PAGE_SIZE):
+        """首次打开加载会话双方和最新一页；之后只拉取新消息"""
+        with self._lock:
+            if not self.opened:
+                session = fetch_query("SELECT studentId, tutorId FROM sessions WHERE id = %s",
+                                      (self.session_id,), use_cache=False)
+                if not session.empty:
+                    self.student_id = to_db_value(session.iloc[0]['studentId'])
+                    self.tutor_id = to_db_value(session.iloc[0]['tutorId'])
+                self._load_older(page_size)
+                self.opened = True
+            elif self.newest_id is None:
+                # 上次打开时还没有消息
+                self.exhausted = False
+                self._load_older(page_size)
+            else:
+                newer = fetch_query(CHAT_PAGE_QUERY.format(condition="cm.id > %s", order="ASC"),
+                                    (self.session_id, self.newest_id, page_size), use_cache=False)
+                if not newer.empty:
+                    self.pages.insert(0, newer)
+                    self.nbytes += frame_bytes(newer)
+                    self.newest_id = int(newer['id'].iloc[-1])
+
+    def load_older(self, page_size=TRANSCRIPT_PAGE_SIZE):
+        with self._lock:
+            self._load_older(page_size)
+
+    def _load_older(self, page_size):
+        if self.exhausted:
+            return
+        if self.oldest_id is None:
+            condition, params = "1=1", (self.session_id, page_size)
+        else:
+            condition, params = "cm.id < %s", (self.session_id, self.oldest_id, page_size)
+        page = fetch_query(CHAT_PAGE_QUERY.format(condition=condition, order="DESC"), params, use_cache=False)
+        if len(page) < page_size:
+            self.exhausted = True
+        if page.empty:
+            return
+        page = page.iloc[::-1].reset_index(drop=True)
+        self.pages.append(page)
+        self.nbytes += frame_bytes(page)
+        self.oldest_id = int(page['id'].iloc[0])
+        if self.newest_id is None:
+            self.newest_id = int(page['id'].iloc[-1])
+
+    def messages(self):
+        """已加载的消息，按时间升序"""
+        with self._lock:
+            if not self.pages:
+                return pd.DataFrame(columns=['id', 'senderId', 'sender_name', 'message', 'createdAt'])
+            return pd.concat(self.pages[::-1], ignore_index=True)
+
+    def search(self, keyword, limit=TRANSCRIPT_SEARCH_LIMIT):
+        """在整个会话的聊天记录中搜索（只扫描该会话的消息）"""
+        return fetch_query(
+            CHAT_PAGE_QUERY.format(condition="cm.message LIKE %s", order="DESC"),
+            (self.session_id, f"%{keyword}%", limit),
+            use_cache=False,
+        )
+
+class TranscriptCache:
+    """最近打开的聊天记录 LRU，进程内共享
+
+    按条目数和已加载消息的字节数两个上限淘汰；记录加载新页后调用 trim() 重新检查。
+    """
+
+    def __init__(self, size=TRANSCRIPT_CACHE_SIZE, max_bytes=int(TRANSCRIPT_CACHE_MAX_MB * 1024 * 1024)):
+        self.size = size
+        self.max_bytes = max_bytes
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.evictions = 0
+
+    def get(self, session_id):
+        with self._lock:
+            transcript = self._entries.get(session_id)
+            if transcript is None:
+                transcript = ChatTranscript(session_id)
+                self._entries[session_id] = transcript
+            self._entries.move_to_end(session_id)
+            self._trim()
+            return transcript
+
+    def _trim(self):
+        """淘汰最久未打开的记录，最近打开的一条始终保留（需持有锁）"""
+        total = sum(transcript.nbytes for transcript in self._entries.values())
+        while len(self._entries) > 1 and (len(self._entries) > self.size or total > self.max_bytes):
+            _, transcript = self._entries.popitem(last=False)
+            total -= transcript.nbytes
+            self.evictions += 1
+
+    def trim(self):
+        with self._lock:
+            self._trim()
+
+    def bytes(self):
+        with self._lock:
+            return sum(transcript.nbytes for transcript in self._entries.values())
+
+@st.cache_resource
+def get_transcript_cache():
+    """获取进程内共享的聊天记录缓存"""
+    return TranscriptCache()
+
+def render_chat_transcript(session_id):
+    """显示会话聊天记录：默认最新一页，按需向前加载，支持会话内搜索"""
+    cache = get_transcript_cache()
+    transcript = cache.get(int(session_id))
+    try:
+        transcript.open()
+    except mysql.connector.Error as err:
+        st.error(f"数据库查询错误: {err}")
+        return
+    cache.trim()
+    
+    keyword = st.text_input("🔍 在本会话中搜索", key=f"chat_search_{session_id}")
+    if keyword:
+        try:
+            found = transcript.search(keyword)
+        except mysql.connector.Error as err:
+            st.error(f"数据库查询错误: {err}")
+            return
+        st.caption(f"找到 {len(found)} 条消息" + ("（只显示最新的部分）" if len(found) >= TRANSCRIPT_SEARCH_LIMIT else ""))
+        st.dataframe(found, use_container_width=True, hide_index=True)
+        return
+    
+    if not transcript.exhausted:
+        if st.button("⬆️ 加载更早的消息", key=f"chat_older_{session_id}"):
+            try:
+                transcript.load_older()
+            except mysql.connector.Error as err:
+                st.error(f"数据库查询错误: {err}")
+            cache.trim()
+    
+    messages = transcript.messages()
+    if messages.empty:
+        st.info("该会话暂无聊天记录")
+        return
+    st.caption(f"已加载 {len(messages)} 条消息" + ("（全部）" if transcript.exhausted else ""))
+    
+    with st.container(height=480):
+        for row in messages.itertuples(index=False):
+            if row.senderId == transcript.student_id:
+                role, avatar = "user", "🎓"
+            elif row.senderId == transcript.tutor_id:
+                role, avatar = "assistant", "👨‍🏫"
+            else:
+                role, avatar = "assistant", "🛡️"
+            with st.chat_message(role, avatar=avatar):
+                st.caption(f"{row.sender_name or row.senderId} · {row.createdAt:%Y-%m-%d %H:%M}")
+                st.text(row.message)
 
 def show_support_tickets():
-    """显示支持工单"""
+    """显示支持工单
+
+    列表和回复分别是独立片段：筛选、翻页只重跑列表查询，切换工单只重跑详情查询，
+    回复表单在提交前不触发任何重跑。
+    """
     st.title("💬 支持工单管理")
     
+    if st.toggle("🔴 实时队列（待处理 / 处理中，自动刷新）", key="tickets_live"):
+        live_queue_fragment("live_queue_tickets", ticket_queue, "待处理工单")
+    else:
+        ticket_list_fragment()
+    
+    ticket_reply_fragment()
+
+@page_fragment
+def ticket_list_fragment():
+    """工单列表"""
     status_filter = st.selectbox("工单状态", ["全部", "待处理", "处理中", "已解决"])
     
     query = """
@@ -553,60 +2561,64 @@ def show_support_tickets():
         query += " AND t.status = %s"
         params.append(status_map[status_filter])
     
-    query += " ORDER BY t.createdAt DESC LIMIT 100"
-    
-    tickets = execute_query(query, params if params else None)
+    tickets = paginated_query("tickets", query, params, "t.createdAt", "t.id")
     
     if not tickets.empty:
         st.dataframe(tickets, use_container_width=True, hide_index=True)
         st.caption(f"显示 {len(tickets)} 个工单")
-        
-        # 工单回复功能
-        st.markdown("---")
-        st.subheader("📝 回复工单")
-        
-        ticket_id = st.number_input("输入工单 ID", min_value=1, step=1, key="ticket_id")
-        
-        # 显示工单详情
-        ticket_detail = execute_query("SELECT * FROM tickets WHERE id = %s", (ticket_id,))
-        if not ticket_detail.empty:
-            ticket = ticket_detail.iloc[0]
-            
-            with st.expander("📋 工单详情", expanded=True):
-                st.write(f"**用户**: {ticket['userId']}")
-                st.write(f"**类别**: {ticket['category']}")
-                st.write(f"**主题**: {ticket['subject']}")
-                st.write(f"**内容**: {ticket['message']}")
-                st.write(f"**当前状态**: {ticket['status']}")
-                if ticket['adminResponse']:
-                    st.write(f"**已有回复**: {ticket['adminResponse']}")
-            
-            # 回复表单
-            col1, col2 = st.columns([3, 1])
-            with col1:
-                admin_response = st.text_area("管理员回复", key=f"response_{ticket_id}")
-            with col2:
-                new_status = st.selectbox("更新状态", ["pending", "in_progress", "resolved"], 
-                                         index=["pending", "in_progress", "resolved"].index(ticket['status']))
-            
-            if st.button("💾 提交回复", type="primary"):
-                if admin_response:
-                    success = execute_update("""
-                        UPDATE tickets 
-                        SET adminResponse = %s, status = %s, updatedAt = NOW()
-                        WHERE id = %s
-                    """, (admin_response, new_status, ticket_id))
-                    
-                    if success:
-                        st.success("✅ 回复已提交")
-                        st.rerun()
-                    else:
-                        st.error("提交失败")
-                else:
-                    st.warning("请输入回复内容")
     else:
         st.info("没有找到工单")
 
+@page_fragment
+def ticket_reply_fragment():
+    """工单详情和回复表单"""
+    st.markdown("---")
+    st.subheader("📝 回复工单")
+    
+    ticket_id = st.number_input("输入工单 ID", min_value=1, step=1, key="ticket_id")
+    
+    # 显示工单详情
+    ticket_detail = execute_query("SELECT * FROM tickets WHERE id = %s", (ticket_id,))
+    if ticket_detail.empty:
+        return
+    ticket = ticket_detail.iloc[0]
+    
+    with st.expander("📋 工单详情", expanded=True):
+        st.write(f"**用户**: {ticket['userId']}")
+        st.write(f"**类别**: {ticket['category']}")
+        st.write(f"**主题**: {ticket['subject']}")
+        st.write(f"**内容**: {ticket['message']}")
+        st.write(f"**当前状态**: {ticket['status']}")
+        if ticket['adminResponse']:
+            st.write(f"**已有回复**: {ticket['adminResponse']}")
+    
+    # 回复表单：输入过程中不重跑，提交时才执行
+    with st.form(f"ticket_reply_{ticket_id}"):
+        col1, col2 = st.columns([3, 1])
+        with col1:
+            admin_response = st.text_area("管理员回复", key=f"response_{ticket_id}")
+        with col2:
+            new_status = st.selectbox("更新状态", ["pending", "in_progress", "resolved"], 
+                                     index=["pending", "in_progress", "resolved"].index(ticket['status']))
+        submitted = st.form_submit_button("💾 提交回复", type="primary")
+    
+    if submitted:
+        if admin_response:
+            success = execute_update("""
+                UPDATE tickets 
+                SET adminResponse = %s, status = %s, updatedAt = NOW()
+                WHERE id = %s
+            """, (admin_response, new_status, ticket_id))
+            
+            if success:
+                st.success("✅ 回复已提交")
+                # 整页重跑，刷新工单列表
+                st.rerun()
+            else:
+                st.error("提交失败")
+        else:
+            st.warning("请输入回复内容")
+
 def show_ratings():
     """显示评分管理"""
     st.title("⭐ 评分管理")
@@ -626,178 +2638,2154 @@ def show_ratings():
         LEFT JOIN users rater ON r.raterId = rater.id
         LEFT JOIN users target ON r.targetId = target.id
         LEFT JOIN sessions s ON r.sessionId = s.id
-        ORDER BY r.createdAt DESC
-        LIMIT 100
+        WHERE 1=1
     """
     
-    ratings = execute_query(query)
+    ratings = paginated_query("ratings", query, None, "r.createdAt", "r.id")
     
-    if not ratings.empty:
-        # 平均分统计
-        avg_score = ratings['score'].mean()
-        st.metric("平均评分", f"{avg_score:.2f} / 5.0")
-        
+    mirror = get_analytics_mirror()
+    if mirror is not None:
+        # 全平台评分统计（分析镜像）
+        ensure_mirror_fresh(mirror)
+        render_mirror_freshness(mirror)
+        summary = mirror.query("SELECT AVG(score) as avg_score, COUNT(*) as count FROM ratings").iloc[0]
+        distribution = mirror.query("SELECT score, COUNT(*) as count FROM ratings GROUP BY score ORDER BY score")
+        col1, col2 = st.columns([1, 2])
+        with col1:
+            avg_score = 0.0 if pd.isna(summary['avg_score']) else float(summary['avg_score'])
+            st.metric("全平台平均评分", f"{avg_score:.2f} / 5.0")
+            st.metric("评分总数", int(summary['count']))
+        with col2:
+            if not distribution.empty:
+                st.bar_chart(distribution.set_index('score'))
         st.markdown("---")
+    
+    if not ratings.empty:
+        if mirror is None:
+            # 平均分统计（当前页）
+            avg_score = ratings['score'].mean()
+            st.metric("平均评分", f"{avg_score:.2f} / 5.0")
+            
+            st.markdown("---")
         
         st.dataframe(ratings, use_container_width=True, hide_index=True)
         st.caption(f"显示 {len(ratings)} 个评分")
     else:
         st.info("暂无评分数据")
 
+UPSERT_ADMIN_RATING_QUERY = """
+    INSERT INTO adminRatings (targetUserId, score, comment, createdAt, updatedAt)
+    VALUES (%s, %s, %s, NOW(), NOW())
+    ON DUPLICATE KEY UPDATE score = VALUES(score), comment = VALUES(comment), updatedAt = NOW()
+"""
+
+ADMIN_RATINGS_LIST_QUERY = """
+    SELECT 
+        ar.id,
+        u.name as user_name,
+        u.email,
+        ar.score,
+        ar.comment,
+        ar.createdAt,
+        ar.updatedAt
+    FROM adminRatings ar
+    LEFT JOIN users u ON ar.targetUserId = u.id
+    ORDER BY ar.updatedAt DESC
+"""
+
 def show_admin_rating():
-    """管理员评分系统 - 50% 权重"""
+    """管理员评分系统 - 50% 权重
+
+    搜索、评分对象和评分列表分别渲染：搜索只重跑搜索查询，切换评分对象只重跑
+    该用户的查询，评分表单在提交前不触发任何重跑。
+    """
     st.title("🎯 管理员评分系统")
     
     st.info("💡 管理员评分占用户总评分的 50% 权重，其他用户评分占 50% 权重")
     
-    # 创建管理员评分表（如果不存在）
-    create_admin_rating_table()
-    
-    # 用户搜索
     st.subheader("1️⃣ 选择要评分的用户")
+    admin_rating_search_fragment()
     
-    col1, col2 = st.columns([2, 1])
-    with col1:
-        search_user = st.text_input("搜索用户（姓名或邮箱）", key="admin_rating_search")
-    with col2:
-        user_id_direct = st.number_input("或直接输入用户 ID", min_value=1, step=1, key="admin_rating_user_id")
-    
-    # 搜索用户
-    if search_user:
-        users = execute_query("""
-            SELECT id, name, email, preferredRoles 
-            FROM users 
-            WHERE name LIKE %s OR email LIKE %s
-            LIMIT 10
-        """, (f"%{search_user}%", f"%{search_user}%"))
-        
-        if not users.empty:
-            st.dataframe(users, use_container_width=True, hide_index=True)
-    
-    # 评分表单
     st.markdown("---")
     st.subheader("2️⃣ 提交管理员评分")
+    admin_rating_form_fragment()
     
-    target_user_id = user_id_direct if user_id_direct > 0 else None
-    
-    if target_user_id:
-        # 显示用户当前评分
-        user_info = execute_query("SELECT name, email FROM users WHERE id = %s", (target_user_id,))
-        if not user_info.empty:
-            user = user_info.iloc[0]
-            st.write(f"**评分对象**: {user['name']} ({user['email']})")
-            
-            # 显示当前评分
-            current_ratings = get_weighted_rating(target_user_id)
-            col1, col2, col3 = st.columns(3)
-            col1.metric("用户平均评分", f"{current_ratings['user_avg']:.2f}")
-            col2.metric("管理员评分", f"{current_ratings['admin_score']:.2f}" if current_ratings['admin_score'] else "未评分")
-            col3.metric("最终加权评分", f"{current_ratings['final_score']:.2f}")
-            
-            st.markdown("---")
-            
-            # 评分输入
-            col1, col2 = st.columns([1, 2])
-            with col1:
-                admin_score = st.slider("评分 (1-5)", 1, 5, 3, key="admin_score_slider")
-            with col2:
-                admin_comment = st.text_area("评价说明（可选）", key="admin_comment")
-            
-            if st.button("💾 提交管理员评分", type="primary"):
-                # 检查是否已有管理员评分
-                existing = execute_query("""
-                    SELECT id FROM adminRatings WHERE targetUserId = %s
-                """, (target_user_id,))
-                
-                if not existing.empty:
-                    # 更新现有评分
-                    success = execute_update("""
-                        UPDATE adminRatings 
-                        SET score = %s, comment = %s, updatedAt = NOW()
-                        WHERE targetUserId = %s
-                    """, (admin_score, admin_comment, target_user_id))
-                else:
-                    # 插入新评分
-                    success = execute_update("""
-                        INSERT INTO adminRatings (targetUserId, score, comment, createdAt, updatedAt)
-                        VALUES (%s, %s, %s, NOW(), NOW())
-                    """, (target_user_id, admin_score, admin_comment))
-                
-                if success:
-                    st.success("✅ 管理员评分已提交")
-                    st.rerun()
-                else:
-                    st.error("提交失败")
-        else:
-            st.error("用户不存在")
-    else:
-        st.info("请选择或输入要评分的用户")
+    st.markdown("---")
+    with st.expander("🚨 可疑评分检测"):
+        show_rating_anomalies()
     
-    # 显示所有管理员评分
+    # 列表没有控件，只在整页重跑（如提交评分后）时刷新
     st.markdown("---")
     st.subheader("📋 所有管理员评分")
-    
-    admin_ratings = execute_query("""
-        SELECT 
-            ar.id,
-            u.name as user_name,
-            u.email,
-            ar.score,
-            ar.comment,
-            ar.createdAt,
-            ar.updatedAt
-        FROM adminRatings ar
-        LEFT JOIN users u ON ar.targetUserId = u.id
-        ORDER BY ar.updatedAt DESC
-    """)
-    
+    admin_ratings = execute_query(ADMIN_RATINGS_LIST_QUERY)
     if not admin_ratings.empty:
         st.dataframe(admin_ratings, use_container_width=True, hide_index=True)
     else:
         st.info("暂无管理员评分")
 
-def create_admin_rating_table():
-    """创建管理员评分表"""
-    execute_update("""
-        CREATE TABLE IF NOT EXISTS adminRatings (
-            id INT AUTO_INCREMENT PRIMARY KEY,
-            targetUserId INT NOT NULL,
-            score INT NOT NULL,
-            comment TEXT,
-            createdAt TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-            updatedAt TIMESTAMP DEFAULT CURRENT_TIMESTAMP ON UPDATE CURRENT_TIMESTAMP,
-            UNIQUE KEY unique_target (targetUserId)
-        )
-    """)
+@page_fragment
+def admin_rating_search_fragment():
+    """按姓名或邮箱搜索评分对象"""
+    search_user = st.text_input("搜索用户（姓名或邮箱）", key="admin_rating_search")
+    if not search_user:
+        return
+    
+    result = search_users(search_user, limit=10)
+    show_search_notes(result)
+    condition, id_params = id_in_clause("id", result.ids)
+    users = execute_query(f"""
+        SELECT id, name, email, preferredRoles 
+        FROM users 
+        WHERE {condition}
+        ORDER BY id DESC
+    """, id_params)
+    if not users.empty:
+        st.dataframe(users, use_container_width=True, hide_index=True)
 
-def get_weighted_rating(user_id):
-    """计算加权评分：管理员评分 50% + 用户评分 50%"""
-    # 获取用户平均评分
-    user_ratings = execute_query("""
-        SELECT AVG(score) as avg_score, COUNT(*) as count
-        FROM ratings WHERE targetId = %s
-    """, (user_id,))
+@page_fragment
+def admin_rating_form_fragment():
+    """评分对象的当前评分和评分表单"""
+    target_user_id = st.number_input("输入要评分的用户 ID", min_value=1, step=1, key="admin_rating_user_id")
     
-    user_avg = float(user_ratings.iloc[0]['avg_score']) if not user_ratings.empty and user_ratings.iloc[0]['avg_score'] else 0
+    # 评分对象和当前评分互不依赖，并发加载
+    results, errors = run_parallel({
+        "user_info": lambda: fetch_query("SELECT name, email FROM users WHERE id = %s", (target_user_id,)),
+        "current_ratings": lambda: get_weighted_rating(target_user_id),
+    })
+    show_query_errors(errors)
     
-    # 获取管理员评分
-    admin_rating = execute_query("""
-        SELECT score FROM adminRatings WHERE targetUserId = %s
-    """, (user_id,))
+    user_info = results.get("user_info", pd.DataFrame())
+    if user_info.empty:
+        st.error("用户不存在")
+        return
+    user = user_info.iloc[0]
+    st.write(f"**评分对象**: {user['name']} ({user['email']})")
     
-    admin_score = float(admin_rating.iloc[0]['score']) if not admin_rating.empty else None
+    try:
+        reasons = refresh_rating_graph(get_rating_graph()).flagged.get(int(target_user_id))
+    except mysql.connector.Error as err:
+        st.error(f"评分环检测失败: {err}")
+        reasons = None
+    if reasons:
+        st.warning(f"🚨 该用户的评分可能被操纵：{'、'.join(dict.fromkeys(reasons))}，请结合下方可疑评分检测判断")
     
-    # 计算最终评分
-    if admin_score is not None:
-        final_score = (admin_score * 0.5) + (user_avg * 0.5)
-    else:
-        final_score = user_avg
+    # 显示当前评分
+    current_ratings = results.get("current_ratings") or get_weighted_rating(target_user_id)
+    col1, col2, col3 = st.columns(3)
+    col1.metric("用户平均评分", f"{current_ratings['user_avg']:.2f}")
+    col2.metric("管理员评分", f"{current_ratings['admin_score']:.2f}" if current_ratings['admin_score'] else "未评分")
+    col3.metric("最终加权评分", f"{current_ratings['final_score']:.2f}")
     
-    return {
-        'user_avg': user_avg,
-        'admin_score': admin_score,
-        'final_score': final_score
+    st.markdown("---")
+    
+    # 评分输入：拖动滑块、输入说明不重跑，提交时才执行
+    with st.form("admin_rating_form"):
+        col1, col2 = st.columns([1, 2])
+        with col1:
+            admin_score = st.slider("评分 (1-5)", 1, 5, 3, key="admin_score_slider")
+        with col2:
+            admin_comment = st.text_area("评价说明（可选）", key="admin_comment")
+        submitted = st.form_submit_button("💾 提交管理员评分", type="primary")
+    
+    if submitted:
+        success = execute_update(UPSERT_ADMIN_RATING_QUERY, (target_user_id, admin_score, admin_comment))
+        
+        if success:
+            get_rating_engine().set_admin_score(target_user_id, admin_score)
+            st.success("✅ 管理员评分已提交")
+            # 整页重跑，刷新评分列表
+            st.rerun()
+        else:
+            st.error("提交失败")
+
+def show_rating_leaderboard():
+    """加权评分排行榜"""
+    st.title("🏆 评分排行榜")
+    
+    st.info("💡 最终评分 = 管理员评分 × 50% + 用户平均评分 × 50%（无管理员评分时为用户平均评分）")
+    
+    col1, col2, col3, col4 = st.columns(4)
+    with col1:
+        role_filter = st.selectbox("角色筛选", ["全部", "学生", "教师", "两者都是"], key="leaderboard_role")
+    with col2:
+        min_count = st.number_input("最少评分数", min_value=0, value=1, step=1, key="leaderboard_min_count")
+    with col3:
+        sort_labels = {"最终评分": "final_score", "用户平均评分": "user_avg",
+                       "管理员评分": "admin_score", "评分数量": "user_count"}
+        sort_by = st.selectbox("排序方式", list(sort_labels), key="leaderboard_sort")
+    with col4:
+        top_n = st.selectbox("显示数量", [50, 100, 200, 500], key="leaderboard_top_n")
+    
+    engine = get_rating_engine()
+    refresh_rating_engine(engine)
+    board = engine.snapshot()
+    
+    board = board[board['user_count'] >= min_count]
+    if role_filter != "全部":
+        role_map = {"学生": "student", "教师": "tutor", "两者都是": "both"}
+        index = get_user_search_index()
+        refresh_user_search_index(index)
+        board = board[board.index.isin(index.role_ids(role_map[role_filter]))]
+    
+    if board.empty:
+        st.info("暂无符合条件的评分数据")
+        return
+    
+    sort_col = sort_labels[sort_by]
+    board = board.sort_values([sort_col, 'user_count'], ascending=False, na_position='last').head(top_n)
+    
+    condition, id_params = id_in_clause("id", [int(uid) for uid in board.index])
+    users = execute_query(f"SELECT id, name, email, preferredRoles FROM users WHERE {condition}", id_params)
+    board = board.reset_index()
+    if not users.empty:
+        board = board.merge(users.rename(columns={'id': 'userId'}), on='userId', how='left')
+    board.insert(0, 'rank', range(1, len(board) + 1))
+    
+    columns = ['rank', 'userId', 'name', 'email', 'preferredRoles',
+               'final_score', 'user_avg', 'admin_score', 'user_count']
+    st.dataframe(
+        board[[c for c in columns if c in board.columns]].round({'final_score': 2, 'user_avg': 2}),
+        use_container_width=True,
+        hide_index=True
+    )
+    st.caption(f"显示前 {len(board)} 名（共 {len(engine.frame)} 个有评分的用户）")
+
+SOFT_DELETE_USER_QUERY = """
+    UPDATE users 
+    SET name = CONCAT('已删除用户_', id),
+        email = CONCAT('deleted_', id, '@deleted.com'),
+        role = 'user',
+        updatedAt = NOW()
+    WHERE id = %s
+"""
+
+def existing_ids(table, ids):
+    """返回 ids 中在表里存在的 id 集合"""
+    if not ids:
+        return set()
+    condition, params = id_in_clause("id", ids)
+    rows = execute_query(f"SELECT id FROM {table} WHERE {condition}", params, use_cache=False)
+    return set(int(x) for x in rows['id']) if not rows.empty else set()
+
+def run_bulk_action(ids, found, query, make_row):
+    """对存在的 id 分块执行批量语句，显示进度并返回每行结果的 DataFrame"""
+    targets = [i for i in ids if i in found]
+    progress_bar = st.progress(0.0, text="正在执行...")
+    
+    def update_progress(done, total):
+        progress_bar.progress(done / total, text=f"已处理 {done} / {total}")
+    
+    outcomes = dict(zip(targets, execute_many(query, [make_row(i) for i in targets], progress=update_progress)))
+    progress_bar.progress(1.0, text="✅ 执行完成")
+    
+    summary = []
+    for i in ids:
+        if i not in found:
+            summary.append((i, "⏭️ 跳过", "不存在"))
+        elif outcomes[i][0]:
+            summary.append((i, "✅ 成功", ""))
+        else:
+            summary.append((i, "❌ 失败", outcomes[i][1]))
+    return pd.DataFrame(summary, columns=["id", "结果", "说明"])
+
+def render_bulk_summary(summary):
+    """显示批量操作的结果汇总"""
+    col1, col2, col3 = st.columns(3)
+    col1.metric("成功", int((summary["结果"] == "✅ 成功").sum()))
+    col2.metric("失败", int((summary["结果"] == "❌ 失败").sum()))
+    col3.metric("跳过", int((summary["结果"] == "⏭️ 跳过").sum()))
+    st.dataframe(summary, use_container_width=True, hide_index=True)
+
+def show_bulk_actions():
+    """批量操作"""
+    st.title("🧰 批量操作")
+    
+    st.info(f"💡 批量操作按每 {BULK_CHUNK_SIZE} 行一个事务执行，某一块失败只回滚该块；"
+            "失败块中的每一行都标为失败（包括本身没有问题的行）")
+    
+    tab1, tab2, tab3 = st.tabs(["🗑️ 批量删除用户", "💬 批量处理工单", "🎯 批量管理员评分"])
+    with tab1:
+        bulk_delete_users()
+    with tab2:
+        bulk_update_tickets()
+    with tab3:
+        bulk_admin_ratings()
+
+def bulk_delete_users():
+    """批量软删除用户"""
+    ids = parse_ids(st.text_area("用户 ID（逗号、空格或换行分隔）", key="bulk_delete_ids"))
+    st.caption(f"已选择 {len(ids)} 个用户")
+    confirmed = st.checkbox("我确认要软删除以上用户（保留历史数据，用户将无法登录）", key="bulk_delete_confirm")
+    
+    if st.button("🗑️ 批量删除", type="primary", disabled=not (ids and confirmed)):
+        summary = run_bulk_action(ids, existing_ids("users", ids), SOFT_DELETE_USER_QUERY, lambda i: (i,))
+        get_user_search_index().last_refresh = 0.0
+        render_bulk_summary(summary)
+
+def bulk_update_tickets():
+    """批量设置工单状态和模板回复"""
+    select_pending = st.checkbox("选择所有待处理（pending）工单", key="bulk_ticket_pending")
+    if select_pending:
+        pending = execute_query("SELECT id FROM tickets WHERE status = 'pending' ORDER BY id")
+        ids = [int(x) for x in pending['id']] if not pending.empty else []
+    else:
+        ids = parse_ids(st.text_area("工单 ID（逗号、空格或换行分隔）", key="bulk_ticket_ids"))
+    st.caption(f"已选择 {len(ids)} 个工单")
+    
+    col1, col2 = st.columns([3, 1])
+    with col1:
+        template = st.text_area(
+            "回复模板（可用占位符：{id} {name} {subject}，留空则不修改回复）",
+            value="您好 {name}，关于「{subject}」的问题已处理，如有疑问请再次提交工单。",
+            key="bulk_ticket_template",
+        )
+    with col2:
+        new_status = st.selectbox("更新状态", ["resolved", "in_progress", "pending"], key="bulk_ticket_status")
+    
+    if st.button("💾 批量提交", type="primary", disabled=not ids):
+        condition, params = id_in_clause("t.id", ids)
+        tickets = execute_query(f"""
+            SELECT t.id, t.subject, u.name
+            FROM tickets t
+            LEFT JOIN users u ON t.userId = u.id
+            WHERE {condition}
+        """, params, use_cache=False)
+        info = {int(row.id): row for row in tickets.itertuples(index=False)} if not tickets.empty else {}
+        
+        if template:
+            try:
+                responses = {
+                    i: template.format(id=i, name=row.name or "", subject=row.subject or "")
+                    for i, row in info.items()
+                }
+            except (KeyError, IndexError, ValueError) as e:
+                st.error(f"回复模板有误: {e}")
+                return
+            summary = run_bulk_action(ids, set(info), """
+                UPDATE tickets 
+                SET adminResponse = %s, status = %s, updatedAt = NOW()
+                WHERE id = %s
+            """, lambda i: (responses[i], new_status, i))
+        else:
+            summary = run_bulk_action(ids, set(info), """
+                UPDATE tickets 
+                SET status = %s, updatedAt = NOW()
+                WHERE id = %s
+            """, lambda i: (new_status, i))
+        render_bulk_summary(summary)
+
+def bulk_admin_ratings():
+    """批量提交管理员评分"""
+    ids = parse_ids(st.text_area("用户 ID（逗号、空格或换行分隔）", key="bulk_rating_ids"))
+    st.caption(f"已选择 {len(ids)} 个用户")
+    
+    col1, col2 = st.columns([1, 2])
+    with col1:
+        score = st.slider("评分 (1-5)", 1, 5, 3, key="bulk_rating_score")
+    with col2:
+        comment = st.text_area("评价说明（可选）", key="bulk_rating_comment")
+    
+    if st.button("💾 批量评分", type="primary", disabled=not ids):
+        summary = run_bulk_action(ids, existing_ids("users", ids), UPSERT_ADMIN_RATING_QUERY,
+                                  lambda i: (i, score, comment))
+        engine = get_rating_engine()
+        for i in summary.loc[summary["结果"] == "✅ 成功", "id"]:
+            engine.set_admin_score(int(i), score)
+        render_bulk_summary(summary)
+
+# 数据库迁移：按版本号顺序执行，已执行的版本记录在 schema_migrations 表中
+MIGRATIONS = [
+    (1, "创建管理员评分表", [
+        """
+        CREATE TABLE IF NOT EXISTS adminRatings (
+            id INT AUTO_INCREMENT PRIMARY KEY,
+            targetUserId INT NOT NULL,
+            score INT NOT NULL,
+            comment TEXT,
+            createdAt TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            updatedAt TIMESTAMP DEFAULT CURRENT_TIMESTAMP ON UPDATE CURRENT_TIMESTAMP,
+            UNIQUE KEY unique_target (targetUserId)
+        )
+        """,
+    ]),
+    (2, "外键和状态列索引（原 setup_admin_features.sql）", [
+        "CREATE INDEX idx_tickets_status ON tickets(status)",
+        "CREATE INDEX idx_tickets_userId ON tickets(userId)",
+        "CREATE INDEX idx_sessions_status ON sessions(status)",
+        "CREATE INDEX idx_sessions_studentId ON sessions(studentId)",
+        "CREATE INDEX idx_sessions_tutorId ON sessions(tutorId)",
+        "CREATE INDEX idx_ratings_targetId ON ratings(targetId)",
+        "CREATE INDEX idx_ratings_raterId ON ratings(raterId)",
+        "CREATE INDEX idx_profiles_userId ON profiles(userId)",
+        "CREATE INDEX idx_profiles_userRole ON profiles(userRole)",
+    ]),
+    (3, "增量同步高水位和列表排序索引", [
+        "CREATE INDEX idx_users_updatedAt ON users(updatedAt, id)",
+        "CREATE INDEX idx_profiles_updatedAt ON profiles(updatedAt, id)",
+        "CREATE INDEX idx_sessions_updatedAt ON sessions(updatedAt, id)",
+        "CREATE INDEX idx_tickets_updatedAt ON tickets(updatedAt, id)",
+        "CREATE INDEX idx_adminRatings_updatedAt ON adminRatings(updatedAt, id)",
+        "CREATE INDEX idx_users_createdAt ON users(createdAt, id)",
+        "CREATE INDEX idx_sessions_createdAt ON sessions(createdAt, id)",
+        "CREATE INDEX idx_tickets_createdAt ON tickets(createdAt, id)",
+        "CREATE INDEX idx_ratings_createdAt ON ratings(createdAt, id)",
+    ]),
+    (4, "重复预约检测的时间区间索引", [
+        "CREATE INDEX idx_sessions_tutor_start ON sessions(tutorId, startTime)",
+        "CREATE INDEX idx_sessions_student_start ON sessions(studentId, startTime)",
+    ]),
+    (5, "聊天记录按会话分页索引", [
+        "CREATE INDEX idx_chatMessages_session ON chatMessages(sessionId, id)",
+    ]),
+    (6, "评分图同一会话互评查找索引", [
+        "CREATE INDEX idx_ratings_session_rater ON ratings(sessionId, raterId)",
+    ]),
+    (7, "用户列表按最近登录 / 姓名分页的索引", [
+        "CREATE INDEX idx_users_lastSignedIn ON users(lastSignedIn, id)",
+        # name 是 TEXT，不能直接建组合索引；用前 64 个字符的虚拟列作为排序键
+        "ALTER TABLE users ADD COLUMN nameSort VARCHAR(64) GENERATED ALWAYS AS (LEFT(name, 64)) VIRTUAL",
+        "CREATE INDEX idx_users_nameSort ON users(nameSort, id)",
+    ]),
+    (8, "评分表增加 updatedAt，加权评分引擎按 (updatedAt, id) 增量刷新", [
+        "ALTER TABLE ratings ADD COLUMN updatedAt TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP ON UPDATE CURRENT_TIMESTAMP",
+        "CREATE INDEX idx_ratings_updatedAt ON ratings(updatedAt, id)",
+    ]),
+]
+
+# 多个应用进程同时启动时，用 MySQL 命名锁保证只有一个进程执行迁移
+MIGRATION_LOCK_NAME = "unitutor_admin_migrations"
+MIGRATION_LOCK_TIMEOUT = int(os.getenv("MIGRATION_LOCK_TIMEOUT", "60"))
+
+def apply_migrations():
+    """执行尚未执行的迁移，返回 (本次执行的版本号列表, 跳过的版本号列表)。失败时抛出异常
+
+    索引已存在（手动执行过 setup_admin_features.sql 的库）视为已完成。
+    涉及的表不存在（如未启用聊天功能的库没有 chatMessages）时跳过该版本且不记录，
+    本进程不再重试；表建好后，下次进程启动时再执行。
+    """
+    conn = checkout_connection()
+    cursor = conn.cursor()
+    applied_now, skipped = [], []
+    try:
+        cursor.execute("SELECT GET_LOCK(%s, %s)", (MIGRATION_LOCK_NAME, MIGRATION_LOCK_TIMEOUT))
+        if cursor.fetchone()[0] != 1:
+            raise TimeoutError("等待迁移锁超时")
+        try:
+            cursor.execute("""
+                CREATE TABLE IF NOT EXISTS schema_migrations (
+                    version INT PRIMARY KEY,
+                    description VARCHAR(255) NOT NULL,
+                    appliedAt TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+                )
+            """)
+            cursor.execute("SELECT version FROM schema_migrations")
+            applied = {row[0] for row in cursor.fetchall()}
+            for version, description, statements in MIGRATIONS:
+                if version in applied:
+                    continue
+                missing_table = False
+                for statement in statements:
+                    try:
+                        cursor.execute(statement)
+                    except mysql.connector.Error as err:
+                        if err.errno == errorcode.ER_NO_SUCH_TABLE:
+                            missing_table = True
+                            break
+                        # 索引或列已存在（手动执行过，或上次迁移中途失败）视为已完成
+                        if err.errno not in (errorcode.ER_DUP_KEYNAME, errorcode.ER_DUP_FIELDNAME):
+                            raise
+                if missing_table:
+                    skipped.append(version)
+                    continue
+                cursor.execute(
+                    "INSERT INTO schema_migrations (version, description) VALUES (%s, %s)",
+                    (version, description),
+                )
+                conn.commit()
+                applied_now.append(version)
+        finally:
+            cursor.execute("SELECT RELEASE_LOCK(%s)", (MIGRATION_LOCK_NAME,))
+            cursor.fetchall()
+    finally:
+        cursor.close()
+        conn.close()
+    if applied_now:
+        get_query_cache().clear()
+    return applied_now, skipped
+
+@st.cache_resource
+def run_migrations():
+    """每个进程只执行一次迁移（包括因表不存在而跳过的版本）；失败时不缓存，下次渲染重试"""
+    return apply_migrations()
+
+# 加权评分引擎配置
+RATING_ENGINE_REFRESH_INTERVAL = int(os.getenv("RATING_ENGINE_REFRESH_INTERVAL", "30"))
+ADMIN_RATING_WEIGHT = 0.5
+
+class RatingEngine:
+    """批量加权评分引擎：管理员评分 50% + 用户评分 50%
+
+    ratings 按 (updatedAt, id) 高水位增量合并，adminRatings 按 updatedAt 高水位增量合并，
+    用 pandas 向量化计算所有用户的最终评分。
+    为每条评分记录上次计入的 (targetId, score)，存放在按评分 id 下标的数组中（0 表示未计入），
+    评分被修改时先从旧目标用户减去旧分数再计入新值。
+    """
+
+    def __init__(self):
+        self.frame = pd.DataFrame(
+            {'user_sum': pd.Series(dtype='int64'),
+             'user_count': pd.Series(dtype='int64'),
+             'admin_score': pd.Series(dtype='float64')},
+            index=pd.Index([], name='userId', dtype='int64'),
+        )
+        self._lock = threading.Lock()
+        self._refresh_lock = threading.Lock()  # 串行化增量刷新，防止同一批增量被重复累加
+        self._targets = np.zeros(0, dtype=np.int32)  # rating id -> 计入的 targetId
+        self._scores = np.zeros(0, dtype=np.int32)  # rating id -> 计入的 score
+        self.ratings_watermark = None  # ratings (updatedAt, id)
+        self.admin_watermark = None  # adminRatings.updatedAt
+        self.last_refresh = 0.0
+
+    def _reserve(self, max_id):
+        if max_id >= len(self._targets):
+            size = max(max_id + 1, len(self._targets) * 2)
+            targets = np.zeros(size, dtype=np.int32)
+            scores = np.zeros(size, dtype=np.int32)
+            targets[:len(self._targets)] = self._targets
+            scores[:len(self._scores)] = self._scores
+            self._targets, self._scores = targets, scores
+
+    def apply_ratings(self, rows):
+        """应用新增或变更的用户评分，rows 为按 (updatedAt, id) 排序的 (id, targetId, score, updatedAt)"""
+        ids, targets, scores = [], [], []
+        watermark = None
+        for rating_id, target_id, score, updated_at in rows:
+            watermark = (updated_at, int(rating_id))
+            ids.append(int(rating_id))
+            targets.append(int(target_id))
+            scores.append(int(score))
+        with self._lock:
+            if watermark is not None:
+                self.ratings_watermark = watermark
+            if not ids:
+                return
+            ids = np.array(ids, dtype=np.int64)
+            targets = np.array(targets, dtype=np.int32)
+            scores = np.array(scores, dtype=np.int32)
+            self._reserve(int(ids.max()))
+            old_targets = self._targets[ids]
+            old_scores = self._scores[ids]
+            counted = old_targets > 0
+            delta = pd.DataFrame({
+                'userId': np.concatenate([targets, old_targets[counted]]).astype('int64'),
+                'user_sum': np.concatenate([scores, -old_scores[counted]]).astype('int64'),
+                'user_count': np.concatenate([np.ones(len(ids), dtype='int64'),
+                                              np.full(int(counted.sum()), -1, dtype='int64')]),
+            }).groupby('userId').sum()
+            self._targets[ids] = targets
+            self._scores[ids] = scores
+            frame = self.frame.reindex(self.frame.index.union(delta.index))
+            frame[['user_sum', 'user_count']] = (
+                frame[['user_sum', 'user_count']].fillna(0).astype('int64')
+                .add(delta.reindex(frame.index, fill_value=0))
+            )
+            self.frame = self._compute(frame)
+
+    def merge_admin_scores(self, scores):
+        """合并管理员评分（列：userId, admin_score）"""
+        if scores.empty:
+            return
+        scores = scores.set_index('userId')['admin_score'].astype('float64')
+        with self._lock:
+            frame = self.frame.reindex(self.frame.index.union(scores.index))
+            frame[['user_sum', 'user_count']] = frame[['user_sum', 'user_count']].fillna(0).astype('int64')
+            frame.loc[scores.index, 'admin_score'] = scores
+            self.frame = self._compute(frame)
+
+    def set_admin_score(self, user_id, score):
+        """管理员提交评分后立即更新单个用户"""
+        self.merge_admin_scores(pd.DataFrame({'userId': [int(user_id)], 'admin_score': [float(score)]}))
+
+    @staticmethod
+    def _compute(frame):
+        counts = frame['user_count'].to_numpy()
+        sums = frame['user_sum'].to_numpy()
+        admin = frame['admin_score'].to_numpy(dtype='float64')
+        user_avg = np.divide(sums, counts, out=np.zeros(len(frame)), where=counts > 0)
+        frame['user_avg'] = user_avg
+        frame['final_score'] = np.where(
+            np.isnan(admin),
+            user_avg,
+            admin * ADMIN_RATING_WEIGHT + user_avg * (1 - ADMIN_RATING_WEIGHT),
+        )
+        return frame
+
+    def get(self, user_id):
+        """单个用户的加权评分"""
+        with self._lock:
+            if user_id not in self.frame.index:
+                return {'user_avg': 0, 'admin_score': None, 'final_score': 0, 'user_count': 0}
+            row = self.frame.loc[user_id]
+        admin_score = None if pd.isna(row['admin_score']) else float(row['admin_score'])
+        return {
+            'user_avg': float(row['user_avg']),
+            'admin_score': admin_score,
+            'final_score': float(row['final_score']),
+            'user_count': int(row['user_count']),
+        }
+
+    def snapshot(self):
+        """所有用户加权评分的副本"""
+        with self._lock:
+            return self.frame.copy()
+
+@st.cache_resource
+def get_rating_engine():
+    """获取进程内共享的加权评分引擎"""
+    return RatingEngine()
+
+def refresh_rating_engine(engine, force=False):
+    """增量拉取新的用户评分和管理员评分
+
+    读水位 → 查询 → 合并 → 推进水位在刷新锁内完成；等锁期间其他会话已刷新过则直接返回。
+    """
+    if not force and time.monotonic() - engine.last_refresh < RATING_ENGINE_REFRESH_INTERVAL:
+        return
+    requested = time.monotonic()
+    with engine._refresh_lock:
+        if engine.last_refresh >= requested or (
+            not force and time.monotonic() - engine.last_refresh < RATING_ENGINE_REFRESH_INTERVAL
+        ):
+            return
+        for rows in iter_changed_rows("ratings", "id, targetId, score, updatedAt", engine.ratings_watermark):
+            engine.apply_ratings(
+                (row.id, row.targetId, row.score, to_db_value(row.updatedAt))
+                for row in rows.itertuples(index=False)
+            )
+        
+        if engine.admin_watermark is None:
+            admin = execute_query("""
+                SELECT targetUserId as userId, score as admin_score, updatedAt
+                FROM adminRatings
+            """, use_cache=False)
+        else:
+            admin = execute_query("""
+                SELECT targetUserId as userId, score as admin_score, updatedAt
+                FROM adminRatings
+                WHERE updatedAt >= %s
+            """, (engine.admin_watermark,), use_cache=False)
+        if not admin.empty:
+            engine.merge_admin_scores(admin)
+            engine.admin_watermark = to_db_value(admin['updatedAt'].max())
+        engine.last_refresh = time.monotonic()
+
+def get_weighted_rating(user_id):
+    """计算加权评分：管理员评分 50% + 用户评分 50%"""
+    engine = get_rating_engine()
+    refresh_rating_engine(engine)
+    return engine.get(int(user_id))
+
+# 评分环检测配置
+RING_REFRESH_INTERVAL = int(os.getenv("RING_REFRESH_INTERVAL", "300"))
+RING_CHUNK_SIZE = int(os.getenv("RING_CHUNK_SIZE", "100000"))
+RING_MIN_SCORE = 4.5       # 互评双方的平均分都不低于该值视为互相刷分
+RING_MIN_RATINGS = 3       # 互评每个方向至少的有效评分数
+SAME_SESSION_WEIGHT = 0.5  # 同一会话内双方互评（正常的课后互评）只按半条计入有效评分
+RATER_MIN_RATINGS = 10     # 评分数少于该值的评分者不做偏差检测
+RATER_SKEW_SD = 1.5        # 评分者平均分偏离全站平均分的标准差倍数（按单条评分的离散程度，不随评分数缩小）
+RATER_FOCUS_SHARE = 0.8    # 评分集中给同一个人的比例阈值
+RATER_FOCUS_MIN_RATINGS = 10  # 给同一个人至少这么多条评分才做集中度检测
+RATER_FOCUS_LOW_SCORE = 1.5   # 集中给出的评分平均不高于该值（或不低于 RING_MIN_SCORE）才算异常
+
+@dataclass
+class RingReport:
+    """评分环检测结果"""
+    reciprocal: pd.DataFrame
+    cliques: pd.DataFrame
+    raters: pd.DataFrame
+    flagged: dict = field(default_factory=dict)  # user id -> [原因]
+    ratings: int = 0
+    edges: int = 0
+
+class RatingGraph:
+    """ratings 的稀疏 评分者 -> 被评分者 矩阵
+
+    以 COO 形式存储：边键为 (raterId << 32) | targetId，升序排列（同一评分者的边相邻），
+    每条边累计评分次数、分数和、平方和、极端分（1 或 5）次数，以及同一会话内有反向评分的次数。
+    ratings 只追加，按 id 高水位分块增量合并，内存只与不同的 (评分者, 被评分者) 对数有关，与评分总数无关。
+    """
+
+    def __init__(self):
+        self.keys = np.empty(0, dtype=np.int64)
+        self.stats = np.empty((0, 5), dtype=np.int64)  # count, sum, sumsq, extremes, same_session
+        self.watermark = 0  # ratings.id
+        self.last_refresh = 0.0
+        self.report = None
+        self._lock = threading.Lock()
+
+    def add_chunk(self, raters, targets, scores, paired=None):
+        """合并一块评分；各列为 int64 数组
+
+        paired[i] 为 1 表示同一会话中更早已有反向评分：这两条评分都计为同一会话互评，
+        所以本条边和反向边的 same_session 各加 1（与分块方式无关）。
+        """
+        paired = np.zeros_like(scores) if paired is None else paired
+        zeros = np.zeros_like(scores)
+        keys = np.concatenate([(raters << 32) | targets, (targets << 32) | raters])
+        chunk = np.concatenate([
+            np.column_stack([np.ones_like(scores), scores, scores * scores, (scores == 1) | (scores == 5), paired]),
+            np.column_stack([zeros, zeros, zeros, zeros, paired]),
+        ])
+        keep = chunk.any(axis=1)
+        keys, chunk = keys[keep], chunk[keep]
+        unique, inverse = np.unique(np.concatenate([self.keys, keys]), return_inverse=True)
+        stacked = np.concatenate([self.stats, chunk.astype(np.int64)])
+        self.stats = np.column_stack([
+            np.bincount(inverse, weights=stacked[:, i], minlength=len(unique)) for i in range(stacked.shape[1])
+        ]).astype(np.int64)
+        self.keys = unique
+
+    def analyze(self):
+        """检测互评刷分、互评小团体和评分偏差异常的评分者"""
+        keys, stats = self.keys, self.stats
+        raters, targets = keys >> 32, keys & 0xFFFFFFFF
+        counts, sums = stats[:, 0], stats[:, 1]
+        flagged = {}
+        
+        def flag(users, reason):
+            for user in users:
+                flagged.setdefault(int(user), []).append(reason)
+        
+        # 互评：(a, b) 与 (b, a) 的平均分都很高，且每个方向都有足够的有效评分；
+        # 同一会话内的互评是正常的课后流程，按 SAME_SESSION_WEIGHT 降权。在已排序的边键上二分查找反向边
+        effective = counts - SAME_SESSION_WEIGHT * stats[:, 4]
+        high = (sums >= RING_MIN_SCORE * counts) & (effective >= RING_MIN_RATINGS) & (raters != targets)
+        high_keys = keys[high]
+        reverse = (targets[high] << 32) | raters[high]
+        position = np.minimum(np.searchsorted(high_keys, reverse), max(len(high_keys) - 1, 0))
+        mutual = (high_keys[position] == reverse) & (raters[high] < targets[high]) if len(high_keys) else high_keys.astype(bool)
+        a, b = raters[high][mutual], targets[high][mutual]
+        forward = np.flatnonzero(high)[mutual]
+        backward = np.flatnonzero(high)[position[mutual]]
+        reciprocal = pd.DataFrame({
+            'user_a': a,
+            'user_b': b,
+            'a_to_b': counts[forward],
+            'a_to_b_avg': (sums[forward] / counts[forward]).round(2),
+            'b_to_a': counts[backward],
+            'b_to_a_avg': (sums[backward] / counts[backward]).round(2),
+            'same_session': stats[forward, 4],
+        }).sort_values(['a_to_b', 'b_to_a'], ascending=False)
+        flag(np.concatenate([a, b]), "互评高分")
+        
+        # 小团体：互评图中的三角形，按共享成员合并成组（互评图已经过滤，规模很小）
+        neighbors = {}
+        for u, v in zip(a.tolist(), b.tolist()):
+            neighbors.setdefault(u, set()).add(v)
+            neighbors.setdefault(v, set()).add(u)
+        parent = {}
+        
+        def find(x):
+            while parent.setdefault(x, x) != x:
+                parent[x] = parent[parent[x]]
+                x = parent[x]
+            return x
+        
+        triangles = []
+        for u, v in zip(a.tolist(), b.tolist()):
+            for w in neighbors[u] & neighbors[v]:
+                if w > v:
+                    parent[find(v)] = find(u)
+                    parent[find(w)] = find(u)
+                    triangles.append((u, v, w))
+        groups = {}
+        for triangle in triangles:
+            groups.setdefault(find(triangle[0]), set()).update(triangle)
+        cliques = pd.DataFrame(
+            [(sorted(members), len(members)) for members in groups.values()],
+            columns=['members', 'size'],
+        ).sort_values('size', ascending=False) if groups else pd.DataFrame(columns=['members', 'size'])
+        flag([user for members in groups.values() for user in members], "互评小团体")
+        
+        # 评分者偏差：按评分者分组（边键按评分者连续），与全站分布比较。
+        # 偏差按单条评分的标准差衡量（效应量），评分多的评分者不会因为标准误变小而被放大
+        rater_ids, starts = np.unique(raters, return_index=True)
+        empty = not len(starts)
+        totals = np.empty((0, stats.shape[1]), dtype=np.int64) if empty else np.add.reduceat(stats, starts, axis=0)
+        focus = np.empty(0, dtype=np.int64) if empty else np.maximum.reduceat(counts, starts)
+        n = totals[:, 0]
+        total_count = max(int(n.sum()), 1)
+        mean = stats[:, 1].sum() / total_count
+        std = np.sqrt(max(stats[:, 2].sum() / total_count - mean ** 2, 1e-9))
+        rater_mean = totals[:, 1] / np.maximum(n, 1)
+        deviation = (rater_mean - mean) / std
+        enough = n >= RATER_MIN_RATINGS
+        skewed = enough & (np.abs(deviation) >= RATER_SKEW_SD)
+        
+        # 集中度：只看给同一个人的评分足够多、且这些评分本身是极端分的评分者
+        # （学生主要约同一位教师并给出正常评分很常见）
+        group = np.repeat(np.arange(len(starts)), np.diff(np.append(starts, len(keys))))
+        edge_avg = sums / np.maximum(counts, 1)
+        is_top = counts == focus[group] if not empty else np.zeros(0, dtype=bool)
+        top_high = np.empty(0) if empty else np.maximum.reduceat(np.where(is_top, edge_avg, -np.inf), starts)
+        top_low = np.empty(0) if empty else np.minimum.reduceat(np.where(is_top, edge_avg, np.inf), starts)
+        focus_share = focus / np.maximum(n, 1)
+        focused = (enough & (focus >= RATER_FOCUS_MIN_RATINGS) & (focus_share >= RATER_FOCUS_SHARE)
+                   & ((top_high >= RING_MIN_SCORE) | (top_low <= RATER_FOCUS_LOW_SCORE)))
+        suspicious = skewed | focused
+        raters_frame = pd.DataFrame({
+            'rater': rater_ids[suspicious],
+            'ratings': n[suspicious],
+            'avg_score': rater_mean[suspicious].round(2),
+            'deviation_sd': deviation[suspicious].round(2),
+            'extreme_share': (totals[suspicious, 3] / n[suspicious]).round(2),
+            'top_target_share': focus_share[suspicious].round(2),
+        }).sort_values('deviation_sd', key=np.abs, ascending=False)
+        flag(rater_ids[skewed], "评分偏离全站分布")
+        flag(rater_ids[focused], "评分集中给同一用户")
+        
+        return RingReport(
+            reciprocal=reciprocal,
+            cliques=cliques,
+            raters=raters_frame,
+            flagged=flagged,
+            ratings=int(n.sum()),
+            edges=len(keys),
+        )
+
+@st.cache_resource
+def get_rating_graph():
+    """获取进程内共享的评分图"""
+    return RatingGraph()
+
+def refresh_rating_graph(graph, force=False, chunk_size=RING_CHUNK_SIZE):
+    """按 id 高水位流式读取新增评分，合并后重新检测"""
+    if not force and graph.report is not None and time.monotonic() - graph.last_refresh < RING_REFRESH_INTERVAL:
+        return graph.report
+    with graph._lock:
+        with streaming_cursor("""
+            SELECT r.raterId, r.targetId, r.score,
+                   EXISTS(SELECT 1 FROM ratings b
+                          WHERE b.sessionId = r.sessionId AND b.raterId = r.targetId
+                            AND b.targetId = r.raterId AND b.id < r.id) as paired,
+                   r.id
+            FROM ratings r
+            WHERE r.id > %s AND r.raterId IS NOT NULL AND r.targetId IS NOT NULL AND r.score IS NOT NULL
+            ORDER BY r.id
+        """, (graph.watermark,)) as cursor:
+            while True:
+                rows = cursor.fetchmany(chunk_size)
+                if not rows:
+                    break
+                data = np.array(rows, dtype=np.int64).reshape(-1, 5)
+                graph.add_chunk(data[:, 0], data[:, 1], data[:, 2], data[:, 3])
+                graph.watermark = int(data[-1, 4])
+        graph.report = graph.analyze()
+        graph.last_refresh = time.monotonic()
+    return graph.report
+
+@page_fragment
+def show_rating_anomalies():
+    """可疑评分：互评刷分、小团体和评分偏差"""
+    col1, col2 = st.columns([4, 1])
+    with col2:
+        force = st.button("🔄 重新检测", key="ring_refresh")
+    try:
+        report = refresh_rating_graph(get_rating_graph(), force=force)
+    except mysql.connector.Error as err:
+        st.error(f"数据库查询错误: {err}")
+        return
+    with col1:
+        st.caption(f"基于 {report.ratings:,} 条评分、{report.edges:,} 个评分者→被评分者组合；"
+                   f"每 {RING_REFRESH_INTERVAL // 60} 分钟增量更新")
+    
+    col1, col2, col3 = st.columns(3)
+    col1.metric("互评高分对", len(report.reciprocal))
+    col2.metric("互评小团体", len(report.cliques))
+    col3.metric("异常评分者", len(report.raters))
+    
+    if not report.reciprocal.empty:
+        st.markdown(f"**互评高分对**（双方平均分都 ≥ {RING_MIN_SCORE:.1f}，每个方向至少 {RING_MIN_RATINGS} 条有效评分；"
+                    f"同一会话内的互评按 {SAME_SESSION_WEIGHT:g} 条计）")
+        st.dataframe(report.reciprocal.head(200), use_container_width=True, hide_index=True)
+    if not report.cliques.empty:
+        st.markdown("**互评小团体**（互评高分构成的三角形）")
+        st.dataframe(report.cliques, use_container_width=True, hide_index=True)
+    if not report.raters.empty:
+        st.markdown(f"**异常评分者**（至少 {RATER_MIN_RATINGS} 条评分，平均分偏离全站 ≥ {RATER_SKEW_SD:g} 个标准差；"
+                    f"或至少 {RATER_FOCUS_MIN_RATINGS} 条、≥ {RATER_FOCUS_SHARE:.0%} 的评分给同一用户且都是极端分）")
+        st.dataframe(report.raters.head(200), use_container_width=True, hide_index=True)
+
+# 分析镜像配置（可选，需要 pip install duckdb）
+ANALYTICS_MIRROR_ENABLED = os.getenv("ANALYTICS_MIRROR", "0") == "1"
+ANALYTICS_MIRROR_PATH = os.getenv("ANALYTICS_MIRROR_PATH", "analytics_mirror.duckdb")
+ANALYTICS_SYNC_INTERVAL = int(os.getenv("ANALYTICS_SYNC_INTERVAL", "60"))
+
+# 镜像表结构；incremental 为增量同步方式：updatedAt 高水位或只追加表的 id 高水位
+MIRROR_TABLES = {
+    "users": {
+        "incremental": "updatedAt",
+        "columns": {
+            "id": "BIGINT PRIMARY KEY", "name": "VARCHAR", "email": "VARCHAR", "role": "VARCHAR",
+            "preferredRoles": "VARCHAR", "createdAt": "TIMESTAMP", "updatedAt": "TIMESTAMP",
+            "lastSignedIn": "TIMESTAMP",
+        },
+    },
+    "profiles": {
+        "incremental": "updatedAt",
+        "columns": {
+            "id": "BIGINT PRIMARY KEY", "userId": "BIGINT", "userRole": "VARCHAR", "major": "VARCHAR",
+            "courses": "VARCHAR", "creditPoints": "BIGINT", "createdAt": "TIMESTAMP", "updatedAt": "TIMESTAMP",
+        },
+    },
+    "sessions": {
+        "incremental": "updatedAt",
+        "columns": {
+            "id": "BIGINT PRIMARY KEY", "studentId": "BIGINT", "tutorId": "BIGINT", "course": "VARCHAR",
+            "status": "VARCHAR", "startTime": "TIMESTAMP", "endTime": "TIMESTAMP",
+            "createdAt": "TIMESTAMP", "updatedAt": "TIMESTAMP",
+        },
+    },
+    "ratings": {
+        "incremental": "id",
+        "columns": {
+            "id": "BIGINT PRIMARY KEY", "sessionId": "BIGINT", "raterId": "BIGINT", "targetId": "BIGINT",
+            "score": "INTEGER", "visibility": "VARCHAR", "createdAt": "TIMESTAMP",
+        },
+    },
+    "tickets": {
+        "incremental": "updatedAt",
+        "columns": {
+            "id": "BIGINT PRIMARY KEY", "userId": "BIGINT", "category": "VARCHAR", "status": "VARCHAR",
+            "subject": "VARCHAR", "createdAt": "TIMESTAMP", "updatedAt": "TIMESTAMP",
+        },
+    },
+}
+
+class AnalyticsMirror:
+    """本地 DuckDB 列式分析镜像
+
+    从 MySQL 按高水位增量复制 sessions / ratings / users / profiles / tickets，
+    聚合分析在本地执行，不再占用线上 OLTP 数据库。
+    """
+
+    def __init__(self, path=ANALYTICS_MIRROR_PATH):
+        self.path = path
+        self.con = duckdb.connect(path)
+        self._lock = threading.Lock()
+        with self._lock:
+            for table, spec in MIRROR_TABLES.items():
+                columns = ", ".join(f'"{name}" {ddl}' for name, ddl in spec["columns"].items())
+                self.con.execute(f'CREATE TABLE IF NOT EXISTS "{table}" ({columns})')
+            self.con.execute("""
+                CREATE TABLE IF NOT EXISTS _watermarks (
+                    table_name VARCHAR PRIMARY KEY,
+                    updated_at TIMESTAMP,
+                    last_id BIGINT,
+                    synced_at TIMESTAMP
+                )
+            """)
+
+    def watermark(self, table):
+        with self._lock:
+            row = self.con.execute(
+                "SELECT updated_at, last_id FROM _watermarks WHERE table_name = ?", [table]
+            ).fetchone()
+        return row
+
+    def _apply_batch(self, table, rows, watermark):
+        columns = ", ".join(f'"{name}"' for name in MIRROR_TABLES[table]["columns"])
+        updated_at, last_id = watermark
+        with self._lock:
+            self.con.register("mirror_batch", rows)
+            try:
+                self.con.execute(f'INSERT OR REPLACE INTO "{table}" ({columns}) SELECT {columns} FROM mirror_batch')
+            finally:
+                self.con.unregister("mirror_batch")
+            self.con.execute(
+                "INSERT OR REPLACE INTO _watermarks VALUES (?, ?, ?, ?)",
+                [table, updated_at, last_id, datetime.now()],
+            )
+
+    def _touch(self, table):
+        with self._lock:
+            self.con.execute("""
+                INSERT INTO _watermarks (table_name, synced_at) VALUES (?, ?)
+                ON CONFLICT (table_name) DO UPDATE SET synced_at = excluded.synced_at
+            """, [table, datetime.now()])
+
+    def sync_table(self, table):
+        """增量同步一张表，返回同步的行数"""
+        spec = MIRROR_TABLES[table]
+        columns = ", ".join(spec["columns"])
+        watermark = self.watermark(table)
+        synced = 0
+        if spec["incremental"] == "updatedAt":
+            start = None if watermark is None or watermark[1] is None else watermark
+            for rows in iter_changed_rows(table, columns, start):
+                last = rows.iloc[-1]
+                self._apply_batch(table, rows, (to_db_value(last['updatedAt']), to_db_value(last['id'])))
+                synced += len(rows)
+        else:
+            last_id = watermark[1] if watermark is not None and watermark[1] is not None else 0
+            while True:
+                rows = execute_query(
+                    f"SELECT {columns} FROM {table} WHERE id > %s ORDER BY id LIMIT %s",
+                    (last_id, WATERMARK_BATCH_SIZE), use_cache=False)
+                if rows.empty:
+                    break
+                last_id = int(rows['id'].iloc[-1])
+                self._apply_batch(table, rows, (None, last_id))
+                synced += len(rows)
+                if len(rows) < WATERMARK_BATCH_SIZE:
+                    break
+        self._touch(table)
+        return synced
+
+    def sync(self):
+        """增量同步所有镜像表"""
+        return {table: self.sync_table(table) for table in MIRROR_TABLES}
+
+    def synced_at(self):
+        """最旧一张表的同步时间（镜像整体的新鲜度）"""
+        with self._lock:
+            rows = self.con.execute("SELECT COUNT(synced_at), MIN(synced_at) FROM _watermarks").fetchone()
+        return rows[1] if rows and rows[0] == len(MIRROR_TABLES) else None
+
+    def query(self, sql, params=None):
+        """在镜像上执行分析查询，返回 DataFrame"""
+        with self._lock:
+            return self.con.execute(sql, params or []).df()
+
+@st.cache_resource
+def get_analytics_mirror():
+    """获取分析镜像；未启用或未安装 duckdb 时返回 None"""
+    if not ANALYTICS_MIRROR_ENABLED or duckdb is None:
+        return None
+    return AnalyticsMirror()
+
+def ensure_mirror_fresh(mirror, force=False):
+    """镜像超过同步间隔时增量同步"""
+    synced_at = mirror.synced_at()
+    if force or synced_at is None or (datetime.now() - synced_at).total_seconds() > ANALYTICS_SYNC_INTERVAL:
+        with st.spinner("正在同步分析镜像..."):
+            mirror.sync()
+
+def render_mirror_freshness(mirror):
+    """显示分析镜像的新鲜度和手动同步按钮"""
+    col1, col2 = st.columns([4, 1])
+    with col1:
+        synced_at = mirror.synced_at()
+        if synced_at is None:
+            st.caption("🪞 分析镜像尚未完成同步")
+        else:
+            age = int((datetime.now() - synced_at).total_seconds())
+            st.caption(f"🪞 统计数据来自本地分析镜像，{age} 秒前同步（{synced_at:%Y-%m-%d %H:%M:%S}）")
+    with col2:
+        if st.button("🔄 立即同步", key="mirror_sync"):
+            ensure_mirror_fresh(mirror, force=True)
+            st.rerun()
+
+def mirror_dashboard_snapshot(mirror, days=30):
+    """从分析镜像计算平台统计快照"""
+    snapshot = DashboardSnapshot()
+    kpis = mirror.query("""
+        SELECT
+            (SELECT COUNT(*) FROM users) as total_users,
+            (SELECT COUNT(DISTINCT userId) FROM profiles WHERE userRole = 'student') as students,
+            (SELECT COUNT(DISTINCT userId) FROM profiles WHERE userRole = 'tutor') as tutors,
+            (SELECT COUNT(*) FROM sessions) as total_sessions
+    """).iloc[0]
+    snapshot.total_users = int(kpis['total_users'])
+    snapshot.students = int(kpis['students'])
+    snapshot.tutors = int(kpis['tutors'])
+    snapshot.total_sessions = int(kpis['total_sessions'])
+    
+    snapshot.status_counts = mirror.query(
+        "SELECT status, COUNT(*) as count FROM sessions GROUP BY status ORDER BY status"
+    )
+    
+    # 镜像中的 createdAt 是按数据库会话时区读出的本地时间，“今天”也取数据库的日期
+    try:
+        today = database_today()
+    except mysql.connector.Error:
+        today = get_session_rollup().today or date.today()
+    dates = [today - timedelta(days=offset) for offset in range(days - 1, -1, -1)]
+    daily = mirror.query("""
+        SELECT CAST(createdAt AS DATE) as date, COUNT(*) as count
+        FROM sessions
+        WHERE createdAt >= CAST(? AS DATE)
+        GROUP BY 1
+    """, [dates[0]])
+    counts = dict(zip(pd.to_datetime(daily['date']).dt.date, daily['count'])) if not daily.empty else {}
+    snapshot.daily_sessions = pd.DataFrame({'date': dates, 'count': [int(counts.get(d, 0)) for d in dates]})
+    return snapshot
+
+# 课程索引配置
+COURSE_INDEX_REFRESH_INTERVAL = int(os.getenv("COURSE_INDEX_REFRESH_INTERVAL", "60"))
+COURSE_ROLES = ("tutor", "student")
+
+def normalize_course(name):
+    """课程名规范化：合并空白、转大写（"econ  10a" -> "ECON 10A"）"""
+    return " ".join(str(name).split()).upper()
+
+def parse_courses(value):
+    """解析 profiles.courses JSON 数组，返回去重后的规范化课程名元组；格式不对时返回空元组"""
+    if value is None or (not isinstance(value, (str, bytes, bytearray, list)) and pd.isna(value)):
+        return ()
+    if isinstance(value, (bytes, bytearray)):
+        value = value.decode("utf-8", "replace")
+    if isinstance(value, str):
+        try:
+            value = json.loads(value)
+        except ValueError:
+            return ()
+    if not isinstance(value, list):
+        return ()
+    return tuple(dict.fromkeys(normalize_course(c) for c in value if isinstance(c, str) and c.strip()))
+
+class CourseIndex:
+    """profiles.courses 的进程内倒排索引：课程 -> 角色 -> 用户 ID
+
+    倒排表按 (用户, 课程) 计数，同一用户的多份资料重复列出同一课程时也能正确增删。
+    通过 profiles 的 (updatedAt, id) 高水位增量刷新；资料更新时先撤销旧课程再加入新课程。
+    """
+
+    def __init__(self):
+        self._postings = {}  # course -> {role: Counter(user id)}
+        self._profiles = {}  # profile id -> (user id, role, courses)
+        self._lock = threading.Lock()
+        self.watermark = None  # (updatedAt, id)
+        self.last_refresh = 0.0
+
+    def __len__(self):
+        return len(self._postings)
+
+    def _apply(self, user_id, role, courses, delta):
+        for course in courses:
+            roles = self._postings.setdefault(course, {})
+            counter = roles.setdefault(role, Counter())
+            counter[user_id] += delta
+            if counter[user_id] <= 0:
+                del counter[user_id]
+
+    def add_rows(self, rows):
+        """添加或更新资料，rows 为按 (updatedAt, id) 排序的 (id, userId, userRole, courses, updatedAt)"""
+        with self._lock:
+            for profile_id, user_id, role, courses, updated_at in rows:
+                profile_id = int(profile_id)
+                old = self._profiles.get(profile_id)
+                if old is not None:
+                    self._apply(*old, -1)
+                if role in COURSE_ROLES and user_id is not None and not pd.isna(user_id):
+                    entry = (int(user_id), role, parse_courses(courses))
+                    self._apply(*entry, 1)
+                    self._profiles[profile_id] = entry
+                else:
+                    self._profiles.pop(profile_id, None)
+                self.watermark = (updated_at, profile_id)
+
+    def users(self, course, role="tutor"):
+        """列出某课程的教师或学生 ID"""
+        with self._lock:
+            counter = self._postings.get(normalize_course(course), {}).get(role)
+            return list(counter) if counter else []
+
+    def counts(self):
+        """每门课程的教师数和学生数"""
+        with self._lock:
+            rows = [
+                (course, len(roles.get("tutor", ())), len(roles.get("student", ())))
+                for course, roles in self._postings.items()
+            ]
+        return pd.DataFrame(rows, columns=['course', 'tutors', 'students'])
+
+@st.cache_resource
+def get_course_index():
+    """获取进程内共享的课程索引"""
+    return CourseIndex()
+
+def refresh_course_index(index, force=False):
+    """从 (updatedAt, id) 高水位开始增量加载资料"""
+    if not force and time.monotonic() - index.last_refresh < COURSE_INDEX_REFRESH_INTERVAL:
+        return
+    for rows in iter_changed_rows("profiles", "id, userId, userRole, courses, updatedAt", index.watermark):
+        index.add_rows(
+            (row.id, row.userId, row.userRole, row.courses, to_db_value(row.updatedAt))
+            for row in rows.itertuples(index=False)
+        )
+    index.last_refresh = time.monotonic()
+
+def course_bookings(days):
+    """最近 days 天每门课程的预约数和预约学生数（课程名规范化后合并）"""
+    query = """
+        SELECT course, COUNT(*) as bookings, COUNT(DISTINCT studentId) as booking_students
+        FROM sessions
+        WHERE createdAt >= {since} AND course IS NOT NULL
+        GROUP BY course
+    """
+    mirror = get_analytics_mirror()
+    if mirror is not None:
+        ensure_mirror_fresh(mirror)
+        bookings = mirror.query(query.format(since="CAST(? AS TIMESTAMP)"), [datetime.now() - timedelta(days=days)])
+    else:
+        bookings = execute_query(query.format(since="DATE_SUB(NOW(), INTERVAL %s DAY)"), (days,))
+    if bookings.empty:
+        return pd.DataFrame(columns=['course', 'bookings', 'booking_students'])
+    bookings['course'] = bookings['course'].astype(str).map(normalize_course)
+    # 规范化后同名的课程合并；学生数按原课程名分别去重后相加，是上限估计
+    return bookings.groupby('course', as_index=False)[['bookings', 'booking_students']].sum()
+
+def show_course_supply():
+    """课程供需：资料中的教师 / 学生与实际预约对比"""
+    st.title("📚 课程供需")
+    
+    index = get_course_index()
+    refresh_course_index(index)
+    
+    st.subheader("🔎 按课程查找教师")
+    col1, col2 = st.columns([3, 1])
+    with col1:
+        course = st.text_input("课程（如 ECON 10A，不区分大小写）", key="course_lookup")
+    if course:
+        started = time.perf_counter()
+        tutor_ids = index.users(course, "tutor")
+        elapsed_us = (time.perf_counter() - started) * 1e6
+        col2.metric("索引查找", f"{elapsed_us:.0f} µs")
+        if tutor_ids:
+            condition, params = id_in_clause("u.id", tutor_ids[:USER_SEARCH_MAX_RESULTS])
+            tutors = execute_query(f"""
+                SELECT u.id, u.name, u.email, p.priceMin, p.priceMax, p.creditPoints
+                FROM users u
+                LEFT JOIN profiles p ON p.userId = u.id AND p.userRole = 'tutor'
+                WHERE {condition}
+            """, params)
+            st.caption(f"{normalize_course(course)}：{len(tutor_ids)} 位教师")
+            st.dataframe(tutors, use_container_width=True, hide_index=True)
+        else:
+            st.warning(f"没有教师在资料中列出 {normalize_course(course)}")
+    
+    st.markdown("---")
+    st.subheader("⚖️ 供需对比")
+    window = st.selectbox("预约统计周期", list(ACTIVITY_WINDOWS), index=2, key="course_window")
+    
+    supply = index.counts()
+    demand = course_bookings(ACTIVITY_WINDOWS[window])
+    table = supply.merge(demand, on='course', how='outer')
+    if table.empty:
+        st.info("暂无课程数据")
+        return
+    table[['tutors', 'students', 'bookings', 'booking_students']] = (
+        table[['tutors', 'students', 'bookings', 'booking_students']].fillna(0).astype('int64')
+    )
+    table['bookings_per_tutor'] = (table['bookings'] / table['tutors'].where(table['tutors'] > 0)).round(2)
+    table['flag'] = np.select(
+        [(table['tutors'] == 0) & ((table['bookings'] > 0) | (table['students'] > 0)),
+         (table['tutors'] > 0) & (table['bookings'] == 0)],
+        ["⚠️ 无教师", "💤 无预约"],
+        default="",
+    )
+    
+    no_tutor = table[table['flag'] == "⚠️ 无教师"]
+    col1, col2, col3 = st.columns(3)
+    col1.metric("课程数", len(table))
+    col2.metric("无教师课程", len(no_tutor))
+    col3.metric("有教师无预约", int((table['flag'] == "💤 无预约").sum()))
+    
+    only_flagged = st.checkbox("只看需关注的课程", key="course_flagged")
+    if only_flagged:
+        table = table[table['flag'] != ""]
+    st.dataframe(
+        table.sort_values(['bookings', 'students'], ascending=False),
+        use_container_width=True,
+        hide_index=True
+    )
+    st.caption("教师 / 学生数来自资料中的课程列表，预约数来自 sessions.course（课程名规范化后匹配）")
+
+# 留存分析配置
+COHORT_CHUNK_SIZE = int(os.getenv("COHORT_CHUNK_SIZE", "100000"))
+COHORT_MAX_OFFSET = 12
+COHORT_EPOCH = date(1970, 1, 5)  # 周一；周编号 = 距该日的天数 // 7
+
+@dataclass
+class SessionProjection:
+    """sessions 的紧凑列式投影，每行 13 字节"""
+    student: np.ndarray  # int32
+    tutor: np.ndarray    # int32，无教师为 0
+    day: np.ndarray      # int32，距 COHORT_EPOCH 的天数
+    status: np.ndarray   # int8，SESSION_STATUSES 下标，未知状态为 -1
+
+def load_session_projection(chunk_size=COHORT_CHUNK_SIZE):
+    """分块读取 (studentId, tutorId, createdAt, status) 投影；启用分析镜像时从镜像读取"""
+    mirror = get_analytics_mirror()
+    if mirror is not None:
+        ensure_mirror_fresh(mirror)
+        frame = mirror.query("""
+            SELECT studentId, COALESCE(tutorId, 0) as tutorId,
+                   datediff('day', CAST(? AS DATE), createdAt) as day, status
+            FROM sessions
+            WHERE createdAt IS NOT NULL AND studentId IS NOT NULL
+        """, [COHORT_EPOCH])
+        return SessionProjection(
+            student=frame['studentId'].to_numpy(dtype=np.int32),
+            tutor=frame['tutorId'].to_numpy(dtype=np.int32),
+            day=frame['day'].to_numpy(dtype=np.int32),
+            status=pd.Categorical(frame['status'], categories=SESSION_STATUSES).codes.astype(np.int8),
+        )
+    
+    # FIELD() 返回状态在列表中的位置（未知为 0），状态以 1 字节整数传输
+    status_params = ", ".join(["%s"] * len(SESSION_STATUSES))
+    chunks = []
+    with streaming_cursor(f"""
+        SELECT studentId, COALESCE(tutorId, 0), DATEDIFF(createdAt, %s), FIELD(status, {status_params}) - 1
+        FROM sessions
+        WHERE createdAt IS NOT NULL AND studentId IS NOT NULL
+    """, [COHORT_EPOCH, *SESSION_STATUSES]) as cursor:
+        while True:
+            rows = cursor.fetchmany(chunk_size)
+            if not rows:
+                break
+            chunks.append(np.array(rows, dtype=np.int32).reshape(-1, 4))
+    data = np.concatenate(chunks) if chunks else np.empty((0, 4), dtype=np.int32)
+    return SessionProjection(
+        student=np.ascontiguousarray(data[:, 0]),
+        tutor=np.ascontiguousarray(data[:, 1]),
+        day=np.ascontiguousarray(data[:, 2]),
+        status=data[:, 3].astype(np.int8),
+    )
+
+@st.cache_resource(max_entries=1, show_spinner="正在加载会话数据...")
+def get_session_projection(day):
+    """按天缓存会话投影（day 只用作缓存键）"""
+    return load_session_projection()
+
+@dataclass
+class CohortAnalytics:
+    """按首次预约周划分的留存和教师供给统计"""
+    counts: pd.DataFrame       # 行：群组周；列：第 0..N 周仍有预约的学生数
+    retention: pd.DataFrame    # counts / 群组人数，尚未到达的周为 NaN
+    repeat: pd.DataFrame       # 每个群组的人数、复购人数（≥2 次预约）和复购率
+    supply: pd.DataFrame       # 每周会话数、活跃教师、新教师、人均会话
+    sessions: int = 0
+    students: int = 0
+
+def _week_starts(first_week, count):
+    return pd.Timestamp(COHORT_EPOCH) + pd.to_timedelta((first_week + np.arange(count)) * 7, unit="D")
+
+def compute_cohort_analytics(projection, statuses, max_offset=COHORT_MAX_OFFSET):
+    """向量化计算群组留存矩阵、复购率和教师供给；没有符合条件的会话时返回 None"""
+    codes = [SESSION_STATUSES.index(status) for status in statuses]
+    mask = np.isin(projection.status, codes)
+    student = projection.student[mask].astype(np.int64)
+    if not len(student):
+        return None
+    tutor = projection.tutor[mask].astype(np.int64)
+    week = projection.day[mask] // 7
+    first_week = int(week.min())
+    week = (week - first_week).astype(np.int64)
+    n_weeks = int(week.max()) + 1
+    
+    # 学生 × 周去重；按 (学生, 周) 排序，每个学生的第一条即首次预约周
+    pairs = np.unique(student * n_weeks + week)
+    pair_student, pair_week = pairs // n_weeks, pairs % n_weeks
+    students, first_index, inverse = np.unique(pair_student, return_index=True, return_inverse=True)
+    cohort_of_student = pair_week[first_index]
+    cohort = cohort_of_student[inverse]
+    offset = pair_week - cohort
+    keep = offset <= max_offset
+    width = max_offset + 1
+    counts = np.bincount(cohort[keep] * width + offset[keep], minlength=n_weeks * width).reshape(n_weeks, width)
+    
+    sizes = counts[:, 0]
+    observable = np.arange(n_weeks)[:, None] + np.arange(width)[None, :] < n_weeks
+    with np.errstate(invalid="ignore", divide="ignore"):
+        retention = np.where(observable, counts / sizes[:, None], np.nan)
+    
+    # 复购：预约次数 ≥ 2 的学生
+    bookings = np.bincount(np.searchsorted(students, student), minlength=len(students))
+    repeat_counts = np.bincount(cohort_of_student, weights=bookings >= 2, minlength=n_weeks)
+    
+    # 教师供给：每周活跃教师数和首次授课的新教师数
+    has_tutor = tutor > 0
+    tutor_pairs = np.unique(tutor[has_tutor] * n_weeks + week[has_tutor])
+    active_tutors = np.bincount(tutor_pairs % n_weeks, minlength=n_weeks)
+    _, tutor_first = np.unique(tutor_pairs // n_weeks, return_index=True)
+    new_tutors = np.bincount((tutor_pairs % n_weeks)[tutor_first], minlength=n_weeks)
+    weekly_sessions = np.bincount(week, minlength=n_weeks)
+    
+    index = pd.Index(_week_starts(first_week, n_weeks).date, name="week")
+    has_cohort = sizes > 0
+    columns = [f"W+{i}" for i in range(width)]
+    with np.errstate(invalid="ignore", divide="ignore"):
+        repeat_rate = repeat_counts / sizes
+        per_tutor = np.where(active_tutors > 0, weekly_sessions / active_tutors, np.nan)
+    return CohortAnalytics(
+        counts=pd.DataFrame(counts, index=index, columns=columns)[has_cohort],
+        retention=pd.DataFrame(retention, index=index, columns=columns)[has_cohort],
+        repeat=pd.DataFrame({
+            "cohort_size": sizes,
+            "repeat_students": repeat_counts.astype(np.int64),
+            "repeat_rate": repeat_rate,
+        }, index=index)[has_cohort],
+        supply=pd.DataFrame({
+            "sessions": weekly_sessions,
+            "active_tutors": active_tutors,
+            "new_tutors": new_tutors,
+            "sessions_per_tutor": per_tutor,
+        }, index=index),
+        sessions=len(student),
+        students=len(students),
+    )
+
+@st.cache_resource(max_entries=8, show_spinner="正在计算留存...")
+def get_cohort_analytics(day, statuses):
+    """按天和状态组合缓存留存分析结果"""
+    return compute_cohort_analytics(get_session_projection(day), list(statuses))
+
+def show_cohorts():
+    """群组留存和教师供给分析"""
+    st.title("📈 留存分析")
+    
+    st.info("💡 按学生首次预约所在的周（周一开始）划分群组，统计之后第 1~12 周仍有预约的比例；数据每天计算一次")
+    
+    col1, col2, col3 = st.columns([3, 1, 1])
+    with col1:
+        statuses = st.multiselect(
+            "计入的会话状态",
+            SESSION_STATUSES,
+            default=[status for status in SESSION_STATUSES if status != "CANCELLED"],
+            key="cohort_statuses",
+        )
+    with col2:
+        recent = st.selectbox("显示最近群组", [12, 26, 52], key="cohort_recent")
+    with col3:
+        if st.button("🔄 重新计算", key="cohort_refresh"):
+            get_session_projection.clear()
+            get_cohort_analytics.clear()
+    
+    if not statuses:
+        st.warning("请至少选择一种会话状态")
+        return
+    
+    try:
+        analytics = get_cohort_analytics(date.today(), tuple(statuses))
+    except mysql.connector.Error as err:
+        st.error(f"数据库查询错误: {err}")
+        return
+    if analytics is None:
+        st.info("暂无符合条件的会话")
+        return
+    
+    repeat = analytics.repeat
+    col1, col2, col3, col4 = st.columns(4)
+    col1.metric("会话数", f"{analytics.sessions:,}")
+    col2.metric("学生数", f"{analytics.students:,}")
+    col3.metric("整体复购率", f"{repeat['repeat_students'].sum() / max(repeat['cohort_size'].sum(), 1):.1%}")
+    col4.metric("最近一周活跃教师", int(analytics.supply['active_tutors'].iloc[-1]))
+    
+    st.markdown("---")
+    st.subheader("🧮 群组留存矩阵")
+    retention = analytics.retention.tail(recent)
+    st.dataframe(
+        (retention * 100).round(1),
+        use_container_width=True,
+        column_config={column: st.column_config.NumberColumn(format="%.1f%%") for column in retention.columns},
+    )
+    
+    # 平均留存曲线：按群组人数加权，只统计已经可观测的格子
+    counts = analytics.counts.tail(recent)
+    sizes = repeat['cohort_size'].tail(recent)
+    observed = retention.notna()
+    curve = counts.where(observed).sum() / observed.mul(sizes, axis=0).sum()
+    st.line_chart(pd.DataFrame({"平均留存率": curve}))
+    
+    st.subheader("🔁 复购率")
+    st.dataframe(repeat.tail(recent), use_container_width=True, column_config={
+        "repeat_rate": st.column_config.NumberColumn(format="%.3f"),
+    })
+    
+    st.subheader("👨‍🏫 教师供给")
+    supply = analytics.supply
+    st.line_chart(supply[['active_tutors', 'new_tutors']])
+    st.line_chart(supply[['sessions_per_tutor']])
+
+# 数据导出配置
+EXPORT_CHUNK_SIZE = int(os.getenv("EXPORT_CHUNK_SIZE", "10000"))
+EXPORT_FORMATS = ["csv", "parquet"]
+# 页面下载：st.download_button 会把整个文件读入内存（Streamlit 的媒体存储），超过上限时只提示使用命令行导出
+EXPORT_DOWNLOAD_MAX_MB = float(os.getenv("EXPORT_DOWNLOAD_MAX_MB", "200"))
+EXPORT_FILE_TTL = int(os.getenv("EXPORT_FILE_TTL", "3600"))
+EXPORT_DIR = os.path.join(tempfile.gettempdir(), "unitutor_exports")
+
+# 与 show_sessions / show_ratings / show_support_tickets 相同的关联，按主键顺序流式读取
+EXPORTS = {
+    "sessions": {
+        "label": "会话",
+        "count_query": "SELECT COUNT(*) as count FROM sessions",
+        "query": """
+            SELECT 
+                s.id,
+                s.status,
+                s.studentId,
+                student.name as student_name,
+                s.tutorId,
+                tutor.name as tutor_name,
+                s.course,
+                s.startTime,
+                s.endTime,
+                s.studentCompleted,
+                s.tutorCompleted,
+                s.cancelReason,
+                s.createdAt,
+                s.updatedAt
+            FROM sessions s
+            LEFT JOIN users student ON s.studentId = student.id
+            LEFT JOIN users tutor ON s.tutorId = tutor.id
+            ORDER BY s.id
+        """,
+    },
+    "ratings": {
+        "label": "评分",
+        "count_query": "SELECT COUNT(*) as count FROM ratings",
+        "query": """
+            SELECT 
+                r.id,
+                r.score,
+                r.comment,
+                r.visibility,
+                r.raterId,
+                rater.name as rater_name,
+                r.targetId,
+                target.name as target_name,
+                r.sessionId,
+                s.course,
+                r.createdAt
+            FROM ratings r
+            LEFT JOIN users rater ON r.raterId = rater.id
+            LEFT JOIN users target ON r.targetId = target.id
+            LEFT JOIN sessions s ON r.sessionId = s.id
+            ORDER BY r.id
+        """,
+    },
+    "tickets": {
+        "label": "工单",
+        "count_query": "SELECT COUNT(*) as count FROM tickets",
+        "query": """
+            SELECT 
+                t.id,
+                t.status,
+                t.category,
+                t.userId,
+                u.name as user_name,
+                u.email,
+                t.subject,
+                t.message,
+                t.adminResponse,
+                t.createdAt,
+                t.updatedAt
+            FROM tickets t
+            LEFT JOIN users u ON t.userId = u.id
+            ORDER BY t.id
+        """,
+    },
+}
+
+def _arrow_type(type_code):
+    """MySQL 列类型 -> Arrow 类型"""
+    if type_code in INTEGER_TYPES:
+        return pa.int64()
+    if type_code in FLOAT_TYPES:
+        return pa.float64()
+    if type_code == FieldType.DATE:
+        return pa.date32()
+    if type_code in DATETIME_TYPES:
+        return pa.timestamp("us")
+    return pa.string()
+
+def _arrow_column(values, arrow_type):
+    if pa.types.is_floating(arrow_type):
+        values = [None if v is None else float(v) for v in values]
+    elif pa.types.is_string(arrow_type):
+        values = [None if v is None else (v.decode("utf-8", "replace") if isinstance(v, (bytes, bytearray)) else str(v))
+                  for v in values]
+    return pa.array(values, type=arrow_type)
+
+def write_csv_chunks(description, chunks, output):
+    """把行块写入 CSV（output 为文本文件对象），返回行数"""
+    writer = csv.writer(output)
+    writer.writerow([column[0] for column in description])
+    total = 0
+    for rows in chunks:
+        writer.writerows(rows)
+        total += len(rows)
+    return total
+
+def write_parquet_chunks(description, chunks, output):
+    """把行块写入 Parquet，每个块一个 row group，返回行数"""
+    schema = pa.schema([(column[0], _arrow_type(column[1])) for column in description])
+    total = 0
+    with pq.ParquetWriter(output, schema) as writer:
+        for rows in chunks:
+            columns = list(zip(*rows))
+            arrays = [_arrow_column(values, field.type) for values, field in zip(columns, schema)]
+            writer.write_table(pa.Table.from_arrays(arrays, schema=schema))
+            total += len(rows)
+    return total
+
+def export_table(name, fmt, output, chunk_size=EXPORT_CHUNK_SIZE, progress=None):
+    """流式导出 sessions / ratings / tickets
+
+    使用非缓冲游标和 fetchmany 分块读取，内存峰值只与 chunk_size 有关。
+    output 为文件路径；progress(done, total) 在每个块写完后调用。返回导出行数。
+    任何失败（数据库错误、磁盘写满、pyarrow 错误、中断）都会删除写了一半的文件再抛出。
+    """
+    try:
+        return _export_table(name, fmt, output, chunk_size, progress)
+    except BaseException:
+        try:
+            os.remove(output)
+        except OSError:
+            pass
+        raise
+
+def _export_table(name, fmt, output, chunk_size, progress):
+    spec = EXPORTS[name]
+    total_rows = execute_query(spec["count_query"], use_cache=False)
+    total = int(total_rows['count'].iloc[0]) if not total_rows.empty else 0
+    
+    with streaming_cursor(spec["query"]) as cursor:
+        def chunks():
+            done = 0
+            while True:
+                rows = cursor.fetchmany(chunk_size)
+                if not rows:
+                    return
+                yield rows
+                done += len(rows)
+                if progress:
+                    progress(done, max(total, done))
+        
+        if fmt == "csv":
+            with open(output, "w", newline="", encoding="utf-8") as f:
+                return write_csv_chunks(cursor.description, chunks(), f)
+        return write_parquet_chunks(cursor.description, chunks(), output)
+
+def cleanup_export_files(max_age=EXPORT_FILE_TTL):
+    """删除超过 max_age 秒的导出文件（会话中断后遗留的文件）"""
+    cutoff = time.time() - max_age
+    try:
+        names = os.listdir(EXPORT_DIR)
+    except OSError:
+        return
+    for file_name in names:
+        path = os.path.join(EXPORT_DIR, file_name)
+        try:
+            if os.path.getmtime(path) < cutoff:
+                os.remove(path)
+        except OSError:
+            pass
+
+def discard_export_file():
+    """删除本会话的导出文件（下载后或开始新的导出前）"""
+    path = st.session_state.pop("export_file", None)
+    if path:
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+
+def show_exports():
+    """数据导出"""
+    st.title("📤 数据导出")
+    
+    st.info("💡 导出按块流式读取数据库，写文件时内存占用与表大小无关；"
+            f"页面下载会把文件整个读入内存，超过 {EXPORT_DOWNLOAD_MAX_MB:.0f} MB 时请在命令行运行 `python export_data.py`")
+    
+    col1, col2, col3 = st.columns(3)
+    with col1:
+        name = st.selectbox("导出内容", list(EXPORTS), format_func=lambda n: f"{EXPORTS[n]['label']} ({n})")
+    with col2:
+        fmt = st.selectbox("格式", EXPORT_FORMATS)
+    with col3:
+        chunk_size = st.number_input("每块行数", min_value=1000, max_value=100000,
+                                     value=EXPORT_CHUNK_SIZE, step=1000)
+    
+    if st.button("🚀 开始导出", type="primary"):
+        progress_bar = st.progress(0.0, text="正在导出...")
+        
+        def update_progress(done, total):
+            progress_bar.progress(done / total if total else 1.0, text=f"已导出 {done:,} / {total:,} 行")
+        
+        discard_export_file()
+        cleanup_export_files()
+        os.makedirs(EXPORT_DIR, exist_ok=True)
+        file_name = f"unitutor_{name}_{datetime.now():%Y%m%d_%H%M%S}.{fmt}"
+        # 临时文件名带随机前缀，避免多个会话同一秒导出时互相覆盖
+        path = os.path.join(EXPORT_DIR, f"{os.urandom(4).hex()}_{file_name}")
+        try:
+            rows = export_table(name, fmt, path, chunk_size=int(chunk_size), progress=update_progress)
+        except mysql.connector.Error as err:
+            st.error(f"导出失败（数据库错误）: {err}")
+            return
+        except Exception as e:
+            # 磁盘写满、权限、pyarrow 等错误；export_table 已删除写了一半的文件
+            st.error(f"导出失败: {e}")
+            return
+        progress_bar.progress(1.0, text=f"✅ 导出完成，共 {rows:,} 行")
+        st.session_state["export_file"] = path
+    
+    path = st.session_state.get("export_file")
+    if not path:
+        return
+    if not os.path.exists(path):
+        st.session_state.pop("export_file", None)
+        return
+    size_mb = os.path.getsize(path) / 1024 / 1024
+    if size_mb > EXPORT_DOWNLOAD_MAX_MB:
+        discard_export_file()
+        st.warning(f"⚠️ 导出文件 {size_mb:.0f} MB 超过页面下载上限 {EXPORT_DOWNLOAD_MAX_MB:.0f} MB（EXPORT_DOWNLOAD_MAX_MB），"
+                   "已删除；请在命令行运行 `python export_data.py` 导出")
+        return
+    with open(path, "rb") as f:
+        data = f.read()
+    file_name = os.path.basename(path).split("_", 1)[1]
+    st.download_button(
+        f"⬇️ 下载 {file_name}（{size_mb:.1f} MB）",
+        data=data,
+        file_name=file_name,
+        mime="text/csv" if path.endswith(".csv") else "application/octet-stream",
+        on_click=discard_export_file,
+    )
+
+def summarize_samples(samples, by):
+    """按分组计算调用次数和 p50/p95/p99 延迟"""
+    grouped = samples.groupby(by, observed=True)
+    summary = grouped['wall_ms'].agg(
+        calls='count',
+        p50=lambda x: x.quantile(0.50),
+        p95=lambda x: x.quantile(0.95),
+        p99=lambda x: x.quantile(0.99),
+        max='max',
+    )
+    summary['avg_rows'] = grouped['rows'].mean()
+    summary['avg_bytes'] = grouped['bytes'].mean()
+    summary['avg_pool_wait_ms'] = grouped['pool_wait_ms'].mean()
+    summary['errors'] = grouped['error'].count()
+    return summary.round(2).sort_values('p95', ascending=False).reset_index()
+
+# 索引建议：扫描行数低于该值的表不提示
+ADVISOR_MIN_ROWS = int(os.getenv("ADVISOR_MIN_ROWS", "1000"))
+
+_SQL_KEYWORDS = {
+    "where", "on", "join", "left", "right", "inner", "outer", "cross", "group", "order",
+    "limit", "union", "having", "using", "as", "set", "natural", "straight_join",
+}
+_FROM_PATTERN = re.compile(r"\b(?:FROM|JOIN)\s+`?(\w+)`?(?:\s+(?:AS\s+)?`?(\w+)`?)?", re.IGNORECASE)
+
+def table_aliases(query):
+    """解析 FROM / JOIN 中的 别名 -> 表名"""
+    aliases = {}
+    for table, alias in _FROM_PATTERN.findall(query):
+        if alias and alias.lower() not in _SQL_KEYWORDS:
+            aliases[alias] = table
+        aliases.setdefault(table, table)
+    return aliases
+
+def strip_parenthesized(query):
+    """去掉所有括号内的内容（子查询、窗口函数的 OVER(...)、函数参数），只保留最外层语句"""
+    previous = None
+    while previous != query:
+        previous, query = query, re.sub(r"\([^()]*\)", "()", query)
+    return query
+
+def order_by_columns(query):
+    """解析最外层 ORDER BY 的 [(别名或 None, 列名)]（跳过 OVER(... ORDER BY ...) 和子查询中的排序）"""
+    query = strip_parenthesized(normalize_sql(query))
+    match = re.search(r"\bORDER\s+BY\s+(.+?)(?:\bLIMIT\b|$)", query, re.IGNORECASE)
+    if not match:
+        return []
+    columns = []
+    for part in match.group(1).split(","):
+        token = re.match(r"\s*`?(?:(\w+)`?\.)?`?(\w+)`?", part)
+        if token:
+            columns.append((token.group(1), token.group(2)))
+    return columns
+
+def condition_columns(condition, alias):
+    """从 EXPLAIN 的 attached_condition 中提取该表的等值列、范围列和问题
+
+    MySQL 输出的列名带库名前缀（`db`.`s`.`createdAt`），库名部分可有可无。
+    """
+    equality, ranges, problems = [], [], []
+    column = rf"(?:`\w+`\.)?`{re.escape(alias)}`\.`(\w+)`"
+    pattern = column + r"\s*(=|<=>|>=|<=|<>|>|<|\bin\b|\bbetween\b|\blike\b)\s*('%)?"
+    for name, op, leading_wildcard in re.findall(pattern, condition, re.IGNORECASE):
+        op = op.lower()
+        if op in ("=", "<=>", "in"):
+            equality.append(name)
+        elif op == "like" and leading_wildcard:
+            problems.append(f"{name} 以通配符开头的 LIKE 无法使用索引")
+        elif op != "<>":
+            ranges.append(name)
+    for func, name in re.findall(r"(\w+)\(\s*" + column, condition):
+        problems.append(f"{name} 被函数 {func}() 包裹，无法使用索引，可改写为范围条件")
+    if re.search(r"\)\s+or\s+\(", condition, re.IGNORECASE):
+        # OR 两侧各自需要单列索引，组合索引帮不上忙
+        problems.append("OR 条件：为每列单独建索引（index_merge）或改写为 UNION ALL")
+        equality = []
+    return list(dict.fromkeys(equality)), list(dict.fromkeys(ranges)), problems
+
+def _plan_nodes(node, block=None):
+    """遍历 EXPLAIN JSON，产出 (查询块标记, 表节点)；first 为该查询块的驱动表"""
+    if isinstance(node, dict):
+        if "query_block" in node:
+            block = {}
+        if block is not None:
+            block["filesort"] = block.get("filesort") or node.get("using_filesort", False)
+            block["temporary"] = block.get("temporary") or node.get("using_temporary_table", False)
+        if "table_name" in node and "access_type" in node:
+            block.setdefault("first", node["table_name"])
+            yield block, node
+        for value in node.values():
+            yield from _plan_nodes(value, block)
+    elif isinstance(node, list):
+        for item in node:
+            yield from _plan_nodes(item, block)
+
+def explain_json(query, params=None):
+    """EXPLAIN FORMAT=JSON，返回解析后的执行计划；失败时抛出异常"""
+    conn = checkout_connection()
+    cursor = conn.cursor()
+    try:
+        cursor.execute("EXPLAIN FORMAT=JSON " + query, params or ())
+        return json.loads(cursor.fetchone()[0])
+    finally:
+        cursor.close()
+        conn.close()
+
+def table_indexes(table):
+    """表上已有索引：{索引名: [列...]}"""
+    rows = execute_query("""
+        SELECT INDEX_NAME, COLUMN_NAME
+        FROM information_schema.STATISTICS
+        WHERE TABLE_SCHEMA = DATABASE() AND TABLE_NAME = %s
+        ORDER BY INDEX_NAME, SEQ_IN_INDEX
+    """, (table,))
+    if rows.empty:
+        return {}
+    return {name: list(group['COLUMN_NAME']) for name, group in rows.groupby('INDEX_NAME', sort=False)}
+
+def advise_statement(entry, indexes_for=table_indexes):
+    """分析一条语句的执行计划，返回每个有问题的表的诊断和建议索引"""
+    plan = explain_json(entry["query"], entry["params"])
+    aliases = table_aliases(entry["query"])
+    order_columns = order_by_columns(entry["query"])
+    findings = []
+    for block, node in _plan_nodes(plan):
+        alias = node["table_name"]
+        table = aliases.get(alias)
+        sort_columns = [name for owner, name in order_columns
+                        if owner == alias or (owner is None and block.get("first") == alias)]
+        problems = []
+        if node["access_type"] == "ALL":
+            problems.append("全表扫描")
+        if block.get("filesort") and sort_columns:
+            problems.append("filesort 排序")
+        if block.get("temporary") and block.get("first") == alias:
+            problems.append("使用临时表")
+        if not problems or table is None:
+            continue
+        
+        equality, ranges, notes = condition_columns(node.get("attached_condition", ""), alias)
+        columns = list(equality)
+        if block.get("filesort") and sort_columns:
+            columns += sort_columns
+        elif ranges:
+            columns.append(ranges[0])
+        columns = list(dict.fromkeys(columns))[:4]
+        
+        suggestion, covered_by = None, None
+        if columns:
+            for name, existing in indexes_for(table).items():
+                if existing[:len(columns)] == columns:
+                    covered_by = name
+                    break
+            if covered_by is None:
+                suggestion = f"CREATE INDEX idx_{table}_{'_'.join(columns)} ON {table}({', '.join(columns)})"
+        
+        cost = node.get("cost_info", {})
+        findings.append({
+            "statement": entry["statement"],
+            "call_site": entry["call_site"],
+            "calls": entry["calls"],
+            "table": table,
+            "access_type": node["access_type"],
+            "key": node.get("key"),
+            "rows_examined": int(node.get("rows_examined_per_scan") or 0),
+            "rows_produced": int(node.get("rows_produced_per_join") or 0),
+            "filtered": float(node.get("filtered") or 100),
+            "cost": float(cost.get("read_cost") or 0) + float(cost.get("eval_cost") or 0),
+            "problems": "；".join(problems + notes),
+            "suggestion": suggestion,
+            "covered_by": covered_by,
+        })
+    return findings
+
+def advise_statements(entries):
+    """逐条 EXPLAIN，返回 (诊断 DataFrame, 失败的语句列表)"""
+    indexes = {}
+    
+    def cached_indexes(table):
+        if table not in indexes:
+            indexes[table] = table_indexes(table)
+        return indexes[table]
+    
+    findings, failures = [], []
+    for entry in entries:
+        try:
+            findings.extend(advise_statement(entry, cached_indexes))
+        except (mysql.connector.Error, ValueError, TypeError) as e:
+            failures.append((entry["statement"], str(e)))
+    return pd.DataFrame(findings), failures
+
+def suggestion_report(findings):
+    """按建议索引汇总，用 EXPLAIN 的扫描行数估算收益并给出结论"""
+    suggested = findings[findings['suggestion'].notna()].copy()
+    if suggested.empty:
+        return suggested
+    suggested['weighted_rows'] = suggested['rows_examined'] * suggested['calls']
+    report = suggested.groupby('suggestion').agg(
+        table=('table', 'first'),
+        statements=('statement', 'nunique'),
+        calls=('calls', 'sum'),
+        rows_examined=('rows_examined', 'max'),
+        rows_produced=('rows_produced', 'max'),
+        filtered=('filtered', 'min'),
+        weighted_rows=('weighted_rows', 'sum'),
+        filesort=('problems', lambda x: x.str.contains('filesort').any()),
+    ).reset_index()
+    report['est_reduction'] = (report['rows_examined'] / report['rows_produced'].clip(lower=1)).round(1)
+    report['verdict'] = np.select(
+        [
+            report['rows_examined'] < ADVISOR_MIN_ROWS,
+            (report['filtered'] >= 50) & ~report['filesort'],
+        ],
+        ["表较小，收益有限", "过滤率高，索引收益有限"],
+        default="建议创建",
+    )
+    return report.drop(columns='filesort').sort_values('weighted_rows', ascending=False)
+
+def show_index_advisor():
+    """索引建议：对记录到的语句执行 EXPLAIN"""
+    catalog = get_statement_catalog()
+    entries = catalog.entries()
+    st.caption(f"已记录 {len(entries)} 条不同的 SELECT 语句（每条保留首次执行时的参数）")
+    if not entries:
+        st.info("暂无语句记录，访问其他页面后再回来查看")
+        return
+    
+    col1, col2 = st.columns([3, 1])
+    with col1:
+        mode = st.radio("模式", ["逐条诊断", "汇总报告"], horizontal=True, key="advisor_mode")
+    with col2:
+        run = st.button("🔍 执行 EXPLAIN", type="primary")
+    
+    frames = get_session_frames()
+    if run:
+        with st.spinner(f"正在分析 {len(entries)} 条语句..."):
+            findings, failures = advise_statements(entries)
+            frames.put("advisor_findings", findings)
+            st.session_state["advisor_failures"] = failures
+    if "advisor_failures" not in st.session_state:
+        return
+    findings = frames.get("advisor_findings")
+    if findings is None:
+        st.info("上次的分析结果已因会话内存预算被淘汰，请重新执行 EXPLAIN")
+        return
+    failures = st.session_state["advisor_failures"]
+    if findings.empty:
+        st.success("✅ 没有发现全表扫描、filesort 或临时表")
+    elif mode == "逐条诊断":
+        st.dataframe(
+            findings[['call_site', 'calls', 'table', 'access_type', 'key', 'rows_examined', 'filtered',
+                      'problems', 'suggestion', 'covered_by', 'statement']],
+            use_container_width=True,
+            hide_index=True
+        )
+    else:
+        report = suggestion_report(findings)
+        if report.empty:
+            st.info("有问题的语句都已有可用索引，或无法通过加索引解决（见逐条诊断）")
+        else:
+            st.dataframe(report, use_container_width=True, hide_index=True)
+            st.code(";\n".join(report.loc[report['verdict'] == "建议创建", 'suggestion']) + ";", language="sql")
+            st.caption("est_reduction = 扫描行数 / 产出行数，是 EXPLAIN 估算值；确认后加入 MIGRATIONS 发布")
+    
+    if failures:
+        with st.expander(f"❌ {len(failures)} 条语句无法 EXPLAIN"):
+            st.dataframe(pd.DataFrame(failures, columns=['statement', 'error']), use_container_width=True, hide_index=True)
+
+def show_performance():
+    """性能诊断：查询延迟、慢查询日志和索引建议"""
+    st.title("🔧 性能诊断")
+    
+    tab1, tab2, tab3 = st.tabs(["⏱️ 查询延迟", "🔍 索引建议", "🧠 内存"])
+    with tab1:
+        show_query_latency()
+    with tab2:
+        show_index_advisor()
+    with tab3:
+        show_memory_usage()
+
+def process_rss_bytes():
+    """当前进程常驻内存（仅 Linux，读取失败时返回 None）"""
+    try:
+        with open("/proc/self/status", encoding="ascii") as f:
+            for line in f:
+                if line.startswith("VmRSS:"):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        return None
+    return None
+
+def shared_memory_usage():
+    """进程内共享结构的 DataFrame / 数组内存 {名称: (字节数, 上限或 None)}（只统计已创建的，不触发加载）"""
+    graph = get_rating_graph()
+    query_cache = get_query_cache()
+    transcripts = get_transcript_cache()
+    return {
+        "查询缓存": (query_cache.bytes, query_cache.max_bytes),
+        "聊天记录": (transcripts.bytes(), transcripts.max_bytes),
+        "加权评分引擎": (frame_bytes(get_rating_engine().frame), None),
+        "评分图": (int(graph.keys.nbytes + graph.stats.nbytes), None),
     }
 
+def show_memory_usage():
+    """每个管理员会话和共享缓存的内存占用"""
+    registry = get_session_memory()
+    current = get_session_frames()
+    sessions = registry.sessions()
+    shared = shared_memory_usage()
+    
+    session_total = sum(cache.cached_bytes() + cache.state_bytes for cache in sessions)
+    col1, col2, col3, col4 = st.columns(4)
+    col1.metric("活跃会话", len(sessions))
+    col2.metric("会话缓存合计", f"{session_total / 1024 / 1024:.1f} MB")
+    col3.metric("共享缓存合计", f"{sum(nbytes for nbytes, _ in shared.values()) / 1024 / 1024:.1f} MB")
+    rss = process_rss_bytes()
+    col4.metric("进程内存 (RSS)", f"{rss / 1024 / 1024:.0f} MB" if rss else "-")
+    st.caption(f"每个会话的页面结果缓存预算为 {SESSION_MEMORY_BUDGET_MB:.0f} MB（SESSION_MEMORY_BUDGET_MB），"
+               "超出时按最久未访问淘汰；被淘汰的结果下次使用时重新加载。查询缓存和聊天记录按各自的字节上限淘汰")
+    
+    now = time.monotonic()
+    st.subheader("👤 按会话")
+    st.dataframe(pd.DataFrame([
+        {
+            "session": cache.session_id[:8] + (" (当前)" if cache is current else ""),
+            "cached_entries": len(cache.entries()),
+            "cached_mb": round(cache.cached_bytes() / 1024 / 1024, 2),
+            "state_mb": round(cache.state_bytes / 1024 / 1024, 2),
+            "budget_used": f"{cache.cached_bytes() / cache.budget_bytes:.0%}",
+            "evictions": cache.evictions,
+            "idle_seconds": int(now - cache.last_seen),
+        }
+        for cache in sessions
+    ]), use_container_width=True, hide_index=True)
+    
+    st.subheader("🗂️ 当前会话的缓存结果")
+    entries = current.entries()
+    if entries:
+        st.dataframe(pd.DataFrame(entries, columns=["key", "rows", "bytes"]), use_container_width=True, hide_index=True)
+        if st.button("🗑️ 清空本会话缓存", key="session_frames_clear"):
+            current.clear()
+            st.rerun()
+    else:
+        st.info("当前会话没有缓存的页面结果")
+    
+    st.subheader("🔗 共享缓存")
+    st.dataframe(pd.DataFrame(
+        [(name, round(nbytes / 1024 / 1024, 2), None if limit is None else round(limit / 1024 / 1024))
+         for name, (nbytes, limit) in shared.items()],
+        columns=["component", "mb", "limit_mb"],
+    ), use_container_width=True, hide_index=True)
+
+def show_query_latency():
+    """查询延迟分布和慢查询日志"""
+    tracer = get_query_tracer()
+    samples = tracer.frame()
+    
+    col1, col2 = st.columns([3, 1])
+    with col1:
+        threshold = st.number_input("慢查询阈值 (ms)", min_value=1, value=SLOW_QUERY_MS, step=50)
+    with col2:
+        include_cached = st.checkbox("包含缓存命中", value=False)
+    
+    if samples.empty:
+        st.info("暂无查询记录，访问其他页面后再回来查看")
+        return
+    
+    if not include_cached:
+        samples = samples[~samples['cached']]
+        if samples.empty:
+            st.info("最近的查询全部命中缓存")
+            return
+    
+    col1, col2, col3, col4 = st.columns(4)
+    col1.metric("记录数", len(samples))
+    col2.metric("p95 延迟", f"{samples['wall_ms'].quantile(0.95):.1f} ms")
+    col3.metric("慢查询", int((samples['wall_ms'] >= threshold).sum()))
+    col4.metric("错误", int(samples['error'].notna().sum()))
+    
+    st.markdown("---")
+    st.subheader("📄 按页面")
+    st.dataframe(summarize_samples(samples, ['page']), use_container_width=True, hide_index=True)
+    
+    st.subheader("🧾 按查询")
+    st.dataframe(
+        summarize_samples(samples, ['page', 'call_site', 'kind', 'statement']),
+        use_container_width=True,
+        hide_index=True
+    )
+    
+    st.subheader("📊 延迟分布")
+    bins = np.logspace(0, 5, 21)  # 1 ms ~ 100 s，对数刻度
+    counts, edges = np.histogram(samples['wall_ms'].clip(lower=1), bins=bins)
+    histogram = pd.DataFrame({'延迟上限 (ms)': [f"{edge:.0f}" for edge in edges[1:]], '次数': counts})
+    st.bar_chart(histogram.set_index('延迟上限 (ms)'))
+    
+    st.subheader("🐢 慢查询日志")
+    slow = samples[samples['wall_ms'] >= threshold].sort_values('timestamp', ascending=False).copy()
+    if not slow.empty:
+        slow['time'] = pd.to_datetime(slow['timestamp'], unit='s')
+        st.dataframe(
+            slow[['time', 'page', 'call_site', 'wall_ms', 'rows', 'pool_wait_ms', 'error', 'statement']],
+            use_container_width=True,
+            hide_index=True
+        )
+    else:
+        st.success("✅ 没有超过阈值的查询")
+    
+    errors = samples[samples['error'].notna()]
+    if not errors.empty:
+        st.subheader("❌ 查询错误")
+        st.dataframe(errors[['page', 'call_site', 'error', 'statement']], use_container_width=True, hide_index=True)
+    
+    st.markdown("---")
+    col1, col2 = st.columns([1, 4])
+    with col1:
+        st.download_button(
+            "⬇️ 导出 JSON",
+            data=json.dumps([asdict(sample) for sample in tracer.samples()], ensure_ascii=False, indent=2),
+            file_name=f"query_samples_{datetime.now():%Y%m%d_%H%M%S}.json",
+            mime="application/json",
+        )
+    with col2:
+        if st.button("🗑️ 清空记录"):
+            tracer.clear()
+            get_statement_catalog().clear()
+            st.session_state.pop("advisor_failures", None)
+            get_session_frames().pop("advisor_findings")
+            st.rerun()
+
 if __name__ == "__main__":
     main()
@@ -0,0 +1,63 @@
+"""留存分析基准测试：compute_cohort_analytics 在百万级会话投影上的耗时
+
+投影为随机生成（两年内的会话，学生 / 教师数按会话数比例），不需要数据库。
+
+用法:
+    python benchmarks/bench_cohorts.py --sessions 1000000 5000000
+"""
+import argparse
+import json
+import os
+import sys
+import time
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from app import SESSION_STATUSES, SessionProjection, compute_cohort_analytics  # noqa: E402
+
+def generate_projection(count, seed=42):
+    rng = np.random.default_rng(seed)
+    students = max(count // 20, 1)
+    tutors = max(count // 200, 1)
+    start_day = 19700  # 2024 年初，距 1970-01-05 的天数
+    return SessionProjection(
+        student=rng.integers(1, students + 1, count, dtype=np.int32),
+        tutor=rng.integers(1, tutors + 1, count, dtype=np.int32),
+        day=(start_day + rng.integers(0, 730, count)).astype(np.int32),
+        status=rng.integers(0, len(SESSION_STATUSES), count).astype(np.int8),
+    )
+
+def main():
+    parser = argparse.ArgumentParser(description="留存分析基准测试")
+    parser.add_argument("--sessions", type=int, nargs="+", default=[1000000])
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--output", help="结果写入 JSON 文件")
+    args = parser.parse_args()
+
+    statuses = [status for status in SESSION_STATUSES if status != "CANCELLED"]
+    report = []
+    for count in args.sessions:
+        projection = generate_projection(count)
+        best = float("inf")
+        for _ in range(args.repeat):
+            start = time.perf_counter()
+            analytics = compute_cohort_analytics(projection, statuses)
+            best = min(best, time.perf_counter() - start)
+        report.append({
+            "sessions": count,
+            "projection_bytes": sum(a.nbytes for a in vars(projection).values()),
+            "seconds": round(best, 4),
+            "cohorts": len(analytics.retention),
+        })
+        print(f"{count:>10} sessions  {best:.3f} s", file=sys.stderr)
+
+    text = json.dumps(report, indent=2, ensure_ascii=False)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            f.write(text)
+    print(text)
+
+if __name__ == "__main__":
+    main()
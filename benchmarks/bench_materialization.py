@@ -0,0 +1,114 @@
+"""结果集物化基准测试：dict 游标 + pd.DataFrame(list of dict) vs 元组游标按列构建
+
+用 10 万行的 sessions 查询结果（与 show_sessions 相同的列）比较耗时和内存占用。
+
+用法:
+    python benchmarks/bench_materialization.py --rows 100000
+"""
+import argparse
+import json
+import os
+import random
+import sys
+import time
+from datetime import datetime, timedelta
+
+import pandas as pd
+from mysql.connector import FieldType
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from app import SESSION_STATUSES, fetch_dataframe  # noqa: E402
+
+DESCRIPTION = [
+    ("id", FieldType.LONG),
+    ("status", FieldType.STRING),
+    ("student_name", FieldType.BLOB),
+    ("tutor_name", FieldType.BLOB),
+    ("course", FieldType.VAR_STRING),
+    ("startTime", FieldType.TIMESTAMP),
+    ("endTime", FieldType.TIMESTAMP),
+    ("studentCompleted", FieldType.TINY),
+    ("tutorCompleted", FieldType.TINY),
+    ("createdAt", FieldType.TIMESTAMP),
+]
+
+class FakeCursor:
+    """模拟 mysql.connector 元组游标"""
+
+    def __init__(self, rows):
+        self.description = [(name, type_code, None, None, None, None, True, 0, 0)
+                            for name, type_code in DESCRIPTION]
+        self._rows = rows
+
+    def fetchall(self):
+        return self._rows
+
+def generate_rows(count, seed=42):
+    rng = random.Random(seed)
+    start = datetime(2024, 1, 1)
+    courses = [f"{dept} {num}" for dept in ("ECON", "CHEM", "MATH", "CMPSC", "PSTAT") for num in ("10A", "109A", "4B", "130A")]
+    rows = []
+    for session_id in range(1, count + 1):
+        begin = start + timedelta(minutes=30 * session_id)
+        rows.append((
+            session_id,
+            rng.choice(SESSION_STATUSES),
+            f"Student {rng.randint(1, 50000)}",
+            f"Tutor {rng.randint(1, 5000)}",
+            rng.choice(courses),
+            begin,
+            begin + timedelta(hours=1),
+            rng.randint(0, 1),
+            rng.randint(0, 1),
+            begin - timedelta(days=rng.randint(1, 14)),
+        ))
+    return rows
+
+def measure(fn, repeat):
+    best = float("inf")
+    result = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = fn()
+        best = min(best, time.perf_counter() - start)
+    return best, result
+
+def main():
+    parser = argparse.ArgumentParser(description="结果集物化基准测试")
+    parser.add_argument("--rows", type=int, default=100000)
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--output", help="结果写入 JSON 文件")
+    args = parser.parse_args()
+
+    rows = generate_rows(args.rows)
+    columns = [name for name, _ in DESCRIPTION]
+
+    def dict_path():
+        # 原实现：dictionary=True 游标为每行创建 dict，再由 pandas 推断类型
+        return pd.DataFrame([dict(zip(columns, row)) for row in rows])
+
+    def columnar_path():
+        return fetch_dataframe(FakeCursor(rows))
+
+    dict_seconds, dict_df = measure(dict_path, args.repeat)
+    columnar_seconds, columnar_df = measure(columnar_path, args.repeat)
+    dict_bytes = int(dict_df.memory_usage(deep=True).sum())
+    columnar_bytes = int(columnar_df.memory_usage(deep=True).sum())
+
+    report = {
+        "rows": args.rows,
+        "dict_rows": {"seconds": round(dict_seconds, 4), "bytes": dict_bytes},
+        "columnar": {"seconds": round(columnar_seconds, 4), "bytes": columnar_bytes},
+        "time_ratio": round(dict_seconds / columnar_seconds, 2),
+        "memory_ratio": round(dict_bytes / columnar_bytes, 2),
+        "dtypes": {name: str(dtype) for name, dtype in columnar_df.dtypes.items()},
+    }
+    text = json.dumps(report, indent=2, ensure_ascii=False)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            f.write(text)
+    print(text)
+
+if __name__ == "__main__":
+    main()
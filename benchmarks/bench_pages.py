@@ -0,0 +1,142 @@
+"""页面端到端基准测试（离线，连接本地合成数据库）
+
+先用 benchmarks/synthetic_data.py 生成数据，再逐个计时页面函数。
+Streamlit 以 bare 模式运行（不启动服务器，控件取默认值），数据库调用和数据处理都是真实的。
+
+用法:
+    DB_HOST=127.0.0.1 DB_PASSWORD=bench DB_NAME=unitutor_bench \\
+        python benchmarks/bench_pages.py --label 100k --output results/100k.json
+    python benchmarks/bench_pages.py --compare results/before.json results/after.json
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from synthetic_data import LOCAL_HOSTS
+
+def git_commit():
+    try:
+        return subprocess.check_output(["git", "rev-parse", "--short", "HEAD"], cwd=ROOT, text=True).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+def load_app(allow_remote=False):
+    # 默认连接本地基准库；会执行迁移，环境变量指向其他主机时拒绝运行，避免误连生产数据库
+    os.environ.setdefault("DB_HOST", "127.0.0.1")
+    os.environ.setdefault("DB_PORT", "3306")
+    os.environ.setdefault("DB_NAME", "unitutor_bench")
+    host = os.environ["DB_HOST"]
+    if host not in LOCAL_HOSTS and not allow_remote:
+        sys.exit(f"❌ 拒绝在非本地数据库 {host} 上执行迁移和基准测试（如确认请加 --allow-remote）")
+    import app
+    return app
+
+def busiest_user(app):
+    rows = app.execute_query("""
+        SELECT tutorId as id FROM sessions GROUP BY tutorId ORDER BY COUNT(*) DESC LIMIT 1
+    """, use_cache=False)
+    return int(rows['id'].iloc[0]) if not rows.empty else 1
+
+def page_functions(app):
+    user_id = busiest_user(app)
+    return {
+        "show_dashboard": app.show_dashboard,
+        "show_users": app.show_users,
+        "show_user_detail": lambda: app.show_user_detail(user_id),
+        "show_sessions": app.show_sessions,
+        "show_support_tickets": app.show_support_tickets,
+        "show_ratings": app.show_ratings,
+        "show_admin_rating": app.show_admin_rating,
+        # 片段内的控件交互只重跑片段本身；与同名页面的整页数据对比即为每次交互的查询数变化
+        "tickets/reply_fragment": app.ticket_reply_fragment,
+        "admin_rating/form_fragment": app.admin_rating_form_fragment,
+    }
+
+def run_page(app, fn):
+    """在一次“渲染”范围内执行页面，返回 (秒, 数据库调用次数)"""
+    tracer = app.get_query_tracer()
+    tracer.clear()
+    start = time.perf_counter()
+    with app.request_connection_scope():
+        fn()
+    elapsed = time.perf_counter() - start
+    queries = sum(1 for sample in tracer.samples() if not sample.cached)
+    return elapsed, queries
+
+def benchmark(app, repeat):
+    results = {}
+    for name, fn in page_functions(app).items():
+        app.get_query_cache().clear()
+        cold_seconds, cold_queries = run_page(app, fn)
+        warm = [run_page(app, fn) for _ in range(repeat)]
+        uncached = []
+        for _ in range(repeat):
+            app.get_query_cache().clear()
+            uncached.append(run_page(app, fn)[0])
+        results[name] = {
+            "cold_ms": round(cold_seconds * 1000, 2),
+            "cold_queries": cold_queries,
+            "uncached_median_ms": round(statistics.median(uncached) * 1000, 2),
+            "warm_median_ms": round(statistics.median(seconds for seconds, _ in warm) * 1000, 2),
+            "warm_queries": max(queries for _, queries in warm),
+        }
+        print(f"{name:<28} cold {results[name]['cold_ms']:>10.1f} ms  "
+              f"uncached {results[name]['uncached_median_ms']:>10.1f} ms  "
+              f"warm {results[name]['warm_median_ms']:>8.1f} ms  "
+              f"queries {cold_queries}", file=sys.stderr)
+    return results
+
+def compare(base_path, new_path):
+    with open(base_path, encoding="utf-8") as f:
+        base = json.load(f)
+    with open(new_path, encoding="utf-8") as f:
+        new = json.load(f)
+    print(f"{'page':<24}{'metric':<22}{base.get('commit') or 'base':>12}{new.get('commit') or 'new':>12}{'ratio':>8}")
+    for page, metrics in new["pages"].items():
+        old_metrics = base["pages"].get(page, {})
+        for metric in ("cold_ms", "uncached_median_ms", "warm_median_ms", "cold_queries"):
+            old, cur = old_metrics.get(metric), metrics.get(metric)
+            ratio = f"{cur / old:.2f}x" if old else "-"
+            print(f"{page:<24}{metric:<22}{old if old is not None else '-':>12}{cur:>12}{ratio:>8}")
+
+def main():
+    parser = argparse.ArgumentParser(description="页面端到端基准测试")
+    parser.add_argument("--label", default="local", help="数据规模标签（如 10k / 100k / 1m）")
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--output", help="结果写入 JSON 文件")
+    parser.add_argument("--compare", nargs=2, metavar=("BASE", "NEW"), help="比较两次结果")
+    parser.add_argument("--allow-remote", action="store_true", help="允许连接非本地数据库")
+    args = parser.parse_args()
+
+    if args.compare:
+        compare(*args.compare)
+        return
+
+    app = load_app(args.allow_remote)
+    # 与线上一致：先补齐迁移中的表和索引
+    _, skipped = app.apply_migrations()
+    if skipped:
+        print(f"⚠️ 表不存在，跳过迁移版本 {skipped}", file=sys.stderr)
+    report = {
+        "commit": git_commit(),
+        "label": args.label,
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "repeat": args.repeat,
+        "pages": benchmark(app, args.repeat),
+    }
+    text = json.dumps(report, indent=2, ensure_ascii=False)
+    if args.output:
+        os.makedirs(os.path.dirname(os.path.abspath(args.output)), exist_ok=True)
+        with open(args.output, "w", encoding="utf-8") as f:
+            f.write(text)
+    print(text)
+
+if __name__ == "__main__":
+    main()
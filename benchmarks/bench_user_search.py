@@ -0,0 +1,93 @@
+"""用户搜索基准测试：三元组索引 vs LIKE '%keyword%' 全表扫描
+
+LIKE 路径用内存中的逐行子串匹配模拟（与 MySQL 对前置通配符 LIKE 的全表扫描等价，
+不含网络和磁盘开销，因此对 LIKE 路径是偏乐观的下界）。
+
+用法:
+    python benchmarks/bench_user_search.py --sizes 100000 1000000
+"""
+import argparse
+import json
+import os
+import random
+import string
+import sys
+import time
+from datetime import datetime, timedelta
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from app import UserSearchIndex  # noqa: E402
+
+FIRST_NAMES = ["Alice", "Bob", "Chen", "David", "Emma", "Fang", "Grace", "Hao", "Ivy", "Jun",
+               "Kevin", "Lin", "Mia", "Noah", "Olivia", "Peng", "Qi", "Ryan", "Sofia", "Tao"]
+LAST_NAMES = ["Wang", "Li", "Zhang", "Liu", "Smith", "Johnson", "Brown", "Garcia", "Kim", "Nguyen"]
+DOMAINS = ["ucsb.edu", "gmail.com", "outlook.com", "qq.com", "163.com"]
+
+def generate_users(count, seed=42):
+    """生成 (id, name, email, preferredRoles, updatedAt) 行，按 (updatedAt, id) 排序"""
+    rng = random.Random(seed)
+    start = datetime(2024, 1, 1)
+    rows = []
+    for user_id in range(1, count + 1):
+        first = rng.choice(FIRST_NAMES)
+        last = rng.choice(LAST_NAMES)
+        suffix = "".join(rng.choices(string.ascii_lowercase + string.digits, k=4))
+        name = f"{first} {last}"
+        email = f"{first.lower()}.{last.lower()}{suffix}@{rng.choice(DOMAINS)}"
+        role = rng.choice(["student", "tutor", "both"])
+        rows.append((user_id, name, email, role, start + timedelta(seconds=user_id)))
+    return rows
+
+def like_scan(texts, query, limit):
+    """模拟 name LIKE %q% OR email LIKE %q% 的全表扫描"""
+    q = query.lower()
+    return [uid for uid, text in texts if q in text][:limit]
+
+def time_call(fn, repeat):
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        best = min(best, time.perf_counter() - start)
+    return best
+
+def run(size, queries, repeat, seed):
+    rows = generate_users(size, seed)
+    texts = [(uid, f"{name}\n{email}".lower()) for uid, name, email, _, _ in rows]
+
+    index = UserSearchIndex()
+    start = time.perf_counter()
+    index.add_rows(rows)
+    build_seconds = time.perf_counter() - start
+
+    results = {"size": size, "build_seconds": round(build_seconds, 4), "queries": []}
+    for query in queries:
+        index_seconds = time_call(lambda: index.search(query, limit=100), repeat)
+        like_seconds = time_call(lambda: like_scan(texts, query, limit=100), repeat)
+        results["queries"].append({
+            "query": query,
+            "index_ms": round(index_seconds * 1000, 3),
+            "like_scan_ms": round(like_seconds * 1000, 3),
+            "speedup": round(like_seconds / index_seconds, 1) if index_seconds else None,
+        })
+    return results
+
+def main():
+    parser = argparse.ArgumentParser(description="用户搜索基准测试")
+    parser.add_argument("--sizes", type=int, nargs="+", default=[100000, 1000000])
+    parser.add_argument("--queries", nargs="+", default=["wang", "alice.kim", "ucsb", "zzqx", "grce"])
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--output", help="结果写入 JSON 文件")
+    args = parser.parse_args()
+
+    report = [run(size, args.queries, args.repeat, args.seed) for size in args.sizes]
+    text = json.dumps(report, indent=2, ensure_ascii=False)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            f.write(text)
+    print(text)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,300 @@
+"""生成可复现的合成数据，写入本地 MySQL 兼容数据库，用于离线基准测试
+
+表结构与 DATABASE_SCHEMA.md 一致（users, profiles, sessions, ratings, tickets,
+adminRatings, chatMessages）。规模档位按会话数划分：10k / 100k / 1m。
+
+⚠️ 会删除并重建目标库中的上述表，默认只允许连接本地数据库。
+
+用法:
+    docker run -d -p 3306:3306 -e MYSQL_ROOT_PASSWORD=bench -e MYSQL_DATABASE=unitutor_bench mysql:8
+    DB_HOST=127.0.0.1 DB_PORT=3306 DB_PASSWORD=bench DB_NAME=unitutor_bench \
+        python benchmarks/synthetic_data.py --tier 100k
+"""
+import argparse
+import json
+import os
+import random
+import sys
+import time
+from datetime import datetime, timedelta
+
+import mysql.connector
+
+TIERS = {"10k": 10_000, "100k": 100_000, "1m": 1_000_000}
+LOCAL_HOSTS = {"localhost", "127.0.0.1", "::1"}
+
+SESSION_STATUS_WEIGHTS = {
+    "PENDING": 8, "CONFIRMED": 12, "PENDING_RATING": 6,
+    "DISPUTED": 1, "CLOSED": 60, "CANCELLED": 13,
+}
+TICKET_CATEGORIES = ["account", "matching", "cancellation", "ratings", "rules", "technical"]
+TICKET_STATUSES = ["pending", "in_progress", "resolved"]
+MAJORS = ["Economics", "Chemistry", "Computer Science", "Mathematics", "Psychology", "Statistics"]
+YEARS = ["Freshman", "Sophomore", "Junior", "Senior", "Graduate"]
+COURSES = [f"{dept} {num}" for dept in ("ECON", "CHEM", "MATH", "CMPSC", "PSTAT", "PSY")
+           for num in ("1", "3A", "10A", "100B", "109A", "120A", "130A", "160")]
+FIRST_NAMES = ["Alice", "Bob", "Chen", "David", "Emma", "Fang", "Grace", "Hao", "Ivy", "Jun",
+               "Kevin", "Lin", "Mia", "Noah", "Olivia", "Peng", "Qi", "Ryan", "Sofia", "Tao"]
+LAST_NAMES = ["Wang", "Li", "Zhang", "Liu", "Smith", "Johnson", "Brown", "Garcia", "Kim", "Nguyen"]
+
+SCHEMA = [
+    "DROP TABLE IF EXISTS schema_migrations, chatMessages, adminRatings, tickets, ratings, sessions, profiles, users",
+    """
+    CREATE TABLE users (
+        id INT AUTO_INCREMENT PRIMARY KEY,
+        openId VARCHAR(64) NOT NULL UNIQUE,
+        name TEXT,
+        email VARCHAR(320),
+        loginMethod VARCHAR(64),
+        role ENUM('user', 'admin') NOT NULL DEFAULT 'user',
+        preferredRoles VARCHAR(20),
+        createdAt TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP,
+        updatedAt TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP ON UPDATE CURRENT_TIMESTAMP,
+        lastSignedIn TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP
+    ) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4
+    """,
+    """
+    CREATE TABLE profiles (
+        id INT AUTO_INCREMENT PRIMARY KEY,
+        userId INT NOT NULL,
+        userRole ENUM('student', 'tutor') NOT NULL,
+        age INT,
+        year VARCHAR(50),
+        major VARCHAR(255),
+        bio TEXT,
+        priceMin INT,
+        priceMax INT,
+        courses JSON,
+        availability JSON,
+        creditPoints INT NOT NULL DEFAULT 0,
+        contactInfo TEXT,
+        createdAt TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP,
+        updatedAt TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP ON UPDATE CURRENT_TIMESTAMP
+    ) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4
+    """,
+    """
+    CREATE TABLE sessions (
+        id INT AUTO_INCREMENT PRIMARY KEY,
+        studentId INT NOT NULL,
+        tutorId INT NOT NULL,
+        course VARCHAR(255),
+        startTime TIMESTAMP NULL,
+        endTime TIMESTAMP NULL,
+        status ENUM('PENDING', 'CONFIRMED', 'PENDING_RATING', 'DISPUTED', 'CLOSED', 'CANCELLED')
+            NOT NULL DEFAULT 'PENDING',
+        studentCompleted BOOLEAN NOT NULL DEFAULT FALSE,
+        tutorCompleted BOOLEAN NOT NULL DEFAULT FALSE,
+        studentRated BOOLEAN NOT NULL DEFAULT FALSE,
+        tutorRated BOOLEAN NOT NULL DEFAULT FALSE,
+        cancelled BOOLEAN NOT NULL DEFAULT FALSE,
+        cancelledBy INT,
+        cancelReason TEXT,
+        cancellationRated BOOLEAN NOT NULL DEFAULT FALSE,
+        createdAt TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP,
+        updatedAt TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP ON UPDATE CURRENT_TIMESTAMP
+    ) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4
+    """,
+    """
+    CREATE TABLE ratings (
+        id INT AUTO_INCREMENT PRIMARY KEY,
+        sessionId INT NOT NULL,
+        raterId INT NOT NULL,
+        targetId INT NOT NULL,
+        score INT NOT NULL,
+        comment TEXT,
+        visibility ENUM('public', 'private') NOT NULL DEFAULT 'public',
+        createdAt TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP
+    ) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4
+    """,
+    """
+    CREATE TABLE tickets (
+        id INT AUTO_INCREMENT PRIMARY KEY,
+        userId INT NOT NULL,
+        category ENUM('account', 'matching', 'cancellation', 'ratings', 'rules', 'technical') NOT NULL,
+        subject VARCHAR(255) NOT NULL,
+        message TEXT NOT NULL,
+        status ENUM('pending', 'in_progress', 'resolved') NOT NULL DEFAULT 'pending',
+        adminResponse TEXT,
+        createdAt TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP,
+        updatedAt TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP ON UPDATE CURRENT_TIMESTAMP
+    ) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4
+    """,
+    """
+    CREATE TABLE adminRatings (
+        id INT AUTO_INCREMENT PRIMARY KEY,
+        targetUserId INT NOT NULL,
+        score INT NOT NULL,
+        comment TEXT,
+        createdAt TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+        updatedAt TIMESTAMP DEFAULT CURRENT_TIMESTAMP ON UPDATE CURRENT_TIMESTAMP,
+        UNIQUE KEY unique_target (targetUserId)
+    ) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4
+    """,
+    """
+    CREATE TABLE chatMessages (
+        id INT AUTO_INCREMENT PRIMARY KEY,
+        sessionId INT NOT NULL,
+        senderId INT NOT NULL,
+        message TEXT NOT NULL,
+        sanitized BOOLEAN NOT NULL DEFAULT FALSE,
+        createdAt TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP
+    ) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4
+    """,
+]
+
+def connect():
+    return mysql.connector.connect(
+        host=os.getenv("DB_HOST", "127.0.0.1"),
+        port=int(os.getenv("DB_PORT", "3306")),
+        user=os.getenv("DB_USER", "root"),
+        password=os.getenv("DB_PASSWORD", ""),
+        database=os.getenv("DB_NAME", "unitutor_bench"),
+    )
+
+def insert_rows(conn, table, columns, rows, chunk_size=5000):
+    """分块 executemany 批量插入"""
+    placeholders = ", ".join(["%s"] * len(columns))
+    query = f"INSERT INTO {table} ({', '.join(columns)}) VALUES ({placeholders})"
+    cursor = conn.cursor()
+    for start in range(0, len(rows), chunk_size):
+        cursor.executemany(query, rows[start:start + chunk_size])
+        conn.commit()
+    cursor.close()
+
+def generate(conn, sessions_count, seed=42, messages_per_session=3, now=None):
+    """生成一个规模档位的数据，返回各表行数"""
+    rng = random.Random(seed)
+    now = now or datetime(2026, 1, 1)
+    start = now - timedelta(days=365)
+    users_count = max(100, sessions_count // 10)
+    tutors_count = max(10, users_count // 8)
+
+    def random_time(begin=start, end=now):
+        return begin + timedelta(seconds=rng.randint(0, int((end - begin).total_seconds())))
+
+    # users：前 tutors_count 个用户是教师
+    users = []
+    for user_id in range(1, users_count + 1):
+        first, last = rng.choice(FIRST_NAMES), rng.choice(LAST_NAMES)
+        created = random_time()
+        role = "tutor" if user_id <= tutors_count else rng.choice(["student"] * 9 + ["both"])
+        users.append((
+            f"open_{user_id}", f"{first} {last}",
+            f"{first.lower()}.{last.lower()}{user_id}@ucsb.edu", "google", "user", role,
+            created, random_time(created), random_time(created),
+        ))
+    insert_rows(conn, "users", ["openId", "name", "email", "loginMethod", "role", "preferredRoles",
+                                "createdAt", "updatedAt", "lastSignedIn"], users)
+
+    profiles = []
+    for user_id, user in enumerate(users, start=1):
+        roles = {"tutor": ["tutor"], "student": ["student"], "both": ["student", "tutor"]}[user[5]]
+        for user_role in roles:
+            courses = rng.sample(COURSES, rng.randint(1, 4))
+            price_min = rng.randint(15, 40) if user_role == "tutor" else None
+            profiles.append((
+                user_id, user_role, rng.randint(18, 30), rng.choice(YEARS), rng.choice(MAJORS),
+                f"Hi, I'm {user[1]}", price_min, price_min + rng.randint(5, 30) if price_min else None,
+                json.dumps(courses), rng.randint(0, 500), user[6], user[7],
+            ))
+    insert_rows(conn, "profiles", ["userId", "userRole", "age", "year", "major", "bio", "priceMin",
+                                   "priceMax", "courses", "creditPoints", "createdAt", "updatedAt"], profiles)
+
+    statuses = list(SESSION_STATUS_WEIGHTS)
+    weights = list(SESSION_STATUS_WEIGHTS.values())
+    session_columns = ["studentId", "tutorId", "course", "startTime", "endTime", "status",
+                       "studentCompleted", "tutorCompleted", "studentRated", "tutorRated",
+                       "cancelled", "cancelledBy", "cancelReason", "createdAt", "updatedAt"]
+    rating_columns = ["sessionId", "raterId", "targetId", "score", "comment", "visibility", "createdAt"]
+    message_columns = ["sessionId", "senderId", "message", "createdAt"]
+    sessions, ratings, messages = [], [], []
+    ratings_total = 0
+
+    def flush():
+        # 按会话 id 顺序插入，AUTO_INCREMENT 与生成时的 session_id 一致
+        insert_rows(conn, "sessions", session_columns, sessions)
+        insert_rows(conn, "ratings", rating_columns, ratings)
+        insert_rows(conn, "chatMessages", message_columns, messages)
+        sessions.clear()
+        ratings.clear()
+        messages.clear()
+
+    for session_id in range(1, sessions_count + 1):
+        student_id = rng.randint(tutors_count + 1, users_count)
+        tutor_id = rng.randint(1, tutors_count)
+        course = rng.choice(COURSES)
+        created = random_time()
+        begin = created + timedelta(days=rng.randint(1, 14), hours=rng.randint(8, 20))
+        status = rng.choices(statuses, weights)[0]
+        done = status in ("PENDING_RATING", "CLOSED", "DISPUTED")
+        sessions.append((
+            student_id, tutor_id, course, begin, begin + timedelta(hours=1), status,
+            done, done, status == "CLOSED", status == "CLOSED", status == "CANCELLED",
+            student_id if status == "CANCELLED" else None,
+            "Schedule conflict" if status == "CANCELLED" else None,
+            created, min(begin + timedelta(hours=2), now),
+        ))
+        if status == "CLOSED":
+            rated_at = min(begin + timedelta(hours=3), now)
+            ratings.append((session_id, student_id, tutor_id, rng.choices([1, 2, 3, 4, 5], [1, 1, 3, 8, 12])[0],
+                            "Great session", "public", rated_at))
+            ratings.append((session_id, tutor_id, student_id, rng.choices([3, 4, 5], [1, 3, 6])[0],
+                            None, "private", rated_at))
+            ratings_total += 2
+        for offset in range(messages_per_session):
+            sender = student_id if offset % 2 == 0 else tutor_id
+            messages.append((session_id, sender, f"message {offset} about {course}",
+                             created + timedelta(minutes=offset)))
+        if len(sessions) >= 50000:
+            flush()
+    flush()
+
+    tickets = []
+    for _ in range(max(10, users_count // 20)):
+        created = random_time()
+        status = rng.choice(TICKET_STATUSES)
+        tickets.append((
+            rng.randint(1, users_count), rng.choice(TICKET_CATEGORIES), "Need help",
+            "Please help me with my account", status,
+            "Handled" if status == "resolved" else None, created, random_time(created),
+        ))
+    insert_rows(conn, "tickets", ["userId", "category", "subject", "message", "status", "adminResponse",
+                                  "createdAt", "updatedAt"], tickets)
+
+    admin_ratings = [(tutor_id, rng.randint(2, 5), "Reviewed", now, now)
+                     for tutor_id in rng.sample(range(1, tutors_count + 1), tutors_count // 3)]
+    insert_rows(conn, "adminRatings", ["targetUserId", "score", "comment", "createdAt", "updatedAt"],
+                admin_ratings)
+
+    return {
+        "users": len(users), "profiles": len(profiles), "sessions": sessions_count,
+        "ratings": ratings_total, "tickets": len(tickets), "adminRatings": len(admin_ratings),
+        "chatMessages": sessions_count * messages_per_session,
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description="生成合成基准数据")
+    parser.add_argument("--tier", choices=list(TIERS), default="10k")
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--messages-per-session", type=int, default=3)
+    parser.add_argument("--allow-remote", action="store_true", help="允许写入非本地数据库")
+    args = parser.parse_args()
+
+    host = os.getenv("DB_HOST", "127.0.0.1")
+    if host not in LOCAL_HOSTS and not args.allow_remote:
+        sys.exit(f"❌ 拒绝在非本地数据库 {host} 上重建表（如确认请加 --allow-remote）")
+
+    conn = connect()
+    cursor = conn.cursor()
+    for statement in SCHEMA:
+        cursor.execute(statement)
+    cursor.close()
+
+    started = time.perf_counter()
+    counts = generate(conn, TIERS[args.tier], seed=args.seed, messages_per_session=args.messages_per_session)
+    conn.close()
+    print(json.dumps({"tier": args.tier, "seconds": round(time.perf_counter() - started, 1), "rows": counts},
+                     indent=2))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,34 @@
+"""命令行数据导出
+
+用法:
+    python export_data.py sessions --format parquet --output sessions.parquet
+    python export_data.py tickets --format csv
+"""
+import argparse
+import sys
+
+from app import EXPORT_CHUNK_SIZE, EXPORT_FORMATS, EXPORTS, export_table
+
+def main():
+    parser = argparse.ArgumentParser(description="流式导出 UniTutor 数据")
+    parser.add_argument("table", choices=list(EXPORTS))
+    parser.add_argument("--format", choices=EXPORT_FORMATS, default="csv")
+    parser.add_argument("--output", help="输出文件路径（默认为 <table>.<format>）")
+    parser.add_argument("--chunk-size", type=int, default=EXPORT_CHUNK_SIZE)
+    args = parser.parse_args()
+
+    output = args.output or f"{args.table}.{args.format}"
+
+    def progress(done, total):
+        percent = done / total * 100 if total else 100
+        print(f"\r已导出 {done:,} / {total:,} 行 ({percent:.1f}%)", end="", file=sys.stderr, flush=True)
+
+    try:
+        rows = export_table(args.table, args.format, output, chunk_size=args.chunk_size, progress=progress)
+    except Exception as e:
+        # export_table 已删除写了一半的文件
+        sys.exit(f"\n❌ 导出失败: {e}")
+    print(f"\n✅ 导出完成: {output}（{rows:,} 行）", file=sys.stderr)
+
+if __name__ == "__main__":
+    main()
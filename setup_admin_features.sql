@@ -1,5 +1,5 @@
 -- UniTutor 管理员功能 - 数据库设置脚本
--- 运行此脚本以手动创建管理员评分表（可选，应用会自动创建）
+-- 运行此脚本以手动创建管理员评分表（可选，应用启动时会通过 app.py 中的 MIGRATIONS 自动创建表和索引）
 
 -- 1. 创建管理员评分表
 CREATE TABLE IF NOT EXISTS adminRatings (
@@ -0,0 +1,74 @@
+"""留存分析：compute_cohort_analytics 与 pandas 分组的暴力算法一致（不连接数据库）"""
+import os
+import sys
+
+import numpy as np
+import pandas as pd
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+import app
+
+def random_projection(seed, count=3000):
+    rng = np.random.default_rng(seed)
+    return app.SessionProjection(
+        student=rng.integers(1, 400, count).astype(np.int32),
+        tutor=(rng.integers(0, 60, count) * (rng.random(count) > 0.1)).astype(np.int32),
+        day=rng.integers(20000, 20200, count).astype(np.int32),
+        status=rng.integers(-1, len(app.SESSION_STATUSES), count).astype(np.int8),
+    )
+
+def brute_force(projection, statuses, max_offset):
+    frame = pd.DataFrame({
+        "student": projection.student, "tutor": projection.tutor,
+        "week": projection.day // 7, "status": projection.status,
+    })
+    frame = frame[frame["status"].isin([app.SESSION_STATUSES.index(s) for s in statuses])].copy()
+    frame["week"] -= frame["week"].min()
+    n_weeks = int(frame["week"].max()) + 1
+    frame["cohort"] = frame.groupby("student")["week"].transform("min")
+    frame["offset"] = frame["week"] - frame["cohort"]
+    
+    active = frame[frame["offset"] <= max_offset].drop_duplicates(["student", "week"])
+    counts = np.zeros((n_weeks, max_offset + 1), dtype=np.int64)
+    for (cohort, offset), students in active.groupby(["cohort", "offset"])["student"].nunique().items():
+        counts[cohort, offset] = students
+    
+    per_student = frame.groupby("student").agg(cohort=("cohort", "first"), bookings=("week", "size"))
+    repeat = (per_student["bookings"] >= 2).groupby(per_student["cohort"]).sum()
+    
+    tutors = frame[frame["tutor"] > 0]
+    first_tutor_week = tutors.groupby("tutor")["week"].min()
+    supply = pd.DataFrame({
+        "sessions": frame.groupby("week").size(),
+        "active_tutors": tutors.groupby("week")["tutor"].nunique(),
+        "new_tutors": first_tutor_week.value_counts(),
+    }).reindex(range(n_weeks)).fillna(0).astype(np.int64)
+    return counts, repeat, supply
+
+def test_matches_pandas_brute_force():
+    statuses = ["PENDING", "CONFIRMED", "CLOSED"]
+    for seed in range(5):
+        projection = random_projection(seed)
+        result = app.compute_cohort_analytics(projection, statuses, max_offset=6)
+        counts, repeat, supply = brute_force(projection, statuses, max_offset=6)
+        
+        cohorts = counts[:, 0] > 0
+        assert np.array_equal(result.counts.to_numpy(), counts[cohorts])
+        assert np.array_equal(result.repeat["repeat_students"].to_numpy(), repeat.to_numpy())
+        assert np.array_equal(result.repeat["cohort_size"].to_numpy(), counts[cohorts, 0])
+        for column in ["sessions", "active_tutors", "new_tutors"]:
+            assert np.array_equal(result.supply[column].to_numpy(), supply[column].to_numpy())
+        
+        # 尚未到达的周为 NaN，其余为 counts / 群组人数
+        n_weeks = len(counts)
+        weeks = np.flatnonzero(cohorts)
+        observable = weeks[:, None] + np.arange(7)[None, :] < n_weeks
+        expected = np.where(observable, counts[cohorts] / counts[cohorts, :1], np.nan)
+        assert np.allclose(result.retention.to_numpy(), expected, equal_nan=True)
+
+def test_no_matching_sessions_returns_none():
+    projection = random_projection(0, count=50)
+    projection.status[:] = -1
+    assert app.compute_cohort_analytics(projection, ["CLOSED"]) is None
@@ -0,0 +1,39 @@
+"""流式导出：失败时删除写了一半的文件（不连接数据库）"""
+import os
+import sys
+from contextlib import contextmanager
+
+import pandas as pd
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+import app
+
+class FailingCursor:
+    description = [("id", None), ("status", None)]
+
+    def __init__(self):
+        self.calls = 0
+
+    def fetchmany(self, size):
+        self.calls += 1
+        if self.calls > 1:
+            raise OSError(28, "No space left on device")
+        return [(1, "CLOSED"), (2, "PENDING")]
+
+def patch_database(monkeypatch):
+    monkeypatch.setattr(app, "execute_query", lambda *args, **kwargs: pd.DataFrame({"count": [4]}))
+
+    @contextmanager
+    def cursor(query, params=None):
+        yield FailingCursor()
+    monkeypatch.setattr(app, "streaming_cursor", cursor)
+
+def test_failed_export_removes_partial_file(monkeypatch, tmp_path):
+    patch_database(monkeypatch)
+    output = tmp_path / "sessions.csv"
+    with pytest.raises(OSError):
+        app.export_table("sessions", "csv", str(output), chunk_size=2)
+    assert not output.exists()
@@ -0,0 +1,53 @@
+"""重复预约检测：find_overlaps 与逐对比较的暴力算法一致（不连接数据库）"""
+import os
+import sys
+
+import numpy as np
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+import app
+
+def brute_force(ids, users, starts, ends):
+    """同一用户按开始时间排序，与之前结束最晚的会话（并列取靠后的）重叠即为冲突"""
+    found = set()
+    for user in set(users.tolist()):
+        if user <= 0:
+            continue
+        rows = [i for i in range(len(ids)) if users[i] == user and ends[i] > starts[i]]
+        rows.sort(key=lambda i: starts[i])
+        for position, i in enumerate(rows):
+            earlier = rows[:position]
+            if not earlier:
+                continue
+            latest_end = max(ends[j] for j in earlier)
+            if starts[i] < latest_end:
+                holder = [j for j in earlier if ends[j] == latest_end][-1]
+                found.add((int(ids[i]), int(ids[holder]), int(user)))
+    return found
+
+def random_sessions(rng, count):
+    ids = rng.permutation(np.arange(1, count + 1)).astype(np.int64)
+    users = rng.integers(0, 6, count).astype(np.int64)  # 0 表示没有教师 / 学生
+    starts = rng.integers(0, 50, count).astype(np.int64)
+    ends = starts + rng.integers(-2, 12, count)  # 包含时长为 0 或负数的无效会话
+    return ids, users, starts, ends
+
+def test_matches_brute_force_on_random_trials():
+    rng = np.random.default_rng(17)
+    mismatches = 0
+    for _ in range(300):
+        arrays = random_sessions(rng, int(rng.integers(0, 40)))
+        session_ids, other_ids, user_ids = app.find_overlaps(*arrays)
+        found = set(zip(session_ids.tolist(), other_ids.tolist(), user_ids.tolist()))
+        mismatches += found != brute_force(*arrays)
+    assert mismatches == 0
+
+def test_back_to_back_sessions_do_not_conflict():
+    ids = np.array([1, 2, 3], dtype=np.int64)
+    users = np.array([7, 7, 7], dtype=np.int64)
+    starts = np.array([0, 10, 15], dtype=np.int64)
+    ends = np.array([10, 20, 18], dtype=np.int64)
+    session_ids, other_ids, user_ids = app.find_overlaps(ids, users, starts, ends)
+    assert list(zip(session_ids, other_ids, user_ids)) == [(3, 2, 7)]
@@ -0,0 +1,61 @@
+"""索引建议：执行计划解析（使用真实的 EXPLAIN FORMAT=JSON 输出，不连接数据库）"""
+import json
+import os
+import sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+import app
+
+FIXTURES = os.path.join(os.path.dirname(os.path.abspath(__file__)), "fixtures")
+
+QUERY = """
+    SELECT s.id, s.course, u.name as tutor_name
+    FROM sessions s
+    JOIN users u ON s.tutorId = u.id
+    WHERE DATE(s.createdAt) = %s AND s.status = 'COMPLETED'
+    ORDER BY s.createdAt DESC
+"""
+
+def load_plan(name):
+    with open(os.path.join(FIXTURES, name), encoding="utf-8") as f:
+        return json.load(f)
+
+def test_schema_qualified_function_wrap_is_flagged():
+    plan = load_plan("explain_sessions_by_day.json")
+    nodes = {node["table_name"]: node for _, node in app._plan_nodes(plan)}
+    equality, ranges, problems = app.condition_columns(nodes["s"]["attached_condition"], "s")
+    assert equality == ["status"]
+    assert ranges == []
+    assert any("createdAt" in problem and "cast()" in problem for problem in problems)
+
+def test_plan_nodes_mark_filesort_driving_table():
+    plan = load_plan("explain_sessions_by_day.json")
+    blocks = {node["table_name"]: block for block, node in app._plan_nodes(plan)}
+    assert blocks["s"]["filesort"]
+    assert blocks["s"]["first"] == "s"
+
+def test_advise_statement_on_fixture(monkeypatch):
+    monkeypatch.setattr(app, "explain_json", lambda query, params=None: load_plan("explain_sessions_by_day.json"))
+    entry = {"statement": app.normalize_sql(QUERY), "query": QUERY, "params": ("2024-03-01",),
+             "call_site": "test", "calls": 1}
+    findings = app.advise_statement(entry, indexes_for=lambda table: {"PRIMARY": ["id"]})
+    assert [finding["table"] for finding in findings] == ["sessions"]
+    finding = findings[0]
+    assert "全表扫描" in finding["problems"] and "cast()" in finding["problems"]
+    assert finding["suggestion"] == "CREATE INDEX idx_sessions_status_createdAt ON sessions(status, createdAt)"
+
+def test_order_by_skips_window_and_subquery():
+    query = """
+        SELECT s.id, ROW_NUMBER() OVER (PARTITION BY s.tutorId ORDER BY s.startTime) as rn
+        FROM sessions s
+        WHERE s.tutorId IN (SELECT id FROM users ORDER BY createdAt)
+        ORDER BY s.createdAt DESC, id
+        LIMIT 20
+    """
+    assert app.order_by_columns(query) == [("s", "createdAt"), (None, "id")]
+
+def test_order_by_absent_outside_window():
+    query = "SELECT id, RANK() OVER (ORDER BY score DESC) as r FROM ratings"
+    assert app.order_by_columns(query) == []
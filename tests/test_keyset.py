@@ -0,0 +1,51 @@
+"""keyset 分页：逐页拼接的结果与一次性排序一致，包括 NULL 排序值（用 SQLite 执行条件）"""
+import os
+import random
+import sqlite3
+import sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+import app
+
+def make_table(seed=3, count=200):
+    rng = random.Random(seed)
+    conn = sqlite3.connect(":memory:")
+    conn.execute("CREATE TABLE users (id INTEGER PRIMARY KEY, lastSignedIn INTEGER)")
+    conn.executemany("INSERT INTO users VALUES (?, ?)", [
+        (i, None if rng.random() < 0.2 else rng.randint(1, 30)) for i in range(1, count + 1)
+    ])
+    return conn
+
+def paginate(conn, descending, page_size=17):
+    """与 show_users 相同的翻页方式：条件 + ORDER BY sort_col, id 同方向"""
+    direction = "DESC" if descending else "ASC"
+    order = f" ORDER BY lastSignedIn {direction}, id {direction} LIMIT ?"
+    seen, cursor = [], None
+    while True:
+        if cursor is None:
+            query, params = "SELECT lastSignedIn, id FROM users", []
+        else:
+            condition, params = app.keyset_condition("lastSignedIn", "id", cursor, descending)
+            query = "SELECT lastSignedIn, id FROM users WHERE " + condition.replace("%s", "?")
+        rows = conn.execute(query + order, [*params, page_size]).fetchall()
+        seen.extend(rows)
+        if len(rows) < page_size:
+            return seen
+        cursor = rows[-1]
+
+def test_pages_match_full_ordering():
+    conn = make_table()
+    for descending in (True, False):
+        direction = "DESC" if descending else "ASC"
+        expected = conn.execute(
+            f"SELECT lastSignedIn, id FROM users ORDER BY lastSignedIn {direction}, id {direction}"
+        ).fetchall()
+        assert paginate(conn, descending) == expected
+
+def test_null_cursor_conditions():
+    condition, params = app.keyset_condition("c", "id", (None, 5), descending=True)
+    assert condition == "(c IS NULL AND id < %s)" and params == [5]
+    condition, params = app.keyset_condition("c", "id", (None, 5), descending=False)
+    assert condition == "((c IS NULL AND id > %s) OR c IS NOT NULL)" and params == [5]
@@ -0,0 +1,48 @@
+"""加权评分引擎：按 (updatedAt, id) 增量合并，评分修改时移出旧值（不连接数据库）"""
+import os
+import random
+import sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+import app
+
+def brute_force(ratings):
+    totals = {}
+    for target, score in ratings.values():
+        user_sum, user_count = totals.get(target, (0, 0))
+        totals[target] = (user_sum + score, user_count + 1)
+    return totals
+
+def test_edited_ratings_move_between_targets():
+    engine = app.RatingEngine()
+    engine.apply_ratings([(1, 10, 5, "t1"), (2, 10, 3, "t1"), (3, 20, 4, "t2")])
+    engine.apply_ratings([(2, 20, 1, "t3")])  # 评分 2 改为给 20 打 1 分
+    assert engine.ratings_watermark == ("t3", 2)
+    assert engine.get(10)['user_count'] == 1 and engine.get(10)['user_avg'] == 5
+    assert engine.get(20)['user_count'] == 2 and engine.get(20)['user_avg'] == 2.5
+
+def test_random_edits_match_brute_force():
+    rng = random.Random(7)
+    engine = app.RatingEngine()
+    ratings = {}
+    for step in range(50):
+        batch = {}
+        for _ in range(rng.randint(1, 20)):
+            batch[rng.randint(1, 300)] = (rng.randint(1, 30), rng.randint(1, 5))
+        ratings.update(batch)
+        engine.apply_ratings((rid, target, score, step) for rid, (target, score) in sorted(batch.items()))
+    frame = engine.snapshot()
+    expected = brute_force(ratings)
+    counted = frame[frame['user_count'] > 0]
+    assert set(counted.index) == set(expected)
+    for target, (user_sum, user_count) in expected.items():
+        assert (frame.loc[target, 'user_sum'], frame.loc[target, 'user_count']) == (user_sum, user_count)
+
+def test_admin_score_weighting_survives_rating_edits():
+    engine = app.RatingEngine()
+    engine.set_admin_score(10, 3)
+    engine.apply_ratings([(1, 10, 5, "t1")])
+    engine.apply_ratings([(1, 10, 1, "t2")])
+    assert engine.get(10)['final_score'] == 3 * app.ADMIN_RATING_WEIGHT + 1 * (1 - app.ADMIN_RATING_WEIGHT)
@@ -0,0 +1,86 @@
+"""评分图：互评刷分和评分者偏差检测（纯内存，不连接数据库）"""
+import os
+import sys
+
+import numpy as np
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+import app
+
+def session_ratings(sessions=10_000, users=1000, seed=7):
+    """与 benchmarks/synthetic_data.py 相同的形状：每个会话学生和教师互评一次，多为高分"""
+    rng = np.random.default_rng(seed)
+    students = rng.integers(1, users // 2, sessions)
+    tutors = rng.integers(users // 2, users + 1, sessions)
+    student_scores = rng.choice([1, 2, 3, 4, 5], sessions, p=[0.04, 0.04, 0.12, 0.32, 0.48])
+    tutor_scores = rng.choice([3, 4, 5], sessions, p=[0.1, 0.3, 0.6])
+    raters = np.concatenate([students, tutors])
+    targets = np.concatenate([tutors, students])
+    scores = np.concatenate([student_scores, tutor_scores])
+    # 第二条评分在同一会话中已有反向评分
+    paired = np.concatenate([np.zeros(sessions, dtype=np.int64), np.ones(sessions, dtype=np.int64)])
+    return raters.astype(np.int64), targets.astype(np.int64), scores.astype(np.int64), paired
+
+def build_graph(raters, targets, scores, paired, chunk_size=3000):
+    graph = app.RatingGraph()
+    for start in range(0, len(raters), chunk_size):
+        end = start + chunk_size
+        graph.add_chunk(raters[start:end], targets[start:end], scores[start:end], paired[start:end])
+    return graph
+
+def test_one_mutual_rating_per_session_is_not_flagged():
+    report = build_graph(*session_ratings()).analyze()
+    assert report.reciprocal.empty
+    assert report.cliques.empty
+    assert not any("互评高分" in reasons for reasons in report.flagged.values())
+
+def test_chunking_does_not_change_same_session_counts():
+    data = session_ratings(sessions=2000, users=100)
+    whole = build_graph(*data, chunk_size=len(data[0]))
+    chunked = build_graph(*data, chunk_size=997)
+    np.testing.assert_array_equal(whole.keys, chunked.keys)
+    np.testing.assert_array_equal(whole.stats, chunked.stats)
+
+def test_repeated_mutual_high_ratings_are_flagged():
+    raters, targets, scores, paired = session_ratings(sessions=2000, users=200)
+    ring = np.array([[5001, 5002], [5002, 5001]] * 4, dtype=np.int64)
+    graph = build_graph(
+        np.concatenate([raters, ring[:, 0]]),
+        np.concatenate([targets, ring[:, 1]]),
+        np.concatenate([scores, np.full(len(ring), 5, dtype=np.int64)]),
+        np.concatenate([paired, np.zeros(len(ring), dtype=np.int64)]),
+    )
+    report = graph.analyze()
+    assert report.reciprocal[['user_a', 'user_b']].values.tolist() == [[5001, 5002]]
+    assert "互评高分" in report.flagged[5001] and "互评高分" in report.flagged[5002]
+
+def with_extra(extra_raters, extra_targets, extra_scores):
+    raters, targets, scores, paired = session_ratings(sessions=4000, users=400)
+    extra = len(extra_scores)
+    return build_graph(
+        np.concatenate([raters, np.asarray(extra_raters, dtype=np.int64)]),
+        np.concatenate([targets, np.asarray(extra_targets, dtype=np.int64)]),
+        np.concatenate([scores, np.asarray(extra_scores, dtype=np.int64)]),
+        np.concatenate([paired, np.zeros(extra, dtype=np.int64)]),
+    ).analyze()
+
+def test_prolific_rater_with_small_bias_is_not_flagged():
+    rng = np.random.default_rng(1)
+    # 600 条评分，平均分只比全站低约 0.3
+    scores = rng.choice([3, 4, 5], 600, p=[0.25, 0.45, 0.3])
+    report = with_extra(np.full(600, 9001), rng.integers(1, 400, 600), scores)
+    assert 9001 not in report.flagged
+
+def test_harsh_rater_is_flagged():
+    report = with_extra(np.full(20, 9002), np.arange(1, 21), np.ones(20))
+    assert "评分偏离全站分布" in report.flagged[9002]
+
+def test_student_mostly_booking_one_tutor_is_not_flagged():
+    report = with_extra(np.full(12, 9003), [350] * 11 + [351], [4, 5, 4, 4, 5, 4, 3, 4, 5, 4, 4, 4])
+    assert 9003 not in report.flagged
+
+def test_focused_extreme_ratings_are_flagged():
+    report = with_extra(np.full(12, 9004), [352] * 11 + [353], [5] * 12)
+    assert "评分集中给同一用户" in report.flagged[9004]
@@ -0,0 +1,34 @@
+"""并发任务：连接池借用和池满时的串行退化（不连接数据库）"""
+import os
+import sys
+import threading
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+import app
+
+def run_with_pool(monkeypatch, pool, tasks):
+    monkeypatch.setattr(app, "init_connection_pool", lambda: pool)
+    return app.run_parallel(tasks)
+
+def test_full_pool_runs_tasks_on_caller_thread(monkeypatch):
+    pool = app.AdminConnectionPool({}, min_size=2, max_size=2)
+    caller = threading.current_thread()
+    results, errors = run_with_pool(monkeypatch, pool, {
+        "a": lambda: threading.current_thread() is caller,
+        "b": lambda: 1 / 0,
+    })
+    assert results == {"a": True}
+    assert "b" in errors
+    assert pool.limit == 2
+
+def test_burst_is_returned_after_the_group(monkeypatch):
+    pool = app.AdminConnectionPool({}, min_size=2, max_size=10)
+    seen = []
+    results, errors = run_with_pool(monkeypatch, pool, {
+        name: (lambda: seen.append(pool.limit) or threading.current_thread().name) for name in "abc"
+    })
+    assert not errors and len(results) == 3
+    assert seen and min(seen) == 5
+    assert pool.limit == 2
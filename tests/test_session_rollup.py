@@ -0,0 +1,40 @@
+"""会话日汇总：状态和日期变化时从旧桶移到新桶（不连接数据库）"""
+import os
+import sys
+from datetime import date, datetime
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+import app
+
+TODAY = date(2026, 3, 10)
+
+def status_totals(rollup):
+    counts = rollup.status_counts()
+    return dict(zip(counts['status'], counts['count']))
+
+def test_status_change_moves_session_between_buckets():
+    rollup = app.SessionRollup()
+    rollup.apply_rows([
+        (1, date(2026, 3, 9), "PENDING", "t1"),
+        (2, date(2026, 3, 9), "PENDING", "t1"),
+        (3, datetime(2026, 3, 10, 8, 30), "CONFIRMED", "t2"),
+    ])
+    assert status_totals(rollup) == {"PENDING": 2, "CONFIRMED": 1}
+    
+    rollup.apply_rows([(2, date(2026, 3, 9), "CLOSED", "t3"), (3, date(2026, 3, 10), "CONFIRMED", "t3")])
+    assert status_totals(rollup) == {"PENDING": 1, "CONFIRMED": 1, "CLOSED": 1}
+    assert rollup.watermark == ("t3", 3)
+    
+    daily = rollup.daily_counts(3, today=TODAY)
+    assert list(daily['date']) == [date(2026, 3, 8), date(2026, 3, 9), date(2026, 3, 10)]
+    assert list(daily['count']) == [0, 2, 1]
+
+def test_date_change_and_unknown_status():
+    rollup = app.SessionRollup()
+    rollup.apply_rows([(5, date(2026, 3, 1), "PENDING", "t1")])
+    rollup.apply_rows([(5, date(2026, 3, 10), "ARCHIVED", "t2"), (9, None, "PENDING", "t2")])
+    assert status_totals(rollup) == {"ARCHIVED": 1}
+    assert list(rollup.daily_counts(10, today=TODAY)['count']) == [0] * 9 + [1]
+    assert rollup.watermark == ("t2", 9)  # 没有日期的行不计入，但高水位照常推进
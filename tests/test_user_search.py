@@ -0,0 +1,40 @@
+"""用户搜索索引：角色筛选、截断和模糊匹配标记"""
+import os
+import sys
+from datetime import datetime, timedelta
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+import app
+
+def build_index(count=50):
+    index = app.UserSearchIndex()
+    start = datetime(2024, 1, 1)
+    # 新用户都是学生，唯一的教师 id 最小
+    index.add_rows(
+        (uid, f"Alice Wang {uid}", f"alice{uid}@ucsb.edu", "tutor" if uid == 1 else "student",
+         start + timedelta(seconds=uid))
+        for uid in range(1, count + 1)
+    )
+    return index
+
+def test_role_filter_applies_before_truncation():
+    result = build_index().search("alice", limit=10, role="tutor")
+    assert result.ids == [1]
+    assert result.total == 1 and not result.truncated
+
+def test_truncation_reports_total():
+    result = build_index().search("alice", limit=10)
+    assert len(result.ids) == 10 and result.total == 50
+    assert result.truncated and not result.fuzzy
+    assert result.ids == sorted(result.ids, reverse=True)
+
+def test_fuzzy_hits_are_marked():
+    result = build_index().search("alise wang", limit=10)
+    assert result.fuzzy and result.ids
+
+def test_role_change_is_picked_up():
+    index = build_index(5)
+    index.add_rows([(3, "Alice Wang 3", "alice3@ucsb.edu", "tutor", datetime(2024, 2, 1))])
+    assert index.search("alice", role="tutor").ids == [3, 1]